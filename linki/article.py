@@ -1,11 +1,14 @@
+from collections import OrderedDict
+from difflib import SequenceMatcher
 from functools import cached_property
 import pickle
-from typing import Iterator
+from threading import Lock
+from typing import Iterable, Iterator, Tuple
 
 import msgspec
-from linki.connection import Connection
+from linki.connection import Columns, Connection, encode_path
 
-from linki.id import ArticleID, BaseLabel
+from linki.id import ID, ArticleID, BaseLabel
 
 
 class BaseArticle(msgspec.Struct, dict=True, frozen=True, kw_only=True):
@@ -44,6 +47,214 @@ def Article(
     )
 
 
+Delta = Tuple[Tuple[int, int, str], ...]
+
+
+def get_delta(parent: str, content: str) -> Delta:
+    a = parent.splitlines(keepends=True)
+    b = content.splitlines(keepends=True)
+    matcher = SequenceMatcher(None, a, b, autojunk=False)
+    return tuple(
+        (i1, i2, ''.join(b[j1:j2]))
+        for (tag, i1, i2, j1, j2) in matcher.get_opcodes()
+        if tag != 'equal'
+    )
+
+
+def apply_delta(parent: str, delta: Delta) -> str:
+    a = parent.splitlines(keepends=True)
+    content = []
+    cursor = 0
+    for (i1, i2, text) in delta:
+        content.extend(a[cursor:i1])
+        content.append(text)
+        cursor = i2
+    content.extend(a[cursor:])
+    return ''.join(content)
+
+
+class ArticleRecord(msgspec.Struct, frozen=True, kw_only=True):
+    label: BaseLabel
+    editOf: str | None
+    redirect: BaseLabel | None = None
+    content: str | None = None
+    delta: Delta | None = None
+    # How many records back the content is, counting this one, when it's
+    # kept as a delta. Records written before it was added have 0.
+    deltas: int = 0
+    # Kept so the article column doesn't need the editOf chain rebuilt.
+    # Records written before it was added don't have it.
+    articleId: str | None = None
+
+
+def get_record_columns(record: 'ArticleRecord | BaseArticle') -> Columns:
+    columns = {
+        'label': str(record.label.labelId),
+        'path': encode_path(record.label.path),
+    }
+    if (record.articleId is not None):
+        columns['article'] = str(record.articleId)
+    return columns
+
+
+class ArticleConnection(Connection[BaseArticle]):
+    # Stores articles as records that point at their editOf by ArticleID
+    # and keep their content as a delta against it. The editOf chain is
+    # looked up in history, which is the articles store. Articles never
+    # change, so the ones rebuilt are shared by every connection, up to
+    # cache_size of them. Every snapshot_size-th edit in a chain keeps its
+    # whole content, so no content is more than that many deltas away.
+    cache_size = 4096
+    cache: 'OrderedDict[str, BaseArticle]' = OrderedDict()
+    cache_lock = Lock()
+    snapshot_size = 32
+
+    def __init__(self, store: Connection, history: Connection | None = None) -> None:
+        self.store = store
+        self.history = store if history is None else history
+
+    @classmethod
+    def get_cached(cls, articleId: str | None, record: ArticleRecord) -> BaseArticle | None:
+        # ArticleIDs only hash a label's name, so articles in different
+        # folders can share one and a hit has to match the record.
+        if (articleId is None):
+            return None
+        with cls.cache_lock:
+            article = cls.cache.get(articleId)
+            if (article is None or article.label != record.label
+                    or article.redirect != record.redirect):
+                return None
+            cls.cache.move_to_end(articleId)
+            return article
+
+    @classmethod
+    def set_cached(cls, article: BaseArticle):
+        with cls.cache_lock:
+            cls.cache[str(article.articleId)] = article
+            cls.cache.move_to_end(str(article.articleId))
+            while (len(cls.cache) > cls.cache_size):
+                cls.cache.popitem(last=False)
+
+    def toRecord(self, article: BaseArticle) -> 'ArticleRecord | BaseArticle':
+        if (article.editOf is None):
+            return ArticleRecord(
+                label=article.label,
+                editOf=None,
+                redirect=article.redirect,
+                content=article.content,
+                articleId=str(article.articleId)
+            )
+
+        parent = article.editOf
+        if (parent.articleId not in self.history):
+            # Without the parent in history there is nothing to point at.
+            return article
+
+        parent_raw = self.history[parent.articleId]
+        deltas = 1
+        if (isinstance(parent_raw, ArticleRecord) and parent_raw.content is None):
+            deltas = parent_raw.deltas + 1
+
+        delta = get_delta(parent.content, article.content)
+        if (deltas >= self.snapshot_size
+                or sum([len(text) for (_, _, text) in delta]) >= len(article.content)):
+            return ArticleRecord(
+                label=article.label,
+                editOf=parent.articleId,
+                redirect=article.redirect,
+                content=article.content,
+                articleId=str(article.articleId)
+            )
+        return ArticleRecord(
+            label=article.label,
+            editOf=parent.articleId,
+            redirect=article.redirect,
+            delta=delta,
+            deltas=deltas,
+            articleId=str(article.articleId)
+        )
+
+    def fromRecord(self, raw: 'ArticleRecord | BaseArticle') -> BaseArticle:
+        if (isinstance(raw, BaseArticle)):
+            return raw
+        cached = self.get_cached(raw.articleId, raw)
+        if (cached is not None):
+            return cached
+
+        # The chain is rebuilt down to the first article already rebuilt,
+        # since a delta needs its parent's content and articles are sent
+        # and stored elsewhere with their whole editOf chain.
+        records = [raw]
+        parent = None
+        parent_id = raw.editOf
+        while (parent_id is not None):
+            parent_raw = self.history[ID(parent_id)]
+            if (isinstance(parent_raw, BaseArticle)):
+                parent = parent_raw
+                self.set_cached(parent)
+                break
+            parent = self.get_cached(parent_id, parent_raw)
+            if (parent is not None):
+                break
+            records.append(parent_raw)
+            parent_id = parent_raw.editOf
+
+        for record in reversed(records):
+            content = record.content
+            if (content is None):
+                content = apply_delta(parent.content, record.delta or ())  # type: ignore
+            parent = BaseArticle(
+                label=record.label,
+                content=content,
+                editOf=parent,
+                redirect=record.redirect
+            )
+            self.set_cached(parent)
+        return parent  # type: ignore
+
+    def __setitem__(self, __key: ID, __value: BaseArticle) -> None:
+        self.store[__key] = self.toRecord(__value)
+
+    def __getitem__(self, __key: ID) -> BaseArticle:
+        return self.fromRecord(self.store[__key])
+
+    def __delitem__(self, __key: ID) -> None:
+        del self.store[__key]
+
+    def __iter__(self) -> Iterator[ID]:
+        return self.store.__iter__()
+
+    def __len__(self) -> int:
+        return self.store.__len__()
+
+    def __contains__(self, __key: ID) -> bool:  # type: ignore
+        return self.store.__contains__(__key)
+
+    def items(self) -> Iterator[Tuple[ID, BaseArticle]]:  # type: ignore
+        for (key, raw) in self.store.items():
+            yield (key, self.fromRecord(raw))
+
+    def get_many(self, keys: Iterable[ID]) -> Iterator[Tuple[ID, BaseArticle]]:
+        for (key, raw) in self.store.get_many(keys):
+            yield (key, self.fromRecord(raw))
+
+    def select_keys(self, column: str, value: str, prefix: bool = False) -> Iterator[ID] | None:
+        return self.store.select_keys(column, value, prefix)
+
+    def select(self, column: str, value: str, prefix: bool = False) -> Iterator[Tuple[ID, BaseArticle]] | None:
+        rows = self.store.select(column, value, prefix)
+        if (rows is None):
+            return None
+        return (
+            (key, self.fromRecord(raw))
+            for (key, raw) in rows
+        )
+
+    def values(self) -> Iterator[BaseArticle]:  # type: ignore
+        for (_, article) in self.items():
+            yield article
+
+
 class ArticleCollection():
     def __init__(self, connection: Connection[BaseArticle]) -> None:
         self.store = connection
@@ -55,9 +266,55 @@ class ArticleCollection():
     def get_article(self, articleId: ArticleID) -> BaseArticle | None:
         return self.store.get(articleId)
 
-    def get_articles(self) -> Iterator[BaseArticle]:
-        for article in self.store.values():
-            yield article
+    def get_records(self) -> Iterator[Tuple[ID, 'ArticleRecord | BaseArticle']]:
+        if (isinstance(self.store, ArticleConnection)):
+            return self.store.store.items()
+        return self.store.items()
+
+    # Prefix queries are answered from the store's path column when it has
+    # one, and otherwise by scanning the records' labels.
+    def get_articles(self, prefix: Tuple[str, ...] = ()) -> Iterator[BaseArticle]:
+        if (len(prefix) == 0):
+            for article in self.store.values():
+                yield article
+            return
+
+        articles = self.store.select('path', encode_path(prefix), prefix=True)
+        if (articles is not None):
+            for (_, article) in articles:
+                yield article
+            return
+
+        if (not isinstance(self.store, ArticleConnection)):
+            for article in self.store.values():
+                if (article.label.path[:len(prefix)] == prefix):
+                    yield article
+            return
+
+        # Records carry their label, so only matching articles get rebuilt.
+        for record in self.store.store.values():
+            if (record.label.path[:len(prefix)] == prefix):
+                yield self.store.fromRecord(record)
+
+    def get_ids(self, prefix: Tuple[str, ...] = ()) -> Iterator[ID]:
+        if (len(prefix) == 0):
+            for articleId in self.store:
+                yield articleId
+            return
+
+        keys = self.store.select_keys('path', encode_path(prefix), prefix=True)
+        if (keys is not None):
+            yield from keys
+            return
+
+        for (articleId, record) in self.get_records():
+            if (record.label.path[:len(prefix)] == prefix):
+                yield articleId
+
+    def get_count(self, prefix: Tuple[str, ...] = ()) -> int:
+        if (len(prefix) == 0):
+            return len(self.store)
+        return sum(1 for _ in self.get_ids(prefix))
 
     @classmethod
     def fromStream(cls, stream: bytes):
@@ -1,7 +1,10 @@
 
+from bisect import bisect_left
+from collections import defaultdict
 from dataclasses import dataclass
 from linki.article import BaseArticle
-from linki.connection import Connection
+from linki.config import ConfigCollection
+from linki.connection import Columns, Connection, SparseConnection, encode_path
 
 from linki.id import Label, LabelID
 from linki.url import URL
@@ -33,37 +36,106 @@ class Change():
         return size
 
 
+def get_change_columns(change: Change) -> Columns:
+    return {
+        'label': str(change.article.label.labelId),
+        'path': encode_path(change.article.label.path),
+        'article': str(change.article.articleId),
+        'source': change.source,
+    }
+
+
 def ChangeLabel(source: str, article: BaseArticle):
     path = [source, *article.label.path]
     return Label(path)
 
 
 class ChangeCollection():
-    def __init__(self, connection: Connection[Change]) -> None:
+    # Change ids are abbreviated like git's short hashes, and are indexed the
+    # same way: a sorted list of ids for each two character prefix.
+    fanout_size = 2
+
+    def __init__(
+        self,
+        connection: Connection[Change],
+        config: ConfigCollection | None = None
+    ) -> None:
         self.store = connection
+        self.config = config
 
     def add_change(self, change: Change):
-        self.store[change.label.labelId] = change
+        change_id = change.label.labelId
+        self.store[change_id] = change
+        if (self.config is None):
+            return
+        fanout = change_id[0:self.fanout_size]
+        change_ids = self.get_fanout(fanout)
+        position = bisect_left(change_ids, change_id)
+        if (position < len(change_ids) and change_ids[position] == change_id):
+            return
+        change_ids.insert(position, str(change_id))
+        self.config.set_change_ids(fanout, change_ids)
+
+    def get_fanout(self, fanout: str) -> list[str]:
+        if (self.config is None):
+            return sorted(
+                str(change_id) for change_id in self.store
+                if change_id.startswith(fanout)
+            )
+        if (not self.config.has_change_index()):
+            self.reindex()
+        return self.config.get_change_ids(fanout)
+
+    def reindex(self):
+        if (self.config is None):
+            return
+        fanouts: defaultdict[str, list[str]] = defaultdict(list)
+        for change_id in sorted(self.store):
+            fanouts[change_id[0:self.fanout_size]].append(str(change_id))
+        for (fanout, change_ids) in fanouts.items():
+            self.config.set_change_ids(fanout, change_ids)
+        self.config.set_change_index(True)
 
     def find_change_id(self, key: str):
-        return [
-            change_id for change_id in self.store
-            if change_id.startswith(key)
-        ]
+        if (len(key) < self.fanout_size):
+            return [
+                change_id for change_id in self.store
+                if change_id.startswith(key)
+            ]
+        change_ids = self.get_fanout(key[0:self.fanout_size])
+        position = bisect_left(change_ids, key)
+        matches = []
+        while (
+            position < len(change_ids) and
+            change_ids[position].startswith(key)
+        ):
+            matches.append(LabelID(change_ids[position]))
+            position += 1
+        return matches
 
     def get_change(self, change_id: str):
         return self.store.get(LabelID(change_id))
 
     def get_changes(self, url: URL | None = None):
-        for change_id in self.store:
-            change = self.store[change_id]
-            if (url is None):
-                yield change
-                continue
+        if (url is None):
+            yield from self.store.values()
+            return
+
+        def from_url(change: Change) -> bool:
+            return ChangeLabel(url.url, change.article) == change.label
 
-            inbox_label = ChangeLabel(url.url, change.article)
-            if (inbox_label == change.label):
-                yield change
+        changes = SparseConnection(
+            self.store, from_url, ('source', url.url, False))
+        yield from changes.values()
 
     def remove_change(self, change: Change):
-        del self.store[change.label.labelId]
+        change_id = change.label.labelId
+        del self.store[change_id]
+        if (self.config is None):
+            return
+        fanout = change_id[0:self.fanout_size]
+        change_ids = self.get_fanout(fanout)
+        position = bisect_left(change_ids, change_id)
+        if (position < len(change_ids) and change_ids[position] == change_id):
+            del change_ids[position]
+            self.config.set_change_ids(fanout, change_ids)
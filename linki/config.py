@@ -1,8 +1,9 @@
-from typing import Any, TypeAlias
+import time
+from typing import Any, Tuple, TypeAlias
 
 import msgspec
 from linki.connection import Connection
-from linki.id import SimpleLabel
+from linki.id import ID, LabelID, SimpleLabel
 from linki.url import URL
 
 Config: TypeAlias = object
@@ -16,6 +17,11 @@ class AuthDetails(msgspec.Struct, frozen=True):
     password: str
 
 
+class Version(msgspec.Struct, frozen=True):
+    count: int = 0
+    modified: float = 0.0
+
+
 class ConfigCollection():
     def __init__(self, connection: Connection[Any]) -> None:
         self.store = connection
@@ -65,3 +71,73 @@ class ConfigCollection():
         if (isinstance(auth, AuthDetails)):
             return auth
         return None
+
+    def get_version(self, style: str) -> Version:
+        version_label = SimpleLabel(f'{style}-version').labelId
+        version = self.store.get(version_label)
+        if (isinstance(version, Version)):
+            return version
+        return Version()
+
+    def bump_version(self, style: str) -> Version:
+        version_label = SimpleLabel(f'{style}-version').labelId
+        version = self.get_version(style)
+        version = Version(version.count + 1, time.time())
+        self.store[version_label] = version
+        return version
+
+    @staticmethod
+    def get_cursor_key(url: str, prefix: Tuple[str, ...]) -> ID:
+        # Hashed as given, since labels are cleaned and different urls can
+        # clean to the same one.
+        key = msgspec.json.encode([url, prefix]).decode()
+        return LabelID.getLabelID(('cursor:', key))
+
+    def get_cursor(self, url: str, prefix: Tuple[str, ...] = ()) -> int:
+        return self.store.get(self.get_cursor_key(url, prefix), 0)
+
+    def set_cursor(self, url: str, cursor: int, prefix: Tuple[str, ...] = ()):
+        self.store[self.get_cursor_key(url, prefix)] = cursor
+
+    def get_change_ids(self, fanout: str) -> list[str]:
+        fanout_label = SimpleLabel(f'change-ids-{fanout}').labelId
+        return self.store.get(fanout_label, [])
+
+    def set_change_ids(self, fanout: str, change_ids: list[str]):
+        fanout_label = SimpleLabel(f'change-ids-{fanout}').labelId
+        if (len(change_ids) > 0):
+            self.store[fanout_label] = change_ids
+        elif (fanout_label in self.store):
+            del self.store[fanout_label]
+
+    def has_change_index(self) -> bool:
+        index_label = SimpleLabel('change-index').labelId
+        return self.store.get(index_label, False)
+
+    def set_change_index(self, indexed: bool):
+        index_label = SimpleLabel('change-index').labelId
+        self.store[index_label] = indexed
+
+    def has_label_index(self) -> bool:
+        index_label = SimpleLabel('label-index').labelId
+        return self.store.get(index_label, False)
+
+    def set_label_index(self, indexed: bool):
+        index_label = SimpleLabel('label-index').labelId
+        self.store[index_label] = indexed
+
+    def has_search_index(self) -> bool:
+        index_label = SimpleLabel('search-change-index').labelId
+        return self.store.get(index_label, False)
+
+    def set_search_index(self, indexed: bool):
+        index_label = SimpleLabel('search-change-index').labelId
+        self.store[index_label] = indexed
+
+    def has_link_index(self) -> bool:
+        index_label = SimpleLabel('backlink-index').labelId
+        return self.store.get(index_label, False)
+
+    def set_link_index(self, indexed: bool):
+        index_label = SimpleLabel('backlink-index').labelId
+        self.store[index_label] = indexed
@@ -1,18 +1,24 @@
+from contextlib import contextmanager
 import copy
+import fcntl
 from io import BytesIO
+import os
 from pathlib import Path
 import pickle
-from typing import Callable, Dict, Iterator, MutableMapping, TypeVar
-from urllib.error import HTTPError
-from urllib.parse import ParseResult
-from urllib.request import urlopen
+import sqlite3
+import threading
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, MutableMapping, Tuple, TypeVar
+from urllib.parse import ParseResult, urlencode
 
 import msgspec
+from requests import HTTPError
 
 
 from linki.id import ID
+from linki.session import get_session
 
 VT = TypeVar('VT')
+Columns = Dict[str, str]
 
 
 class Connection(MutableMapping[ID, VT]):
@@ -31,26 +37,107 @@ class Connection(MutableMapping[ID, VT]):
     def __len__(self) -> int:  # type: ignore
         pass
 
+    def get_many(self, keys: Iterable[ID]) -> Iterator[Tuple[ID, VT]]:
+        for key in keys:
+            if (key in self):
+                yield (key, self[key])
+
+    def sync(self) -> None:
+        # Flushes this connection's writes to disk, for stores that buffer
+        # them.
+        pass
+
+    @contextmanager
+    def batch(self):
+        # Writes inside the block may share locks and open files, for
+        # stores that would otherwise take them for every write.
+        yield self
+
+    def select_keys(self, column: str, value: str, prefix: bool = False) -> Iterator[ID] | None:
+        # Keys of the items whose indexed column equals value, or starts with
+        # it when prefix is set, found without reading the items. None when
+        # the store has no index to answer from, in which case callers fall
+        # back to scanning.
+        return None
+
+    def select(self, column: str, value: str, prefix: bool = False) -> Iterator[Tuple[ID, VT]] | None:
+        keys = self.select_keys(column, value, prefix)
+        if (keys is None):
+            return None
+        return self.get_many(keys)
+
+    def iter_stream(self) -> Iterator[bytes]:
+        # The same bytes as encoding a list of every item, written a piece at
+        # a time: a MessagePack array header and then each item.
+        yield encode_array_header(len(self))
+        encoder = msgspec.msgpack.Encoder()
+        for item in self.values():
+            if (not isinstance(item, msgspec.Struct)):
+                raise AttributeError
+            yield encoder.encode(item)
+
+    def iter_frames(self) -> Iterator[bytes]:
+        for item in self.values():
+            if (not isinstance(item, msgspec.Struct)):
+                raise AttributeError
+            yield encode_frame(item)
+
     def toStream(self) -> bytes:
-        items = [self[label] for label in self]
-        if (any([not isinstance(item, msgspec.Struct) for item in items])):
-            raise AttributeError
-        encode = msgspec.msgpack.encode(items)
-        return encode
+        return b''.join(self.iter_stream())
 
     def toFile(self) -> BytesIO:
         return BytesIO(self.toStream())
 
+    def toFramedFile(self) -> BytesIO:
+        return BytesIO(b''.join(self.iter_frames()))
+
+
+def is_immutable(value: Any) -> bool:
+    if (isinstance(value, (str, bytes, int, float, bool, type(None)))):
+        return True
+    if (isinstance(value, msgspec.Struct)):
+        if (not type(value).__struct_config__.frozen):
+            return False
+        # Fields holding structs are only checked for being frozen, so an
+        # article's editOf chain isn't walked on every read.
+        return all(
+            type(item).__struct_config__.frozen
+            if isinstance(item, msgspec.Struct) else is_immutable(item)
+            for item in msgspec.structs.astuple(value)
+        )
+    if (isinstance(value, (tuple, frozenset))):
+        return all(is_immutable(item) for item in value)
+    return False
+
+
+def copy_mutable(value: VT) -> VT:
+    # Frozen structs (articles, labels, records) are shared instead of copied,
+    # since copying an article also copies its whole editOf chain. One with
+    # a list or other mutable field is still copied.
+    if (is_immutable(value)):
+        return value
+    return copy.deepcopy(value)
+
+
+def matches(columns: Columns, column: str, value: str, prefix: bool = False) -> bool:
+    found = columns.get(column)
+    if (found is None):
+        return False
+    if (prefix):
+        return found.startswith(value)
+    return found == value
+
 
 class MemoryConnection(Connection[VT]):
-    def __init__(self) -> None:
+    def __init__(self, columns: Callable[[Any], Columns] | None = None) -> None:
         self.store: Dict[ID, VT] = dict()
+        self.get_columns = columns
 
     def __setitem__(self, __key: ID, __value: VT) -> None:
-        self.store[__key] = copy.deepcopy(__value)
+        self.store[__key] = copy_mutable(__value)
 
     def __getitem__(self, __key: ID) -> VT:
-        return copy.deepcopy(self.store[__key])
+        return copy_mutable(self.store[__key])
 
     def __delitem__(self, __key: ID) -> None:
         del self.store[__key]
@@ -61,36 +148,270 @@ class MemoryConnection(Connection[VT]):
     def __len__(self) -> int:
         return self.store.__len__()
 
+    def select_keys(self, column: str, value: str, prefix: bool = False) -> Iterator[ID] | None:
+        # The values are already in memory, so they're read in place
+        # instead of copied.
+        get_columns = self.get_columns
+        if (get_columns is None):
+            return None
+        return iter([
+            key for (key, item) in self.store.items()
+            if matches(get_columns(item), column, value, prefix)
+        ])
+
+
+def encode_value(value: Any) -> Any:
+    # Paths and ID subclasses of str
+    if (isinstance(value, (Path, str))):
+        return str(value)
+    raise NotImplementedError
+
+
+def decode_value(item_type: type, value: Any) -> Any:
+    if (item_type is Path):
+        return Path(value)
+    raise NotImplementedError
+
+
+class Codec():
+    # Records of the listed types are written as <0xc1><version><type index>
+    # followed by MessagePack. 0xc1 is never used by MessagePack or pickle, so
+    # anything without the header is read as a pickle, which is also how
+    # values of any other type are written.
+    marker = b'\xc1'
+    version = 1
+
+    def __init__(
+        self,
+        *types: type,
+        columns: Callable[[Any], Columns] | None = None
+    ) -> None:
+        self.types = types
+        # Values indexed by stores that support select().
+        self.get_columns = columns
+        self.header = self.marker + bytes([self.version])
+        self.encoder = msgspec.msgpack.Encoder(enc_hook=encode_value)
+        self.decoders = [
+            msgspec.msgpack.Decoder(item_type, dec_hook=decode_value)
+            for item_type in types
+        ]
+
+    def encode(self, value: Any) -> bytes:
+        for (index, item_type) in enumerate(self.types):
+            if (type(value) is item_type):
+                return b''.join([
+                    self.header,
+                    bytes([index]),
+                    self.encoder.encode(value)
+                ])
+        return pickle.dumps(value)
+
+    def decode(self, data: bytes) -> Any:
+        if (data[0:2] != self.header):
+            return pickle.loads(data)
+        return self.decoders[data[2]].decode(memoryview(data)[3:])
+
+    def columns(self, value: Any) -> Columns:
+        if (self.get_columns is None):
+            return dict()
+        return self.get_columns(value)
+
+
+def fsync_path(path: Path) -> None:
+    # Works for directories too, which is how a new or removed file's entry
+    # is made durable.
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+@contextmanager
+def append_locked(path: Path) -> Iterator[BinaryIO]:
+    # Appends hold an exclusive flock on the file, so a torn tail a writer
+    # finds can't be another writer's frame still going in. The file is
+    # opened with O_APPEND, and opened again if it was replaced while this
+    # waited for the lock.
+    while (True):
+        stream = path.open('ab')
+        fcntl.flock(stream.fileno(), fcntl.LOCK_EX)
+        if (path.exists() and os.fstat(stream.fileno()).st_ino == path.stat().st_ino):
+            break
+        stream.close()
+    with stream:
+        stream.seek(0, os.SEEK_END)
+        yield stream
+
+
+def encode_path(path: Tuple[str, ...]) -> str:
+    # Every part ends in a slash, so a prefix match on the encoded path only
+    # matches whole parts.
+    return ''.join(f'{part}/' for part in path)
+
+
+class ColumnIndex:
+    def __init__(self) -> None:
+        self.inode = 0
+        self.position = 0
+        self.entries: Dict[ID, Columns] = dict()
+
 
 class PathConnection(Connection[VT]):
-    def __init__(self, path: Path) -> None:
+    # When the codec has columns, every write also appends <key, columns> to
+    # a .columns file as a frame, and a deletion appends <key, None>. The
+    # file is read into memory once per process and then only from where it
+    # was left, so select_keys never opens the items.
+    column_indexes: Dict[Path, ColumnIndex] = dict()
+    # Past this many dirty files, one sync(2) is cheaper than an fsync each.
+    sync_size = 64
+
+    def __init__(self, path: Path, codec: Codec | None = None) -> None:
         self.store = path.resolve()
         if (not self.store.is_dir()):
             raise TypeError('Path must be a directory.')
+        self.codec = Codec() if codec is None else codec
+        self.column_path = self.store.joinpath('.columns')
+        # Files written since the last sync()
+        self.dirty: set[Path] = set()
+        # The .columns file while batch() holds its lock
+        self.column_stream: BinaryIO | None = None
 
     def __setitem__(self, __key: ID, __value: VT) -> None:
-        with self.store.joinpath(__key).open('wb') as item:
-            pickle.dump(__value, item)
+        path = self.store.joinpath(__key)
+        path.write_bytes(self.codec.encode(__value))
+        self.dirty.update([path, self.store])
+        self.index_columns(__key, __value)
+
+    def sync(self) -> None:
+        if (len(self.dirty) > self.sync_size):
+            os.sync()
+        else:
+            for path in self.dirty:
+                if (path.exists()):
+                    fsync_path(path)
+        self.dirty.clear()
+
+    def get_column_index(self) -> ColumnIndex | None:
+        if (self.codec.get_columns is None):
+            return None
+        index = self.column_indexes.setdefault(self.column_path, ColumnIndex())
+        if (not self.column_path.exists()):
+            # Stores written before the index existed are indexed in full.
+            self.rebuild_columns(index)
+            return index
+        stat = self.column_path.stat()
+        if (stat.st_ino != index.inode or stat.st_size < index.position):
+            # Rebuilt, or swapped out by a migration.
+            (index.inode, index.position, index.entries) = (
+                stat.st_ino, 0, dict())
+        if (stat.st_size == index.position):
+            return index
+        with self.column_path.open('rb') as stream:
+            stream.seek(index.position)
+            frames = read_frames(stream)
+            while (True):
+                try:
+                    frame = next(frames)
+                except (StopIteration, EOFError):
+                    # A torn write at the end is ignored, and cut off by
+                    # the next append.
+                    break
+                (key, columns) = msgspec.msgpack.decode(frame)
+                if (columns is None):
+                    index.entries.pop(ID(key), None)
+                else:
+                    index.entries[ID(key)] = columns
+                index.position = stream.tell()
+        return index
+
+    def rebuild_columns(self, index: ColumnIndex) -> None:
+        temporary = self.store.joinpath('.columns.tmp')
+        # Appends wait for the swap and then go to the new file, and the
+        # items are read under the lock so none written before it are missed.
+        with append_locked(self.column_path):
+            entries = {key: self.codec.columns(value) for (key, value) in self.items()}
+            with temporary.open('wb') as stream:
+                for (key, columns) in entries.items():
+                    stream.write(encode_frame((str(key), columns)))
+                position = stream.tell()
+            temporary.replace(self.column_path)
+        index.inode = self.column_path.stat().st_ino
+        (index.position, index.entries) = (position, entries)
+
+    @contextmanager
+    def batch(self):
+        # Column frames are appended under one lock for the whole block.
+        if (self.get_column_index() is None or self.column_stream is not None):
+            yield self
+            return
+        with self.lock_columns() as stream:
+            self.column_stream = stream
+            try:
+                yield self
+            finally:
+                self.column_stream = None
+
+    @contextmanager
+    def lock_columns(self) -> Iterator[BinaryIO]:
+        with append_locked(self.column_path) as stream:
+            # Read to the end under the lock, so only a tail that doesn't
+            # decode is cut off.
+            index = self.get_column_index()
+            if (index is not None and stream.tell() > index.position):
+                stream.truncate(index.position)
+            yield stream
+
+    def index_columns(self, __key: ID, __value: Any, deleted: bool = False) -> None:
+        index = self.get_column_index()
+        if (index is None):
+            return
+        columns = None if deleted else self.codec.columns(__value)
+        frame = encode_frame((str(__key), columns))
+        if (self.column_stream is not None):
+            self.column_stream.write(frame)
+            # Flushed so reads in the block see the file as long as the index.
+            self.column_stream.flush()
+        else:
+            with self.lock_columns() as stream:
+                stream.write(frame)
+        self.dirty.add(self.column_path)
+        index.position += len(frame)
+        if (columns is None):
+            index.entries.pop(__key, None)
+        else:
+            index.entries[__key] = columns
+
+    def select_keys(self, column: str, value: str, prefix: bool = False) -> Iterator[ID] | None:
+        index = self.get_column_index()
+        if (index is None):
+            return None
+        return iter([
+            key for (key, columns) in index.entries.items()
+            if matches(columns, column, value, prefix)
+        ])
 
     def __getitem__(self, __key: ID) -> VT:
         if (not self.__contains__(__key)):
             raise KeyError
 
-        with self.store.joinpath(__key).open('rb') as item:
-            return pickle.load(item)
+        return self.codec.decode(self.store.joinpath(__key).read_bytes())
 
     def __delitem__(self, __key: ID) -> None:
         if (not self.__contains__(__key)):
             raise KeyError
         self.store.joinpath(__key).unlink()
+        self.dirty.add(self.store)
+        self.index_columns(__key, None, deleted=True)
 
     def __iter__(self) -> Iterator[ID]:
         for item in self.store.iterdir():
-            if (item.is_file()):
+            # Skips the .columns index
+            if (item.is_file() and not item.name.startswith('.')):
                 yield ID(item.name)
 
     def __len__(self) -> int:
-        return len(list(self.store.iterdir()))
+        return sum(1 for _ in self)
 
     def __contains__(self, __key: ID) -> bool:
         key_path = self.store.joinpath(__key)
@@ -132,53 +453,627 @@ class PathConnection(Connection[VT]):
         return connection.resolve()
 
 
+class PackIndex:
+    def __init__(self) -> None:
+        self.inode = 0
+        self.position = 0
+        self.entries: Dict[ID, Tuple[int, int]] = dict()
+        # Bytes of the pack holding current records, and bytes left behind
+        # by overwrites and deletions.
+        self.live = 0
+        self.dead = 0
+
+    def clear(self) -> None:
+        self.position = 0
+        self.entries.clear()
+        (self.live, self.dead) = (0, 0)
+
+
+class PackConnection(PathConnection[VT]):
+    # Records are appended to a single packfile as
+    # <56 byte id><8 byte length><payload>, and the offset of every payload
+    # is appended to an index file as <56 byte id><8 byte offset><8 byte length>.
+    # A length of 0 marks a deletion.
+    id_size = 56
+    int_size = 8
+    entry_size = id_size + int_size + int_size
+    record_size = id_size + int_size
+    # Packs are rewritten once they're mostly dead records, but not before
+    # there's this much to reclaim.
+    repack_size = 1 << 16
+    indexes: Dict[Path, PackIndex] = dict()
+
+    def __init__(self, path: Path, codec: Codec | None = None) -> None:
+        super().__init__(path, codec)
+        self.pack = self.store.joinpath('pack')
+        self.idx = self.store.joinpath('idx')
+        self.index = self.indexes.setdefault(self.idx, PackIndex())
+        # The pack and idx while batch() holds the pack's lock
+        self.streams: Tuple[BinaryIO, BinaryIO] | None = None
+        self.locked = False
+        self.refresh()
+
+    def refresh(self) -> None:
+        if (not self.idx.exists()):
+            self.index.clear()
+            return
+        stat = self.idx.stat()
+        size = stat.st_size - stat.st_size % self.entry_size
+        if (stat.st_ino != self.index.inode or size < self.index.position):
+            # The index was rewritten, most likely by a repack.
+            self.index.clear()
+            self.index.inode = stat.st_ino
+        if (size == self.index.position):
+            return
+        with self.idx.open('rb') as idx:
+            idx.seek(self.index.position)
+            raw = idx.read(size - self.index.position)
+        for start in range(0, len(raw), self.entry_size):
+            (key, offset, length) = self.unpack_entry(
+                raw[start:start+self.entry_size])
+            old = self.index.entries.get(key)
+            if (old is not None):
+                self.index.live -= self.record_size + old[1]
+                self.index.dead += self.record_size + old[1]
+            if (length == 0):
+                self.index.entries.pop(key, None)
+                self.index.dead += self.record_size
+            else:
+                self.index.entries[key] = (offset, length)
+                self.index.live += self.record_size + length
+        self.index.position = size
+
+    @classmethod
+    def pack_entry(cls, key: ID, offset: int, length: int) -> bytes:
+        return b''.join([
+            key.encode(),
+            offset.to_bytes(cls.int_size, 'big'),
+            length.to_bytes(cls.int_size, 'big'),
+        ])
+
+    @classmethod
+    def unpack_entry(cls, raw: bytes) -> Tuple[ID, int, int]:
+        key = ID(raw[:cls.id_size].decode())
+        offset = int.from_bytes(
+            raw[cls.id_size:cls.id_size+cls.int_size], 'big')
+        length = int.from_bytes(raw[cls.id_size+cls.int_size:], 'big')
+        return (key, offset, length)
+
+    @contextmanager
+    def lock_pack(self) -> Iterator[Tuple[BinaryIO, BinaryIO]]:
+        # The pack's lock covers the idx too, so entries go into the idx in
+        # the order their records went into the pack.
+        with append_locked(self.pack) as pack, self.idx.open('ab') as idx:
+            # Drop a torn entry left behind by an interrupted write.
+            if (idx.tell() % self.entry_size != 0):
+                idx.truncate(idx.tell() - idx.tell() % self.entry_size)
+            self.locked = True
+            try:
+                yield (pack, idx)
+            finally:
+                self.locked = False
+
+    @contextmanager
+    def batch(self):
+        # Records are appended under one lock on the pack for the whole
+        # block. It's taken before the .columns lock, as repack() does.
+        if (self.streams is not None):
+            yield self
+            return
+        with self.lock_pack() as streams, super().batch():
+            self.streams = streams
+            try:
+                yield self
+            finally:
+                self.streams = None
+
+    def append(self, __key: ID, payload: bytes) -> None:
+        if (self.streams is None):
+            with self.lock_pack() as (pack, idx):
+                self.write_record(pack, idx, __key, payload)
+        else:
+            self.write_record(*self.streams, __key, payload)
+        self.dirty.update([self.pack, self.idx, self.store])
+        self.refresh()
+
+    def write_record(self, pack: BinaryIO, idx: BinaryIO, __key: ID, payload: bytes) -> None:
+        offset = pack.tell() + self.id_size + self.int_size
+        pack.write(__key.encode())
+        pack.write(len(payload).to_bytes(self.int_size, 'big'))
+        pack.write(payload)
+        pack.flush()
+        idx.write(self.pack_entry(__key, offset, len(payload)))
+        idx.flush()
+
+    def read_record(self, pack: BinaryIO, __key: ID) -> bytes | None:
+        # None if the record at the offset isn't the one the index expects.
+        (offset, length) = self.index.entries[__key]
+        pack.seek(offset - self.record_size)
+        header = pack.read(self.record_size)
+        if (header != __key.encode() + length.to_bytes(self.int_size, 'big')):
+            return None
+        return pack.read(length)
+
+    def read(self, pack: BinaryIO, __key: ID) -> bytes:
+        # A repack replaces the pack and then the idx, so a reader can hold
+        # the idx of one and the pack of the other. Each record's header is
+        # checked against the index, and on a mismatch the read waits out
+        # the repack and tries again with both files reloaded.
+        payload = self.read_record(pack, __key)
+        if (payload is not None):
+            return payload
+        if (not self.locked):
+            # No repack can be under way while this holds the lock.
+            with self.lock_pack():
+                self.index.clear()
+                self.index.inode = 0
+                self.refresh()
+                if (__key not in self.index.entries):
+                    raise KeyError
+                with self.pack.open('rb') as current:
+                    payload = self.read_record(current, __key)
+        if (payload is None):
+            raise ValueError(f'Pack record for {__key} does not match its index.')
+        return payload
+
+    def __setitem__(self, __key: ID, __value: VT) -> None:
+        self.append(__key, self.codec.encode(__value))
+        self.index_columns(__key, __value)
+
+    def __getitem__(self, __key: ID) -> VT:
+        if (not self.__contains__(__key)):
+            raise KeyError
+        with self.pack.open('rb') as pack:
+            return self.codec.decode(self.read(pack, __key))
+
+    def __delitem__(self, __key: ID) -> None:
+        if (not self.__contains__(__key)):
+            raise KeyError
+        self.append(__key, b'')
+        self.index_columns(__key, None, deleted=True)
+
+    def __iter__(self) -> Iterator[ID]:
+        self.refresh()
+        return iter(list(self.index.entries))
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self.index.entries)
+
+    def __contains__(self, __key: ID) -> bool:  # type: ignore
+        self.refresh()
+        return __key in self.index.entries
+
+    def get_many(self, keys: Iterable[ID]) -> Iterator[Tuple[ID, VT]]:
+        # One refresh and one open for the whole batch, read in pack order.
+        self.refresh()
+        found = sorted(
+            (key for key in set(keys) if key in self.index.entries),
+            key=lambda key: self.index.entries[key][0]
+        )
+        if (len(found) == 0):
+            return
+        with self.pack.open('rb') as pack:
+            for key in found:
+                try:
+                    payload = self.read(pack, key)
+                except KeyError:
+                    # Deleted while the pack was being rewritten.
+                    continue
+                yield (key, self.codec.decode(payload))
+
+    def raw_items(self) -> Iterator[Tuple[ID, bytes]]:
+        # Read in pack order so bulk reads are sequential.
+        self.refresh()
+        keys = sorted(self.index.entries,
+                      key=lambda key: self.index.entries[key][0])
+        if (len(keys) == 0):
+            return
+        with self.pack.open('rb') as pack:
+            for key in keys:
+                try:
+                    payload = self.read(pack, key)
+                except KeyError:
+                    # Deleted while the pack was being rewritten.
+                    continue
+                yield (key, payload)
+
+    def items(self) -> Iterator[Tuple[ID, VT]]:  # type: ignore
+        for (key, payload) in self.raw_items():
+            yield (key, self.codec.decode(payload))
+
+    def values(self) -> Iterator[VT]:  # type: ignore
+        for (_, value) in self.items():
+            yield value
+
+    def should_repack(self) -> bool:
+        self.refresh()
+        return (
+            self.index.dead > self.repack_size
+            and self.index.dead > self.index.live
+        )
+
+    def repack(self) -> None:
+        # Rewrites the pack with only the current records. The .columns
+        # index is rebuilt too, since it also grows with every write.
+        pack = self.store.joinpath('pack.tmp')
+        idx = self.store.joinpath('idx.tmp')
+        # Appends wait for the swap and then go to the new files.
+        with self.lock_pack():
+            with pack.open('wb') as n_pack, idx.open('wb') as n_idx:
+                for (key, payload) in self.raw_items():
+                    n_pack.write(key.encode())
+                    n_pack.write(len(payload).to_bytes(self.int_size, 'big'))
+                    offset = n_pack.tell()
+                    n_pack.write(payload)
+                    n_idx.write(self.pack_entry(key, offset, len(payload)))
+                for stream in (n_pack, n_idx):
+                    stream.flush()
+                    os.fsync(stream.fileno())
+            pack.replace(self.pack)
+            idx.replace(self.idx)
+        self.index.clear()
+        self.refresh()
+        if (self.codec.get_columns is not None):
+            self.rebuild_columns(
+                self.column_indexes.setdefault(self.column_path, ColumnIndex()))
+        self.dirty.update([self.pack, self.idx, self.column_path, self.store])
+
+
+class SqliteConnection(PathConnection[VT]):
+    # Items are rows of a single table in <style>/db.sqlite, next to columns
+    # the codec pulls out of each value. The columns are indexed so select()
+    # is a query instead of a scan. WAL mode lets readers carry on while
+    # another process writes.
+    columns = ('label', 'path', 'article', 'source')
+    batch_size = 500
+    # Databases whose table and indexes have been created by this process.
+    created: set[Path] = set()
+    # Each thread keeps one connection per database, with the inode it was
+    # opened on, since opening one costs more than most queries.
+    local = threading.local()
+
+    def __init__(self, path: Path, codec: Codec | None = None) -> None:
+        super().__init__(path, codec)
+        self.db = self.connect(self.store.joinpath('db.sqlite'))
+
+    @classmethod
+    def connect(cls, db: Path) -> sqlite3.Connection:
+        opened: Dict[Path, Tuple[int, sqlite3.Connection]] | None = getattr(
+            cls.local, 'opened', None)
+        if (opened is None):
+            opened = cls.local.opened = dict()
+        inode = db.stat().st_ino if db.exists() else None
+        if (db in opened):
+            (known, connection) = opened.pop(db)
+            if (known == inode):
+                opened[db] = (known, connection)
+                return connection
+            # Replaced, most likely by a migration.
+            connection.close()
+        connection = sqlite3.connect(
+            db,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        connection.execute('PRAGMA synchronous=NORMAL')
+        if (inode is None or db not in cls.created):
+            cls.create(connection)
+            cls.created.add(db)
+        opened[db] = (db.stat().st_ino, connection)
+        return connection
+
+    @classmethod
+    def create(cls, connection: sqlite3.Connection) -> None:
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+            + ', '.join(f'{column} TEXT' for column in cls.columns)
+            + ')'
+        )
+        for column in cls.columns:
+            connection.execute(
+                f'CREATE INDEX IF NOT EXISTS items_{column} ON items ({column})')
+
+    @contextmanager
+    def batch(self):
+        # Writes inside the block are committed as one SQLite transaction
+        # instead of one each.
+        self.db.execute('BEGIN')
+        try:
+            yield self
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+
+    def sync(self) -> None:
+        # Commits in WAL mode with synchronous=NORMAL only reach the disk at
+        # a checkpoint.
+        self.db.execute('PRAGMA wal_checkpoint(FULL)')
+
+    def __setitem__(self, __key: ID, __value: VT) -> None:
+        columns = self.codec.columns(__value)
+        self.db.execute(
+            'INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                str(__key),
+                self.codec.encode(__value),
+                *(columns.get(column) for column in self.columns)
+            )
+        )
+
+    def __getitem__(self, __key: ID) -> VT:
+        row = self.db.execute(
+            'SELECT value FROM items WHERE key = ?', (str(__key),)).fetchone()
+        if (row is None):
+            raise KeyError
+        return self.codec.decode(row[0])
+
+    def __delitem__(self, __key: ID) -> None:
+        cursor = self.db.execute(
+            'DELETE FROM items WHERE key = ?', (str(__key),))
+        if (cursor.rowcount == 0):
+            raise KeyError
+
+    def __iter__(self) -> Iterator[ID]:
+        for (key,) in self.db.execute('SELECT key FROM items').fetchall():
+            yield ID(key)
+
+    def __len__(self) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def __contains__(self, __key: ID) -> bool:  # type: ignore
+        row = self.db.execute(
+            'SELECT 1 FROM items WHERE key = ?', (str(__key),)).fetchone()
+        return row is not None
+
+    def decode_rows(self, rows: Iterable[Tuple[str, bytes]]) -> Iterator[Tuple[ID, VT]]:
+        for (key, value) in rows:
+            yield (ID(key), self.codec.decode(value))
+
+    def items(self) -> Iterator[Tuple[ID, VT]]:  # type: ignore
+        return self.decode_rows(self.db.execute('SELECT key, value FROM items'))
+
+    def values(self) -> Iterator[VT]:  # type: ignore
+        for (_, value) in self.items():
+            yield value
+
+    def get_many(self, keys: Iterable[ID]) -> Iterator[Tuple[ID, VT]]:
+        keys = [str(key) for key in keys]
+        for start in range(0, len(keys), self.batch_size):
+            batch = keys[start:start+self.batch_size]
+            marks = ', '.join('?' * len(batch))
+            yield from self.decode_rows(self.db.execute(
+                f'SELECT key, value FROM items WHERE key IN ({marks})', batch))
+
+    def where(self, column: str, value: str, prefix: bool) -> Tuple[str, Tuple[str, ...]] | None:
+        if (column not in self.columns):
+            return None
+        if (not prefix):
+            return (f'{column} = ?', (value,))
+        if (value == ''):
+            return (f'{column} IS NOT NULL', ())
+        # Everything starting with value sorts between it and value with its
+        # last character bumped, which the index can answer as a range.
+        end = value[:-1] + chr(ord(value[-1]) + 1)
+        return (f'{column} >= ? AND {column} < ?', (value, end))
+
+    def select_keys(self, column: str, value: str, prefix: bool = False) -> Iterator[ID] | None:
+        where = self.where(column, value, prefix)
+        if (where is None):
+            return None
+        (clause, parameters) = where
+        rows = self.db.execute(
+            f'SELECT key FROM items WHERE {clause}', parameters).fetchall()
+        return (ID(key) for (key,) in rows)
+
+    def select(self, column: str, value: str, prefix: bool = False) -> Iterator[Tuple[ID, VT]] | None:
+        where = self.where(column, value, prefix)
+        if (where is None):
+            return None
+        (clause, parameters) = where
+        return self.decode_rows(self.db.execute(
+            f'SELECT key, value FROM items WHERE {clause}', parameters))
+
+
+def encode_array_header(size: int) -> bytes:
+    if (size < 16):
+        return bytes([0x90 | size])
+    if (size < 2**16):
+        return b'\xdc' + size.to_bytes(2, 'big')
+    return b'\xdd' + size.to_bytes(4, 'big')
+
+
+def encode_frame(item: msgspec.Struct) -> bytes:
+    payload = msgspec.msgpack.encode(item)
+    return len(payload).to_bytes(4, 'big') + payload
+
+
+def read_exactly(stream: BinaryIO, size: int) -> bytes:
+    data = b''
+    while (len(data) < size):
+        chunk = stream.read(size - len(data))
+        if (not chunk):
+            raise EOFError('Stream ended in the middle of a frame.')
+        data += chunk
+    return data
+
+
+def read_frames(stream: BinaryIO) -> Iterator[bytes]:
+    while (True):
+        header = stream.read(4)
+        if (not header):
+            return
+        if (len(header) < 4):
+            header += read_exactly(stream, 4 - len(header))
+        yield read_exactly(stream, int.from_bytes(header, 'big'))
+
+
+def is_array_header(header: bytes) -> bool:
+    return (header[0] & 0xf0) == 0x90 or header[0] in (0xdc, 0xdd)
+
+
+def decode_stream(stream: BinaryIO, item_type: type = Any) -> Iterator[Any]:
+    # Framed streams are decoded an item at a time. A plain MessagePack list,
+    # as sent by older versions, has to be read whole. No frame is big enough
+    # for its length to start like an array header.
+    header = stream.read(1)
+    if (not header):
+        return
+    if (is_array_header(header)):
+        yield from msgspec.msgpack.decode(
+            header + stream.read(), type=list[item_type])  # type: ignore
+        return
+    decoder = msgspec.msgpack.Decoder(item_type)
+    size = int.from_bytes(header + read_exactly(stream, 3), 'big')
+    yield decoder.decode(read_exactly(stream, size))
+    for frame in read_frames(stream):
+        yield decoder.decode(frame)
+
+
 class ROWebConnection(Connection[VT]):
-    def __init__(self, url: ParseResult, style: str) -> None:
-        if (style not in ['titles', 'articles']):
+    def __init__(
+        self,
+        url: ParseResult,
+        style: str,
+        item_type: type = Any,
+        prefix: Tuple[str, ...] = ()
+    ) -> None:
+        if (style not in ['titles', 'articles', 'labels']):
             raise NotImplementedError
-        self.url = f'{url.geturl()}pickles/{style}/'
-        self.count_url = f'{url.geturl()}count/{style}/'
+        root = url.geturl()
+        query = ''
+        if (len(prefix) > 0):
+            query = '?' + urlencode({'prefix': '/'.join(prefix)})
+        self.url = f'{root}copy/'
+        self.stream_url = f'{root}copy/stream/{style}{query}'
+        self.ids_url = f'{root}copy/ids/{style}{query}'
+        self.count_url = f'{root}count/{style}/{query}'
         self.style = style
+        self.prefix = prefix
+        self.decoder = msgspec.msgpack.Decoder(item_type)
 
-    def __getitem__(self, __key: ID) -> 'Title | Article':  # type: ignore
+    def read(self, url: str) -> bytes:
+        res = get_session().get(url)
+        res.raise_for_status()
+        return res.content
+
+    def fetch(self, path: str, item_type: type):
+        res = self.read(f'{self.url}{path}')
+        return msgspec.msgpack.decode(res, type=item_type)
+
+    def get_key(self, item) -> ID:
+        if (self.style == 'articles'):
+            return item.articleId
+        return item.label.labelId
+
+    def __getitem__(self, __key: ID) -> VT:
+        if (self.style == 'labels'):
+            for (_, item) in self.get_many([__key]):
+                return item
+            raise KeyError
         try:
-            url = f"{self.url}{__key}"
-            res = urlopen(url).read()
-            return pickle.loads(res)
+            res = self.read(f"{self.url}{__key}")
+            return self.decoder.decode(res)
         except HTTPError:
             raise KeyError
 
+    def read_stream(self, body: bytes | None = None) -> Iterator[Tuple[ID, VT]]:
+        # Items are decoded as they arrive instead of after the download.
+        method = 'GET' if body is None else 'POST'
+        with get_session().request(method, self.stream_url, data=body, stream=True) as res:
+            res.raise_for_status()
+            res.raw.decode_content = True
+            for frame in read_frames(res.raw):
+                # A stream that keeps trickling in is stopped at the deadline.
+                get_session().get_remaining()
+                item = self.decoder.decode(frame)
+                yield (self.get_key(item), item)
+
+    def items(self) -> Iterator[Tuple[ID, VT]]:  # type: ignore
+        return self.read_stream()
+
+    def values(self) -> Iterator[VT]:  # type: ignore
+        for (_, item) in self.items():
+            yield item
+
+    def get_many(self, keys: Iterable[ID]) -> Iterator[Tuple[ID, VT]]:
+        keys = list(keys)
+        if (len(keys) == 0):
+            return iter([])
+        return self.read_stream(
+            msgspec.msgpack.encode([str(key) for key in keys]))
+
+    def read_ids(self, url: str) -> Iterator[ID]:
+        res = self.read(url)
+        for key in msgspec.msgpack.decode(res, type=list[str]):
+            yield ID(key)
+
     def __iter__(self) -> Iterator[ID]:
-        res = urlopen(self.url).read()
-        unpickle = pickle.loads(res)
-        for item in unpickle:
-            if (self.style == 'articles'):
-                yield item.articleId
+        return self.read_ids(self.ids_url)
 
-            if (self.style == 'titles'):
-                yield item.label.labelId
+    def select_keys(self, column: str, value: str, prefix: bool = False) -> Iterator[ID] | None:
+        # The server lists the ids under a path without sending the items.
+        if (column != 'path' or not prefix):
+            return None
+        scope = encode_path(self.prefix)
+        if (scope.startswith(value)):
+            return self.__iter__()
+        if (not value.startswith(scope)):
+            return iter([])
+        query = urlencode({'prefix': value.rstrip('/')})
+        return self.read_ids(f'{self.url}ids/{self.style}?{query}')
 
     def __len__(self) -> int:
-        res = urlopen(self.count_url).read()
-        return res
+        if (self.style == 'labels'):
+            return sum(1 for _ in self)
+        return int(self.read(self.count_url))
 
 
 class SparseConnection(Connection[VT]):
-    def __init__(self, store: Connection[VT], identifier: Callable[[VT], bool]) -> None:
+    # The items of store that identifier accepts. When the same filter is
+    # given as where, a (column, value, prefix) selection, the store is asked
+    # for the matching keys first and only read in full if it can't answer.
+    def __init__(
+        self,
+        store: Connection[VT],
+        identifier: Callable[[VT], bool],
+        where: Tuple[str, str, bool] | None = None
+    ) -> None:
         super().__init__()
         self.store = store
         self.identifies = identifier
+        self.where = where
 
     def __getitem__(self, __key: ID) -> VT:
-        return self.store[__key]
+        item = self.store[__key]
+        if (not self.identifies(item)):
+            raise KeyError
+        return item
 
     def __iter__(self) -> Iterator[ID]:
-        for (key, item) in self.store.items():
-            if (self.identifies(item)):
-                yield key
+        if (self.where is not None):
+            keys = self.store.select_keys(*self.where)
+            if (keys is not None):
+                return keys
+        return (key for (key, item) in self.store.items() if self.identifies(item))
 
     def __len__(self) -> int:
-        return self.store.__len__()
+        return sum(1 for _ in self)
+
+    def get_many(self, keys: Iterable[ID]) -> Iterator[Tuple[ID, VT]]:
+        for (key, item) in self.store.get_many(keys):
+            if (self.identifies(item)):
+                yield (key, item)
+
+    def items(self) -> Iterator[Tuple[ID, VT]]:  # type: ignore
+        return self.get_many(self.__iter__())
+
+    def values(self) -> Iterator[VT]:  # type: ignore
+        for (_, item) in self.items():
+            yield item
 
 
 class CountError(Exception):
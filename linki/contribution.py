@@ -1,11 +1,10 @@
 from dataclasses import dataclass
 from urllib.parse import urlencode
-import msgspec
-import requests
 from linki.change import Change
 from linki.editor import FileCopier
 from linki.inbox import Inbox
 from linki.repository import Repository
+from linki.session import get_session
 from linki.url import URL
 
 
@@ -27,14 +26,14 @@ class Contribution():
                 return True
             case 'https':
                 url = self.destination.url + 'api/contribute'
-                changes = self.source.titles.store.toFile()
+                changes = self.source.titles.store.toFramedFile()
                 auth = self.source.config.get_auth(URL(self.destination.url))
                 if (auth is None):
                     raise AttributeError(
                         "You need to authenticate this URL. Add it again using contribute.")
-                res = requests.post(
+                res = get_session().post(
                     url,
-                    data={'changes': (changes, 'changes')},
+                    files={'changes': ('changes', changes)},
                     auth=(auth.username, auth.password)
                 )
                 return (res.status_code == 201 or res.status_code == 202)
@@ -45,8 +44,8 @@ class Contribution():
             raise NotImplementedError('authentication works with: https')
 
         url = self.destination.url + 'api/me'
-        res = requests.get(url, auth=(username, password))
+        res = get_session().get(url, auth=(username, password))
         if (res.status_code == 200):
-            user = res.json.get('username')
+            user = res.json().get('username')
             return user == username
         return False
@@ -1,11 +1,16 @@
 from pathlib import Path
-from typing import Iterator
+from typing import Dict, Iterator, Tuple
 
 import msgspec
 from linki.article import BaseArticle
 from linki.connection import Connection
 
-from linki.id import BaseLabel, InoLabel
+from linki.id import BaseLabel, InoLabel, SimpleLabel
+
+Stat = Tuple[int, int, int]
+# Filesystems can round modification times down by up to a couple of
+# seconds, so anything modified this close to a scan can't be trusted.
+RACY_NS = 2_000_000_000
 
 
 def Draft(
@@ -47,9 +52,15 @@ class Shadow(msgspec.Struct, frozen=True, kw_only=True):
     article: BaseArticle
 
 
+def FileStat(path: Path) -> Stat:
+    stat = path.stat()
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
 class ShadowCollection():
     def __init__(self, connection: Connection[Shadow]) -> None:
         self.store = connection
+        self.manifest_label = SimpleLabel('manifest').labelId
 
     def add_shadow(self, article: BaseArticle, path: Path):
         label = InoLabel(path)
@@ -61,3 +72,15 @@ class ShadowCollection():
     def get_shadow(self, path: Path):
         label = InoLabel(path)
         return self.store.get(label.labelId, None)
+
+    def get_manifest(self) -> Dict[str, Stat]:
+        manifest = self.store.get(self.manifest_label, None)
+        if (not isinstance(manifest, dict)):
+            return dict()
+        return manifest
+
+    def set_manifest(self, manifest: Dict[str, Stat], stamp: int):
+        self.store[self.manifest_label] = {  # type: ignore
+            path: stat for (path, stat) in manifest.items()
+            if stat[1] < stamp - RACY_NS
+        }
@@ -1,15 +1,22 @@
-from itertools import zip_longest
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable
+import time
+from typing import Iterable, Tuple
 
 from linki.article import ArticleCollection
-from linki.connection import SparseConnection
-from linki.draft import BaseArticle, Draft
+from linki.draft import BaseArticle, Draft, FileStat
 from linki.repository import FileRepository, Repository
 from linki.title import BaseArticle, Redirect, TitleCollection
 from linki.id import PathLabel
 
 
+@dataclass
+class UnloadCount():
+    written: int = 0
+    skipped: int = 0
+    removed: int = 0
+
+
 class Editor():
 
     def __init__(self, repo: Repository) -> None:
@@ -28,39 +35,71 @@ class Editor():
     def publish_drafts(self) -> int:
         published = []
         changed = []
-        for draft in self.get_updates():
-            article = self.merge_title(draft)
-            published.append(draft.label)
-            if (article.editOf is not None):
-                if (article.label != article.editOf.label):
-                    redirect = Redirect(
-                        article.editOf,
-                        article.label
-                    )
-                    self.merge_title(redirect)
-                    changed.append(article.label)
-
-        for label in published:
-            self.repo.drafts.clear_draft(label)
-        for label in changed:
-            self.repo.drafts.clear_draft(label)
+        with self.repo.transaction():
+            for draft in self.get_updates():
+                article = self.merge_title(draft)
+                published.append(draft.label)
+                if (article.editOf is not None):
+                    if (article.label != article.editOf.label):
+                        redirect = Redirect(
+                            article.editOf,
+                            article.label
+                        )
+                        self.merge_title(redirect)
+                        changed.append(article.label)
+
+            for label in published:
+                self.repo.drafts.clear_draft(label)
+            for label in changed:
+                self.repo.drafts.clear_draft(label)
         return len(published)
 
-    def copy_articles(self, articles: ArticleCollection):
+    def copy_articles(
+        self,
+        articles: ArticleCollection,
+        prefix: Tuple[str, ...] = ()
+    ):
+        local = self.repo.articles
+        have = set(local.get_ids())
+        wants = [
+            articleId for articleId in articles.get_ids(prefix)
+            if articleId not in have
+        ]
+
         count = 0
-        for article in articles.get_articles():
+        deferred = []
+        for (articleId, article) in articles.store.get_many(wants):
             if (article is None):
                 continue
-            self.repo.articles.merge_article(article)
+            if (article.editOf is not None and
+                    article.editOf.articleId not in have):
+                deferred.append(articleId)
+            local.merge_article(article)
+            have.add(articleId)
             count += 1
+
+        # Edits that arrived before their parent had nothing to point at.
+        for articleId in deferred:
+            article = local.get_article(articleId)
+            if (article is None or article.editOf is None):
+                continue
+            if (article.editOf.articleId in have):
+                local.merge_article(article)
         return count
 
-    def copy_titles(self, titles: TitleCollection):
+    def copy_titles(
+        self,
+        titles: TitleCollection,
+        prefix: Tuple[str, ...] = ()
+    ):
+        local = self.repo.titles.get_versions()
+        wants = [
+            labelId for (labelId, articleId) in titles.get_versions(prefix).items()
+            if local.get(labelId) != articleId
+        ]
+
         count = 0
-        for n_title in titles.get_titles():
-            o_title = self.repo.titles.get_title(n_title.label)
-            if (o_title == n_title):
-                continue
+        for (_, n_title) in titles.store.get_many(wants):
             self.repo.titles.set_title(n_title)
             count += 1
         return count
@@ -89,8 +128,18 @@ class FileEditor(Editor):
         return (_glob.resolve() for _glob in glob if _glob.is_file())
 
     def load_drafts(self):
+        stamp = time.time_ns()
+        shadows = self.repo.shadows
+        drafts = self.repo.drafts
+        manifest = shadows.get_manifest()
+        loaded = dict()
         for file in self.iterfiles():
-            shadow = self.repo.shadows.get_shadow(file)
+            stat = FileStat(file)
+            loaded[str(file)] = stat
+            if (manifest.get(str(file)) == stat):
+                continue
+
+            shadow = shadows.get_shadow(file)
             editOf = None
             if (shadow is not None):
                 editOf = shadow.article
@@ -101,24 +150,44 @@ class FileEditor(Editor):
                 editOf
             )
 
-            self.repo.drafts.set_draft(_draft)
+            drafts.set_draft(_draft)
+        shadows.set_manifest(loaded, stamp)
 
-    def unload_titles(self):
+    def unload_titles(self) -> UnloadCount:
+        count = UnloadCount()
+        shadows = self.repo.shadows
         for title in self.repo.titles.get_titles():
+            unload = self.repo.path.joinpath(*title.label.path)
             if (title.redirect is not None):
-                prev = self.repo.path.joinpath(*title.label.path)
-                prev.unlink(missing_ok=True)
-                for crumb in prev.parents:
+                if (not unload.is_file()):
+                    continue
+                unload.unlink()
+                count.removed += 1
+                for crumb in unload.parents:
                     if (crumb == self.repo.path):
                         break
-                    if (crumb.exists()):
+                    if (crumb.exists() and not any(crumb.iterdir())):
                         crumb.rmdir()
                 continue
-            unload = self.repo.path.joinpath(*title.label.parents)
-            unload.mkdir(parents=True, exist_ok=True)
-            unload = unload.joinpath(title.label.name)
+
+            if (unload.is_file()):
+                shadow = shadows.get_shadow(unload)
+                if (shadow is not None and
+                        shadow.path == unload.resolve() and
+                        shadow.article.articleId == title.articleId
+                    ):
+                    count.skipped += 1
+                    continue
+                if (unload.read_text() == title.content):
+                    shadows.add_shadow(title, unload.resolve())
+                    count.skipped += 1
+                    continue
+
+            unload.parent.mkdir(parents=True, exist_ok=True)
             unload.write_text(title.content)
-            self.repo.shadows.add_shadow(title, unload.resolve())
+            shadows.add_shadow(title, unload.resolve())
+            count.written += 1
+        return count
 
 
 class Copier:
@@ -130,27 +199,17 @@ class Copier:
         self.destination = destination
         self.articles = self.source.articles
         self.titles = self.source.titles
-        if (self.source.connection.url != self.source.connection.root):
-            self.articles = ArticleCollection(SparseConnection(
-                self.source.articles.store, self.should_copy))
-            self.titles = TitleCollection(SparseConnection(
-                self.source.titles.store, self.should_copy))
-
-    def should_copy(self, article: BaseArticle) -> bool:
-        a = article.label.path
-        b = self.source.connection.path
-        for (x, y) in zip_longest(a, b):
-            if (y is None):
-                return True
-            if (x != y):
-                return False
-        return True
+        # Only the subtree under the source's path is copied. Remote stores
+        # are already scoped to it by the server.
+        self.prefix: Tuple[str, ...] = ()
+        if (self.source.connection.root.scheme != 'https'):
+            self.prefix = tuple(self.source.connection.path)
 
     def copy_articles(self):
-        return self.destination.copy_articles(self.articles)
+        return self.destination.copy_articles(self.articles, self.prefix)
 
     def copy_titles(self):
-        return self.destination.copy_titles(self.titles)
+        return self.destination.copy_titles(self.titles, self.prefix)
 
 
 class FileCopier(Copier):
@@ -161,5 +220,5 @@ class FileCopier(Copier):
         self.destination = FileEditor.fromPath(destination)
         super().__init__(self.source, self.destination)
 
-    def unload_titles(self):
-        self.destination.unload_titles()
+    def unload_titles(self) -> UnloadCount:
+        return self.destination.unload_titles()
@@ -51,7 +51,7 @@ class LabelID(ID):
 
 
 class BaseLabel(msgspec.Struct, kw_only=True, dict=True, frozen=True):
-    path: tuple[str]
+    path: tuple[str, ...]
 
     @classmethod
     def fromUnsafeString(cls, unsafe_raw_name: str):
@@ -1,11 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from difflib import unified_diff
 from itertools import groupby
-from typing import Iterator
+import time
+from typing import Dict, Iterator, List, Tuple
+from requests import HTTPError, Timeout
 from linki.change import Change
 from linki.connection import CountError
+from linki.draft import BaseArticle
+from linki.id import ID
 from linki.repository import Repository
+from linki.session import get_session
 from linki.subscription import Subscription
+from linki.title import TitleChanges
 
 
 @dataclass
@@ -14,24 +21,85 @@ class InboxRow():
     updates: Iterator[Change]
 
 
+@dataclass
+class InboxReport():
+    url: str
+    count: int = 0
+    elapsed: float = 0.0
+    error: str | None = None
+
+
 class Inbox():
     def __init__(self, repo: Repository) -> None:
         self.repo = repo
 
-    def load_inbox(self):
+    def fetch_updates(
+        self,
+        report: InboxReport,
+        local: Dict[ID, str],
+        timeout: float | None
+    ) -> Tuple[List[BaseArticle], int, Tuple[str, ...]]:
+        # The clock starts when the fetch does, not while it waits for a
+        # worker, and the deadline is kept by the requests themselves so a
+        # hung wiki doesn't keep its thread past it.
+        start = time.monotonic()
+        try:
+            with get_session().deadline(timeout):
+                repo = Repository(report.url)
+                # Cursors are kept per url and subtree.
+                prefix = tuple(repo.connection.path)
+                cursor = self.repo.config.get_cursor(report.url, prefix)
+                try:
+                    changes = repo.get_title_changes(cursor)
+                except HTTPError:
+                    # Servers from before sync cursors.
+                    changes = TitleChanges(0)
+                subscription = Subscription(self.repo.titles, repo.titles)
+                updates = list(subscription.get_updates(local, changes.labels))
+                return (updates, changes.cursor, prefix)
+        finally:
+            report.elapsed = time.monotonic() - start
+
+    def load_inbox(
+        self,
+        workers: int = 8,
+        timeout: float | None = 30.0
+    ) -> List[InboxReport]:
+        # Subscriptions are downloaded in parallel, but only this thread
+        # writes to the inbox.
         refusals = self.repo.config.get_refusals()
-        for sub in self.repo.subs.get_urls():
-            repo = Repository(sub.url)
-            remote = repo.titles
-            subscription = Subscription(self.repo.titles, remote)
-            for update in subscription.get_updates():
-                change = Change(
-                    article=update,
-                    source=sub.url
-                )
-                if (change.change_id in refusals):
+        local = self.repo.titles.get_versions()
+        reports = [InboxReport(sub.url) for sub in self.repo.subs.get_urls()]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fetches = [
+                (report, executor.submit(
+                    self.fetch_updates, report, local, timeout))
+                for report in reports
+            ]
+            for (report, fetch) in fetches:
+                try:
+                    updates: List[BaseArticle]
+                    (updates, cursor, prefix) = fetch.result()
+                except Exception as error:
+                    # Retries that ran out at the deadline fail as connection
+                    # errors, so they're told apart by the time taken.
+                    if (isinstance(error, Timeout) or (
+                            timeout is not None and report.elapsed >= timeout)):
+                        report.error = f'timed out after {timeout}s'
+                    else:
+                        report.error = str(error) or type(error).__name__
                     continue
-                self.repo.changes.add_change(change)
+                for update in updates:
+                    change = Change(
+                        article=update,
+                        source=report.url
+                    )
+                    if (change.change_id in refusals):
+                        continue
+                    self.repo.changes.add_change(change)
+                    report.count += 1
+                self.repo.config.set_cursor(report.url, cursor, prefix)
+        return reports
 
     def read_inbox(self):
         def sort_by_key(x): return x.source
@@ -0,0 +1,200 @@
+from bisect import bisect_right
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple
+
+import msgspec
+from linki.connection import VT, Connection, append_locked, encode_frame, fsync_path, read_frames
+from linki.id import ID
+
+
+class JournalEntry(msgspec.Struct, frozen=True):
+    sequence: int
+    style: str
+    key: str
+    deleted: bool = False
+
+
+class Journal():
+    def __init__(self) -> None:
+        self.entries: List[JournalEntry] = []
+
+    @property
+    def sequence(self) -> int:
+        if (len(self.entries) == 0):
+            return 0
+        return self.entries[-1].sequence
+
+    def append(self, style: str, key: ID, deleted: bool = False) -> JournalEntry:
+        entry = JournalEntry(self.sequence + 1, style, str(key), deleted)
+        self.entries.append(entry)
+        return entry
+
+    def extend(self, writes: Iterable[Tuple[str, ID, bool]]) -> List[JournalEntry]:
+        return [
+            self.append(style, key, deleted)
+            for (style, key, deleted) in writes
+        ]
+
+    def sync(self) -> None:
+        pass
+
+    def tail(self, after: int = 0) -> Iterator[JournalEntry]:
+        sequences = [entry.sequence for entry in self.entries]
+        yield from self.entries[bisect_right(sequences, after):]
+
+    def last(self, style: str) -> int:
+        # The sequence of the latest entry for the style, or 0.
+        for entry in reversed(self.entries):
+            if (entry.style == style):
+                return entry.sequence
+        return 0
+
+
+class FileJournal(Journal):
+    # Entries are appended to a single file as length-prefixed MessagePack
+    # frames. The end of the file and the last sequence number are cached per
+    # path, so appending doesn't reread the journal unless another process
+    # has written to it, and neither is the latest entry for each style.
+    # Every mark_size entries, the position after the entry is marked too,
+    # so tail() starts reading near where it's asked.
+    positions: Dict[Path, Tuple[int, int]] = dict()
+    lasts: Dict[Path, Dict[str, int]] = dict()
+    marks: Dict[Path, List[Tuple[int, int]]] = dict()
+    mark_size = 256
+    decoder = msgspec.msgpack.Decoder(JournalEntry)
+
+    def __init__(self, path: Path) -> None:
+        self.path = path.resolve()
+
+    def read_entries(self, stream: BinaryIO) -> Iterator[Tuple[JournalEntry, int]]:
+        frames = read_frames(stream)
+        while (True):
+            try:
+                frame = next(frames)
+            except (StopIteration, EOFError):
+                # A torn write at the end of the journal is ignored.
+                return
+            yield (self.decoder.decode(frame), stream.tell())
+
+    def refresh(self) -> Tuple[int, int]:
+        size = self.path.stat().st_size if self.path.exists() else 0
+        (position, sequence) = self.positions.get(self.path, (0, 0))
+        if (position == size):
+            return (position, sequence)
+        if (position > size):
+            (position, sequence) = (0, 0)
+            self.marks.pop(self.path, None)
+            self.lasts.pop(self.path, None)
+        with self.path.open('rb') as stream:
+            stream.seek(position)
+            for (entry, end) in self.read_entries(stream):
+                (position, sequence) = (end, entry.sequence)
+                self.note(entry, position)
+        self.positions[self.path] = (position, sequence)
+        return (position, sequence)
+
+    def note(self, entry: JournalEntry, position: int) -> None:
+        self.lasts.setdefault(self.path, dict())[entry.style] = entry.sequence
+        if (entry.sequence % self.mark_size != 0):
+            return
+        marks = self.marks.setdefault(self.path, [])
+        if (len(marks) == 0 or marks[-1][0] < entry.sequence):
+            marks.append((entry.sequence, position))
+
+    def last(self, style: str) -> int:
+        self.refresh()
+        return self.lasts.get(self.path, dict()).get(style, 0)
+
+    @property
+    def sequence(self) -> int:
+        return self.refresh()[1]
+
+    def append(self, style: str, key: ID, deleted: bool = False) -> JournalEntry:
+        return self.extend([(style, key, deleted)])[0]
+
+    def extend(self, writes: Iterable[Tuple[str, ID, bool]]) -> List[JournalEntry]:
+        writes = list(writes)
+        with append_locked(self.path) as stream:
+            # Read to the end under the lock, so sequence numbers follow
+            # other processes' entries and only a tail that doesn't decode
+            # is cut off.
+            (position, sequence) = self.refresh()
+            entries = [
+                JournalEntry(sequence + count, style, str(key), deleted)
+                for (count, (style, key, deleted)) in enumerate(writes, 1)
+            ]
+            frames = [encode_frame(entry) for entry in entries]
+            if (stream.tell() > position):
+                stream.truncate(position)
+            stream.write(b''.join(frames))
+            for (entry, frame) in zip(entries, frames):
+                (position, sequence) = (position + len(frame), entry.sequence)
+                self.note(entry, position)
+            self.positions[self.path] = (position, sequence)
+        return entries
+
+    def sync(self) -> None:
+        if (self.path.exists()):
+            fsync_path(self.path)
+
+    def tail(self, after: int = 0) -> Iterator[JournalEntry]:
+        if (not self.path.exists()):
+            return
+        self.refresh()
+        marks = self.marks.get(self.path, [])
+        start = bisect_right(marks, after, key=lambda mark: mark[0]) - 1
+        with self.path.open('rb') as stream:
+            if (start >= 0):
+                stream.seek(marks[start][1])
+            for (entry, _) in self.read_entries(stream):
+                if (entry.sequence > after):
+                    yield entry
+
+
+class JournalConnection(Connection[VT]):
+    def __init__(self, store: Connection[VT], journal: Journal, style: str) -> None:
+        self.store = store
+        self.journal = journal
+        self.style = style
+
+    # Entries are on disk before the write they record, so a crash can
+    # leave an entry for a write that didn't happen but never the other way
+    # around. Copies following the journal just find the item unchanged.
+    def __setitem__(self, __key: ID, __value: VT) -> None:
+        self.journal.append(self.style, __key)
+        self.journal.sync()
+        self.store[__key] = __value
+
+    def __delitem__(self, __key: ID) -> None:
+        if (__key not in self.store):
+            raise KeyError
+        self.journal.append(self.style, __key, deleted=True)
+        self.journal.sync()
+        del self.store[__key]
+
+    def __getitem__(self, __key: ID) -> VT:
+        return self.store[__key]
+
+    def __iter__(self) -> Iterator[ID]:
+        return self.store.__iter__()
+
+    def __len__(self) -> int:
+        return self.store.__len__()
+
+    def __contains__(self, __key: object) -> bool:
+        return self.store.__contains__(__key)
+
+    def items(self):
+        return self.store.items()
+
+    def values(self):
+        return self.store.values()
+
+    def get_many(self, keys: Iterable[ID]) -> Iterator[Tuple[ID, VT]]:
+        return self.store.get_many(keys)
+
+    def select_keys(self, column: str, value: str, prefix: bool = False) -> Iterator[ID] | None:
+        return self.store.select_keys(column, value, prefix)
+
+    def select(self, column: str, value: str, prefix: bool = False) -> Iterator[Tuple[ID, VT]] | None:
+        return self.store.select(column, value, prefix)
@@ -0,0 +1,134 @@
+from collections import defaultdict
+import re
+from typing import Dict, Iterable, List, Set, Tuple
+from urllib.parse import unquote
+
+import msgspec
+from linki.article import BaseArticle
+from linki.config import ConfigCollection
+from linki.connection import Connection
+from linki.id import ID, Label, LabelID
+from linki.postings import PostingItem, PostingList
+
+MARKDOWN_LINK = re.compile(r'\[[^\]]*\]\(\s*<?([^)\s>]+)>?(?:\s+"[^"]*")?\s*\)')
+REDIRECT_LINK = re.compile(r'\[redirect:[^#\]]*#([a-f0-9]{56})\]')
+SCHEME = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*:')
+
+
+class LinkList(msgspec.Struct, frozen=True):
+    ids: Tuple[str, ...] = ()
+
+
+class LinkIndex():
+    # The titles each title links to, and the reverse, so "what links here"
+    # is a single read. A title's forward links are kept so an edit only
+    # touches the backlinks of the links that changed, and backlinks are a
+    # PostingList so that touch doesn't rewrite them. Backlinks to a title
+    # are kept when it's cleared, since the titles linking to it still do.
+    def __init__(
+        self,
+        connection: Connection[LinkList | PostingItem],
+        config: ConfigCollection | None = None
+    ) -> None:
+        self.store = connection
+        self.config = config
+
+    @staticmethod
+    def resolve(parents: Tuple[str, ...], target: str) -> ID | None:
+        # Targets are read like the web viewer reads them, relative to the
+        # title's group unless they start with a slash.
+        if (SCHEME.match(target) or target.startswith('//')):
+            return None
+        target = unquote(target.split('#')[0].split('?')[0])
+        if (LabelID.isValidID(target)):
+            return ID(target)
+        if (target.startswith('/')):
+            crumbs = target.strip('/').split('/')
+            path = crumbs[1:] if crumbs[0] in {'w', 'api'} else crumbs
+        else:
+            path = list(parents)
+            for crumb in target.split('/'):
+                if (crumb == '..'):
+                    path = path[:-1]
+                elif (crumb not in {'', '.'}):
+                    path.append(crumb)
+        if (len(path) == 0):
+            return None
+        if (len(path) == 1 and LabelID.isValidID(path[0])):
+            return ID(path[0])
+        try:
+            return Label(path).labelId
+        except AttributeError:
+            return None
+
+    @classmethod
+    def get_links(cls, title: BaseArticle) -> Set[ID]:
+        links: Set[ID] = set()
+        if (title.redirect is not None):
+            links.add(title.redirect.labelId)
+        for labelId in REDIRECT_LINK.findall(title.content):
+            links.add(ID(labelId))
+        for target in MARKDOWN_LINK.findall(title.content):
+            labelId = cls.resolve(title.label.parents, target)
+            if (labelId is not None):
+                links.add(labelId)
+        links.discard(title.label.labelId)
+        return links
+
+    @staticmethod
+    def get_forward_key(labelId: ID) -> ID:
+        return LabelID.getLabelID(('links-to:', labelId))
+
+    def get_backward_list(self, labelId: ID) -> PostingList:
+        return PostingList(self.store, 'links-from', labelId)
+
+    def is_indexed(self) -> bool:
+        if (self.config is None):
+            return True
+        return self.config.has_link_index()
+
+    def get_outlinks(self, labelId: ID) -> List[ID]:
+        links = self.store.get(self.get_forward_key(labelId), LinkList())
+        return [ID(link) for link in links.ids]
+
+    def get_backlinks(self, labelId: ID) -> List[ID]:
+        return [ID(link) for link in sorted(self.get_backward_list(labelId).get())]
+
+    def index_title(self, title: BaseArticle):
+        self.update(title.label.labelId, self.get_links(title))
+
+    def remove_title(self, labelId: ID):
+        self.update(labelId, set())
+
+    def update(self, labelId: ID, links: Set[ID]):
+        # Each backlink that changed is one posting change, however many
+        # titles link to its target.
+        key = self.get_forward_key(labelId)
+        old = set(self.get_outlinks(labelId))
+        if (old == links):
+            return
+        for link in old - links:
+            self.get_backward_list(link).remove(labelId)
+        for link in links - old:
+            self.get_backward_list(link).add(labelId)
+        if (len(links) == 0):
+            del self.store[key]
+        else:
+            self.store[key] = LinkList(tuple(sorted(links)))
+
+    def reindex(self, titles: Iterable[BaseArticle]):
+        for key in list(self.store):
+            del self.store[key]
+        backlinks: Dict[ID, List[str]] = defaultdict(list)
+        for title in titles:
+            labelId = title.label.labelId
+            links = self.get_links(title)
+            if (len(links) == 0):
+                continue
+            self.store[self.get_forward_key(labelId)] = LinkList(tuple(sorted(links)))
+            for link in links:
+                backlinks[link].append(str(labelId))
+        for (labelId, ids) in backlinks.items():
+            self.get_backward_list(labelId).set(ids)
+        if (self.config is not None):
+            self.config.set_link_index(True)
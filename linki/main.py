@@ -5,11 +5,11 @@ import pypandoc
 import typer
 from linki.contribution import Contribution
 
-from linki.editor import FileCopier, FileEditor
+from linki.editor import FileCopier, FileEditor, UnloadCount
 from linki.inbox import Inbox
 from linki.outbox import Outbox
 from linki.repository import FileRepository, Repository
-from linki.viewer import WebView, WebViewConf
+from linki.viewer import RenderCache, Renderer, WebView, WebViewConf
 from linki import __version__
 
 app = typer.Typer(
@@ -20,20 +20,28 @@ app = typer.Typer(
 )
 
 
+def echo_unload(count: UnloadCount):
+    typer.echo(
+        f"Wrote {count.written} files, skipped {count.skipped} and removed {count.removed}.")
+
+
 @app.command()
 def init(
     destination: Path = typer.Argument(Path.cwd()),
-    silent: bool = typer.Option(False)
+    silent: bool = typer.Option(False),
+    storage: str = typer.Option('path'),
 ):
     """
     This is how you get started!
 
     Just go ahead and run it in the folder you want to use as your linki, or give it the destination of where you want your linki.
+
+    Use --storage=pack to keep each part of the linki in a single packfile instead of one file per item. This is faster for large wikis. Use --storage=sqlite to keep each part in an indexed SQLite database, which is faster still for copies and changes of part of a large wiki.
     """
     if (not destination.exists()):
         destination.mkdir()
     try:
-        FileRepository.createPath(destination)
+        FileRepository.createPath(destination, storage)
         if (not silent):
             typer.echo(f"Initialized wiki in {destination}.")
     except FileExistsError:
@@ -41,12 +49,16 @@ def init(
             typer.echo(
                 f"{destination} already initialized. No action was taken.")
         typer.Abort()
+    except ValueError as e:
+        typer.echo(str(e))
+        raise typer.Abort()
 
 
 @app.command()
 def publish(
     location: Path = typer.Argument(Path.cwd()),
-    contribute: bool = typer.Option(False)
+    contribute: bool = typer.Option(False),
+    verbose: bool = typer.Option(False),
 ):
     """
     Write your drafts to the linki.
@@ -64,8 +76,10 @@ def publish(
     editor = FileEditor.fromPath(location)
     editor.load_drafts()
     x = editor.publish_drafts()
-    editor.unload_titles()
+    unloaded = editor.unload_titles()
     typer.echo(f"Published {x} drafts.")
+    if (verbose):
+        echo_unload(unloaded)
     if (contribute):
         outbox = Outbox(editor.repo)
         update_count = outbox.send_updates()
@@ -74,22 +88,28 @@ def publish(
 
 
 @app.command()
-def copy(source: str, destination: Path = typer.Argument(Path.cwd(), file_okay=False)):
+def copy(
+    source: str,
+    destination: Path = typer.Argument(Path.cwd(), file_okay=False),
+    verbose: bool = typer.Option(False),
+):
     """
     Replicate another wiki
 
     Do you like something you see on someone else's linki? Go ahead and run this command pointing at the linki you'd like to replicate. It'll copy over the whole linki and all of its history. Its yours to change and host now.
     """
     if (not destination.exists()):
-        init(destination, True)
+        init(destination, True, 'path')
     source_repo = Repository(source)
     copier = FileCopier(source_repo, destination)
 
     articles_count = copier.copy_articles()
     titles_count = copier.copy_titles()
-    copier.unload_titles()
+    unloaded = copier.unload_titles()
 
     typer.echo(f"Copied {titles_count} titles and {articles_count} articles.")
+    if (verbose):
+        echo_unload(unloaded)
 
 
 @app.command()
@@ -116,7 +136,9 @@ def subscribe(
 @app.command()
 def inbox(
     location: Path = typer.Option(Path.cwd()),
-    copy_id: Optional[str] = typer.Argument(None)
+    copy_id: Optional[str] = typer.Argument(None),
+    timeout: float = typer.Option(30.0),
+    verbose: bool = typer.Option(False),
 ):
     """
     See changes from your subscriptions and contributions
@@ -125,7 +147,12 @@ def inbox(
     """
     repo = FileRepository.fromPath(location)
     inbox = Inbox(repo)
-    inbox.load_inbox()
+    for report in inbox.load_inbox(timeout=timeout):
+        if (report.error is not None):
+            typer.echo(f"Couldn't load {report.url}: {report.error}")
+        elif (verbose):
+            typer.echo(
+                f"Loaded {report.count} changes from {report.url} in {report.elapsed:.2f}s.")
     if (copy_id is None):
         output = ''.join(inbox.render_inbox())
     else:
@@ -162,7 +189,8 @@ def refuse(
 def approve(
     location: Path = typer.Option(Path.cwd()),
     copy_id: str = typer.Argument(None),
-    list: bool = typer.Option(False)
+    list: bool = typer.Option(False),
+    verbose: bool = typer.Option(False),
 ):
     """
     Accept a change
@@ -176,8 +204,10 @@ def approve(
         try:
             inbox = Inbox(editor.repo)
             inbox.approve(copy_id)
-            editor.unload_titles()
+            unloaded = editor.unload_titles()
             typer.echo(f"Approving contribution {copy_id}")
+            if (verbose):
+                echo_unload(unloaded)
         except IndexError:
             typer.echo("Change ID not found.")
             typer.Abort()
@@ -230,6 +260,86 @@ def serve(
     viewer.run(host, port)
 
 
+@app.command()
+def search(
+    query: str,
+    location: Path = typer.Option(Path.cwd()),
+    limit: int = typer.Option(20),
+):
+    """
+    Find titles in your linki
+
+    Lists the titles that contain every word of your search, with the ones named after it first.
+    """
+    repo = FileRepository.fromPath(location)
+    entries = repo.titles.search(query, limit)
+    if (len(entries) == 0):
+        typer.echo(f"No titles found for {query}.")
+    for entry in entries:
+        typer.echo('/'.join(entry.label.path))
+
+
+@app.command()
+def migrate(
+    location: Path = typer.Argument(Path.cwd()),
+    storage: str = typer.Option(...),
+):
+    """
+    Change how your linki is stored
+
+    Moves everything in your linki over to another storage. Use --storage=pack to keep each part of the linki in a single packfile, --storage=sqlite to keep it in an indexed SQLite database, or --storage=path to go back to one file per item.
+    """
+    repo = FileRepository.fromPath(location)
+    try:
+        count = repo.migrate(storage)
+    except ValueError as e:
+        typer.echo(str(e))
+        raise typer.Abort()
+    typer.echo(f"Migrated {count} items to {storage} storage.")
+
+
+@app.command()
+def repack(
+    location: Path = typer.Argument(Path.cwd()),
+):
+    """
+    Shrink your linki's packfiles
+
+    Packfiles only ever grow as items are changed, so this rewrites them with just the current items. linki also does this on its own once most of a packfile is old items.
+    """
+    repo = FileRepository.fromPath(location)
+    if (repo.connection.storage != 'pack'):
+        typer.echo("Only pack storage needs repacking.")
+        return
+    (before, after) = repo.repack()
+    typer.echo(f"Repacked {before} bytes down to {after} bytes.")
+
+
+@app.command()
+def render(
+    location: Path = typer.Argument(Path.cwd()),
+    workers: Optional[int] = typer.Option(None),
+):
+    """
+    Get your titles ready for the web
+
+    Renders every title ahead of time so that `linki serve` doesn't have to when someone first visits it. Titles that were already rendered are skipped.
+
+    To render titles, you must have pandoc installed. You can install it with `linki install-pandoc`
+    """
+    try:
+        pypandoc.get_pandoc_path()
+    except OSError:
+        typer.echo(
+            "Pandoc not found. Install pandoc with linki install-pandoc.")
+        raise typer.Abort()
+    repo = FileRepository.fromPath(location)
+    renderer = Renderer(RenderCache.fromRepository(repo), workers)
+    count = renderer.prewarm(repo.titles.get_titles())
+    renderer.close()
+    typer.echo(f"Rendered {count} titles.")
+
+
 @ app.command(hidden=True)
 def install_pandoc():
     """
@@ -0,0 +1,137 @@
+from typing import Dict, Iterable, List, Set, Tuple
+
+import msgspec
+from linki.connection import Connection
+from linki.id import ID, LabelID
+
+
+class Postings(msgspec.Struct, frozen=True):
+    # Every id in the list, as of the last merge.
+    ids: Tuple[str, ...] = ()
+
+
+class PostingChange(msgspec.Struct, frozen=True):
+    label: str
+    added: bool = True
+
+
+class PostingCount(msgspec.Struct, frozen=True):
+    # How many changes a list has had since it was last merged, and how many
+    # ids it held then.
+    changes: int = 0
+    size: int = 0
+
+
+PostingItem = Postings | PostingChange | PostingCount
+
+
+class PostingList():
+    # A set of ids that's never rewritten to add or remove one of them. Each
+    # id added or removed is written as its own change, and the changes are
+    # merged into the ids once there are enough of them to be worth
+    # rewriting it, so a change costs about the same however long the list
+    # gets.
+    merge_size = 32
+
+    def __init__(self, connection: Connection[PostingItem], name: str, part: str) -> None:
+        self.store = connection
+        self.name = name
+        self.part = part
+        self.key = LabelID.getLabelID((f'{name}:', part))
+        self.count_key = LabelID.getLabelID((f'{name}-count:', part))
+
+    def get_key(self) -> ID:
+        return self.key
+
+    def get_count_key(self) -> ID:
+        return self.count_key
+
+    def get_change_key(self, change: int) -> ID:
+        return LabelID.getLabelID((f'{self.name}-change:', self.part, ':', str(change)))
+
+    def get_count(self) -> PostingCount:
+        return self.store.get(self.get_count_key(), PostingCount())
+
+    def add(self, id: str):
+        self.change(PostingChange(str(id), True))
+
+    def remove(self, id: str):
+        self.change(PostingChange(str(id), False))
+
+    def change(self, change: PostingChange):
+        count = self.get_count()
+        count = PostingCount(count.changes + 1, count.size)
+        self.store[self.get_change_key(count.changes)] = change
+        self.store[self.get_count_key()] = count
+        # Merging rewrites the ids, so it waits for a share of their number
+        # in changes and costs a few ids per change.
+        if (count.changes >= max(self.merge_size, count.size // 4)):
+            self.merge()
+
+    def is_empty(self) -> bool:
+        # Without reading the ids when there were more of them at the last
+        # merge than changes since.
+        count = self.get_count()
+        if (count.size > count.changes):
+            return False
+        return len(self.get()) == 0
+
+    def get(self) -> Set[str]:
+        return self.read_many(self.store, [self])[0]
+
+    @staticmethod
+    def read_many(
+        connection: Connection[PostingItem],
+        lists: List['PostingList']
+    ) -> List[Set[str]]:
+        # Reads any number of lists with two get_many calls.
+        counts: Dict[ID, PostingCount] = dict(
+            connection.get_many(posting.get_count_key() for posting in lists))
+        keys: List[ID] = []
+        for posting in lists:
+            count = counts.get(posting.get_count_key(), PostingCount())
+            keys.append(posting.get_key())
+            keys.extend(
+                posting.get_change_key(change)
+                for change in range(1, count.changes + 1)
+            )
+        found = dict(connection.get_many(keys))
+        results: List[Set[str]] = []
+        for posting in lists:
+            ids = set(found.get(posting.get_key(), Postings()).ids)
+            count = counts.get(posting.get_count_key(), PostingCount())
+            for change in range(1, count.changes + 1):
+                item = found.get(posting.get_change_key(change))
+                if (not isinstance(item, PostingChange)):
+                    continue
+                if (item.added):
+                    ids.add(item.label)
+                else:
+                    ids.discard(item.label)
+            results.append(ids)
+        return results
+
+    def merge(self):
+        ids = self.get()
+        self.clear_changes()
+        self.set(ids)
+
+    def clear_changes(self):
+        for change in range(1, self.get_count().changes + 1):
+            key = self.get_change_key(change)
+            if (key in self.store):
+                del self.store[key]
+
+    def set(self, ids: Iterable[str]):
+        ids = tuple(sorted(ids))
+        if (len(ids) == 0):
+            for key in [self.get_key(), self.get_count_key()]:
+                if (key in self.store):
+                    del self.store[key]
+            return
+        self.store[self.get_key()] = Postings(ids)
+        self.store[self.get_count_key()] = PostingCount(0, len(ids))
+
+    def clear(self):
+        self.clear_changes()
+        self.set(())
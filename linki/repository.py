@@ -1,16 +1,26 @@
+from contextlib import ExitStack, contextmanager
+import fcntl
+from functools import cached_property
+import os
+from io import BytesIO
 from pathlib import Path
-from typing import Dict, List
+import shutil
+from typing import BinaryIO, Dict, Tuple
 from urllib.parse import ParseResult
 
-import msgspec
-from linki.article import BaseArticle, ArticleCollection
-from linki.config import ConfigCollection
-from linki.connection import MemoryConnection, ROWebConnection, Connection, PathConnection
-from linki.draft import DraftCollection, ShadowCollection
+from linki.article import ArticleConnection, ArticleRecord, BaseArticle, ArticleCollection, get_record_columns
+from linki.config import AuthDetails, ConfigCollection, Version
+from linki.connection import Codec, MemoryConnection, PackConnection, ROWebConnection, Connection, PathConnection, SqliteConnection, decode_stream, fsync_path
+from linki.draft import DraftCollection, Shadow, ShadowCollection
 from linki.id import ID
-from linki.change import ChangeCollection
+from linki.journal import FileJournal, Journal, JournalConnection
+from linki.transaction import Transaction, TransactionConnection
+from linki.change import Change, ChangeCollection, get_change_columns
 from linki.url import URL, URLCollection
-from linki.title import BaseArticle, TitleCollection
+from linki.title import BaseArticle, TitleChanges, TitleCollection, TitleEntry, get_entry_columns
+from linki.links import LinkIndex, LinkList
+from linki.postings import PostingChange, PostingCount, Postings
+from linki.search import SearchDocument, SearchIndex
 from linki.user import ContributorCollection
 
 
@@ -18,6 +28,28 @@ class RepositoryConnection:
     root: ParseResult
     url: ParseResult
     path: tuple[str]
+    transaction: Transaction | None = None
+    storages: Dict[str, type[PathConnection]] = {
+        'path': PathConnection,
+        'pack': PackConnection,
+        'sqlite': SqliteConnection,
+    }
+    # Values of types a style doesn't list, like the refusal sets in config,
+    # are stored as pickles.
+    codecs: Dict[str, Codec] = {
+        'titles': Codec(ArticleRecord, BaseArticle, columns=get_record_columns),
+        'drafts': Codec(ArticleRecord, BaseArticle, columns=get_record_columns),
+        'articles': Codec(ArticleRecord, BaseArticle, columns=get_record_columns),
+        'labels': Codec(TitleEntry, columns=get_entry_columns),
+        'shadows': Codec(Shadow),
+        'changes': Codec(Change, columns=get_change_columns),
+        'search': Codec(SearchDocument, Postings, PostingChange, PostingCount),
+        'links': Codec(LinkList, Postings, PostingChange, PostingCount),
+        'users': Codec(str),
+        'config': Codec(AuthDetails, Version, bool, int, list),
+        'subs': Codec(URL),
+        'contribs': Codec(URL),
+    }
 
     def __init__(self, url: str) -> None:
         self.url = URL(url).parsed
@@ -38,25 +70,255 @@ class RepositoryConnection:
                     raise FileNotFoundError(
                         '.linki folder not found. Maybe you need to initialize it?')
                 self.root = root
+                self.recover()
             case 'https':
                 # TODO Assumes installed to root path
                 root = URL(url)
-                root.parsed = root.parsed._replace(path='')
+                root.parsed = root.parsed._replace(
+                    path='/', params='', query='', fragment='')
                 root = root.parsed.geturl()
                 self.root = URL(root).parsed
+                path = tuple(crumb for crumb in self.url.path.split('/') if crumb)
+                if (len(path) > 0 and path[0] in ['w', 'api', 'copy']):
+                    path = path[1:]
+                self.path = path  # type: ignore
+                if (len(path) == 0):
+                    self.url = self.root
+
+    @cached_property
+    def storage(self) -> str:
+        match self.root.scheme:
+            case 'file':
+                return self.get_storage(self.root.path)
+            case _:
+                return 'path'
+
+    @staticmethod
+    def get_storage(path: str) -> str:
+        storage = Path(path).resolve().joinpath('.linki', 'storage')
+        if (not storage.exists()):
+            return 'path'
+        return storage.read_text().strip()
+
+    @classmethod
+    def check_storage(cls, storage: str) -> None:
+        if (storage not in cls.storages):
+            storages = ', '.join(cls.storages)
+            raise ValueError(
+                f'Invalid storage. Must be one of these: {storages}')
+
+    @classmethod
+    def set_storage(cls, path: str, storage: str) -> None:
+        cls.check_storage(storage)
+        root = Path(path).resolve().joinpath('.linki')
+        root.joinpath('storage').write_text(storage)
+
+    def reload_storage(self) -> bool:
+        # Reads the storage again, since a migration in another process may
+        # have changed it. True if it did.
+        if (self.root.scheme != 'file'):
+            return False
+        storage = self.get_storage(self.root.path)
+        if (storage == self.storage):
+            return False
+        self.__dict__['storage'] = storage
+        return True
 
     def get_style(self, style: str) -> Connection:
+        if (self.transaction is None):
+            return self.open_style(style)
+        connection = self.get_store(self.transaction, style)
+        return TransactionConnection(connection, self.transaction, style)
+
+    def get_store(self, transaction: Transaction, style: str) -> Connection:
+        connection = transaction.stores.get(style)
+        if (connection is None):
+            connection = transaction.stores[style] = self.open_style(style)
+        return connection
+
+    def open_style(self, style: str) -> Connection:
         match self.root.scheme:
             case 'file':
                 path = PathConnection.get_path(self.root.path, style)
-                return PathConnection(path)
+                if (not path.exists()):
+                    # Styles added after the wiki was created.
+                    path.mkdir()
+                return self.storages[self.storage](path, self.codecs.get(style))
             case 'ssh':
                 raise NotImplementedError
             case 'https':
-                return ROWebConnection(self.root, style)
+                item_type = TitleEntry if style == 'labels' else BaseArticle
+                return ROWebConnection(self.root, style, item_type, self.path)
             case _:
                 raise NotImplementedError
 
+    def get_journal(self) -> Journal | None:
+        if (self.transaction is not None):
+            return self.transaction.journal
+        return self.open_journal()
+
+    def open_journal(self) -> Journal | None:
+        match self.root.scheme:
+            case 'file':
+                root = Path(self.root.path).resolve().joinpath('.linki')
+                return FileJournal(root.joinpath('journal'))
+            case _:
+                return None
+
+    def get_transaction_path(self) -> Path | None:
+        match self.root.scheme:
+            case 'file':
+                root = Path(self.root.path).resolve().joinpath('.linki')
+                return root.joinpath('transaction')
+            case _:
+                return None
+
+    def get_migration_path(self) -> Path | None:
+        path = self.get_transaction_path()
+        return None if path is None else path.with_name('migrate')
+
+    @contextmanager
+    def lock(self):
+        # Held while a transaction is applied or recovered, so another
+        # process opening the wiki waits instead of replaying it too.
+        path = self.get_transaction_path()
+        if (path is None):
+            yield
+            return
+        with path.with_name('lock').open('a') as stream:
+            fcntl.flock(stream.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(stream.fileno(), fcntl.LOCK_UN)
+
+    def commit(self, transaction: Transaction):
+        # The transaction is saved before any of it is applied, and replayed
+        # by recover() if applying it gets interrupted. It's only removed
+        # once everything it wrote is on disk.
+        path = self.get_transaction_path()
+        with self.lock():
+            if (self.reload_storage()):
+                # Migrated while this waited, so the stores it opened are
+                # gone.
+                transaction.stores.clear()
+            if (path is not None):
+                transaction.save(path)
+            self.apply(transaction)
+            if (path is not None):
+                self.finish(path)
+            self.repack(force=False)
+
+    def finish(self, path: Path):
+        path.unlink()
+        fsync_path(path.parent)
+
+    def apply(self, transaction: Transaction):
+        # The journal goes first, as in JournalConnection.
+        journal = self.open_journal()
+        if (journal is not None):
+            journal.extend(
+                (entry.style, entry.key, entry.deleted)
+                for entry in transaction.journal.entries
+            )
+            journal.sync()
+        connections: Dict[str, Connection] = dict()
+        with ExitStack() as batches:
+            for ((style, key), (deleted, value)) in transaction.writes.items():
+                connection = connections.get(style)
+                if (connection is None):
+                    connection = connections[style] = self.get_store(
+                        transaction, style)
+                    batches.enter_context(connection.batch())
+                if (not deleted):
+                    connection[key] = value
+                elif (key in connection):
+                    del connection[key]
+        for connection in connections.values():
+            connection.sync()
+
+    def repack(self, force: bool = True) -> Tuple[int, int]:
+        # Rewrites the packs of every style, or only those that are mostly
+        # dead records unless forced. Styles written outside a transaction
+        # are caught by the next commit. Callers hold the lock. Returns the
+        # size of the rewritten packs before and after.
+        path = self.get_transaction_path()
+        if (path is None or self.storage != 'pack'):
+            return (0, 0)
+        (before, after) = (0, 0)
+        for style_path in sorted(path.parent.iterdir()):
+            if (not style_path.is_dir() or '.' in style_path.name):
+                continue
+            connection = self.open_style(style_path.name)
+            if (not isinstance(connection, PackConnection)):
+                continue
+            if (not force and not connection.should_repack()):
+                continue
+            before += self.get_size(connection)
+            connection.repack()
+            connection.sync()
+            after += self.get_size(connection)
+        return (before, after)
+
+    @staticmethod
+    def get_size(connection: PackConnection) -> int:
+        return sum(
+            path.stat().st_size
+            for path in (connection.pack, connection.idx, connection.column_path)
+            if path.exists()
+        )
+
+    def start_migration(self, storage: str):
+        # Once this is on disk, the styles written out by the migration are
+        # swapped in even if it gets interrupted.
+        path = self.get_migration_path()
+        if (path is None):
+            return
+        temporary = path.with_name(f'{path.name}.tmp')
+        with temporary.open('w') as stream:
+            stream.write(storage)
+            stream.flush()
+            os.fsync(stream.fileno())
+        temporary.replace(path)
+        fsync_path(path.parent)
+
+    def finish_migration(self):
+        # Every step can be repeated, so recover() picks up wherever an
+        # interrupted one stopped. Callers hold the lock.
+        path = self.get_migration_path()
+        if (path is None or not path.exists()):
+            return
+        root = path.parent
+        for target in sorted(root.glob('*.migrate')):
+            style = target.with_suffix('')
+            if (style.exists()):
+                style.rename(style.with_suffix('.old'))
+            target.rename(style)
+        self.set_storage(str(root.parent), path.read_text().strip())
+        fsync_path(root.joinpath('storage'))
+        fsync_path(root)
+        for old in root.glob('*.old'):
+            shutil.rmtree(old)
+        self.finish(path)
+        self.reload_storage()
+
+    def recover(self):
+        path = self.get_transaction_path()
+        migration = self.get_migration_path()
+        if (path is None or migration is None):
+            return
+        if (not path.exists() and not migration.exists()):
+            return
+        with self.lock():
+            self.finish_migration()
+            # Another process may have finished it while this one waited.
+            if (not path.exists()):
+                return
+            transaction = Transaction.load(path)
+            if (transaction is not None):
+                self.apply(transaction)
+            self.finish(path)
+
     def create_style(self, style: str):
         match self.root.scheme:
             case 'file':
@@ -70,18 +332,57 @@ class RepositoryConnection:
 
 
 class Repository:
-    styles = {'titles', 'subs', 'contribs',
-              'drafts', 'articles', 'users', 'changes', 'config'}
+    styles = {'titles', 'subs', 'contribs', 'labels', 'search',
+              'links', 'drafts', 'articles', 'users', 'changes', 'config'}
 
     def __init__(self, url: str) -> None:
         self.connection = RepositoryConnection(url)
 
+    # Styles that record every write in the journal, which copies follow.
+    # The indexes and caches left out are rebuilt from these. config and
+    # shadows aren't rebuildable, but they're this wiki's own settings,
+    # credentials and working files, which copies never get.
+    journaled = {'titles', 'subs', 'contribs',
+                 'drafts', 'articles', 'users', 'changes'}
+
     def __init_subclass__(cls, styles: set[str] | None = None) -> None:
         if (styles is not None):
             cls.styles |= styles
 
-    def get_item(self, style: str, item_id: ID):
+    @property
+    def journal(self) -> Journal | None:
+        return self.connection.get_journal()
+
+    @contextmanager
+    def transaction(self):
+        # Writes inside the block are held in memory and committed together
+        # when it exits, or dropped if it raises.
+        if (self.connection.transaction is not None):
+            yield self.connection.transaction
+            return
+        transaction = Transaction(self.connection.open_journal())
+        self.connection.transaction = transaction
+        try:
+            yield transaction
+        finally:
+            self.connection.transaction = None
+        self.connection.commit(transaction)
+
+    def get_connection(self, style: str) -> Connection:
         connection = self.connection.get_style(style)
+        journal = self.journal
+        if (style in self.journaled and journal is not None):
+            connection = JournalConnection(connection, journal, style)
+        match style:
+            case 'articles':
+                return ArticleConnection(connection)
+            case 'titles' | 'drafts':
+                history = self.connection.get_style('articles')
+                return ArticleConnection(connection, history)
+        return connection
+
+    def get_item(self, style: str, item_id: ID):
+        connection = self.get_connection(style)
         if (connection is None):
             return None
         if (item_id not in connection):
@@ -89,10 +390,15 @@ class Repository:
         return connection.get(item_id)
 
     def get_collection(self, style: str):
-        connection = self.connection.get_style(style)
+        connection = self.get_connection(style)
         return list(connection.values())
 
-    def get_count(self, style: str):
+    def get_count(self, style: str, prefix: Tuple[str, ...] = ()):
+        match style:
+            case 'titles' if len(prefix) > 0:
+                return self.titles.get_count(prefix)
+            case 'articles' if len(prefix) > 0:
+                return self.articles.get_count(prefix)
         connection = self.connection.get_style(style)
         if (connection is None):
             return 0
@@ -100,38 +406,67 @@ class Repository:
 
     @property
     def titles(self) -> TitleCollection:
-        connection = self.connection.get_style('titles')
-        return TitleCollection(connection)
+        connection = self.get_connection('titles')
+        labels = self.connection.get_style('labels')
+        config = None
+        journal = None
+        if (self.connection.root.scheme != 'https'):
+            config = self.config
+            journal = self.journal
+        return TitleCollection(
+            connection, labels, config, journal,
+            self.search_index, self.link_index)
+
+    @property
+    def search_index(self) -> SearchIndex | None:
+        if (self.connection.root.scheme == 'https'):
+            return None
+        return SearchIndex(self.connection.get_style('search'), self.config)
+
+    @property
+    def link_index(self) -> LinkIndex | None:
+        if (self.connection.root.scheme == 'https'):
+            return None
+        return LinkIndex(self.connection.get_style('links'), self.config)
+
+    def get_title_changes(self, cursor: int) -> TitleChanges:
+        if (self.connection.root.scheme == 'https'):
+            remote = self.connection.get_style('titles')
+            return remote.fetch(f'since/titles?cursor={cursor}', TitleChanges)
+        return self.titles.get_changes(cursor)
 
     @property
     def subs(self) -> URLCollection:
-        connection = self.connection.get_style('subs')
+        connection = self.get_connection('subs')
         return URLCollection(connection)
 
     @property
     def contribs(self) -> URLCollection:
-        connection = self.connection.get_style('contribs')
+        connection = self.get_connection('contribs')
         return URLCollection(connection)
 
     @property
     def drafts(self) -> DraftCollection:
-        connection = self.connection.get_style('drafts')
+        connection = self.get_connection('drafts')
         return DraftCollection(connection)
 
     @property
     def articles(self) -> ArticleCollection:
-        connection = self.connection.get_style('articles')
+        connection = self.get_connection('articles')
         return ArticleCollection(connection)
 
     @property
     def users(self) -> ContributorCollection:
-        connection = self.connection.get_style('users')
+        connection = self.get_connection('users')
         return ContributorCollection(connection)
 
     @property
     def changes(self) -> ChangeCollection:
-        connection = self.connection.get_style('changes')
-        return ChangeCollection(connection)
+        connection = self.get_connection('changes')
+        config = None
+        if (self.connection.root.scheme != 'https'):
+            config = self.config
+        return ChangeCollection(connection, config)
 
     @property
     def config(self) -> ConfigCollection:
@@ -139,8 +474,10 @@ class Repository:
         return ConfigCollection(connection)
 
     @classmethod
-    def create(cls, base: str):
+    def create(cls, base: str, storage: str = 'path'):
         connection = RepositoryConnection(base)
+        if (connection.root.scheme == 'file'):
+            RepositoryConnection.set_storage(connection.root.path, storage)
         for style in cls.styles:
             connection.create_style(style)
 
@@ -162,10 +499,52 @@ class FileRepository(Repository, styles={'shadows'}):
         return cls(path)
 
     @classmethod
-    def createPath(cls, path: str | Path):
+    def createPath(cls, path: str | Path, storage: str = 'path'):
+        RepositoryConnection.check_storage(storage)
         Path(path).joinpath('.linki').mkdir()
         path = Path(path).resolve().as_uri()
-        cls.create(path)
+        cls.create(path, storage)
+
+    def migrate(self, storage: str) -> int:
+        RepositoryConnection.check_storage(storage)
+        root = self.path.joinpath('.linki')
+        # Held throughout, so commits wait for the new layout instead of
+        # writing to stores that are about to be replaced.
+        with self.connection.lock():
+            self.connection.reload_storage()
+            if (storage == self.connection.storage):
+                return 0
+            styles = [
+                style for style in self.styles
+                if root.joinpath(style).is_dir()
+            ]
+
+            # Write every style out next to the old one before swapping,
+            # so an interrupted migration leaves the old layout intact.
+            count = 0
+            for style in styles:
+                target = root.joinpath(f'{style}.migrate')
+                if (target.exists()):
+                    shutil.rmtree(target)
+                target.mkdir()
+                source = self.connection.get_style(style)
+                destination = RepositoryConnection.storages[storage](
+                    target, RepositoryConnection.codecs.get(style))
+                with destination.batch():
+                    for (key, value) in source.items():
+                        destination[key] = value
+                        count += 1
+                destination.sync()
+
+            self.connection.start_migration(storage)
+            self.connection.finish_migration()
+
+        self.connection = RepositoryConnection(self.path.as_uri())
+        return count
+
+    def repack(self) -> Tuple[int, int]:
+        with self.connection.lock():
+            return self.connection.repack()
 
     @property
     def shadows(self) -> ShadowCollection:
@@ -176,14 +555,22 @@ class FileRepository(Repository, styles={'shadows'}):
 class MemoryRepoConnection(RepositoryConnection):
     def __init__(self) -> None:
         self.connections: Dict[str, MemoryConnection] = dict()
+        self.journal = Journal()
         self.root = URL('').parsed
         self.url = URL('').parsed
         self.path = ('',)
 
-    def get_style(self, style: str) -> Connection:
+    def open_journal(self) -> Journal | None:
+        return self.journal
+
+    def get_transaction_path(self) -> Path | None:
+        return None
+
+    def open_style(self, style: str) -> Connection:
         conn = self.connections.get(style)
         if conn is None:
-            conn = MemoryConnection()
+            codec = self.codecs.get(style)
+            conn = MemoryConnection(None if codec is None else codec.get_columns)
             self.connections[style] = conn
         return self.connections[style]
 
@@ -193,7 +580,7 @@ class TemporaryRepository(Repository):
         self.connection = MemoryRepoConnection()
 
     @classmethod
-    def fromStreams(cls, **streams: bytes):
+    def fromStreams(cls, **streams: bytes | BinaryIO):
         repo = cls()
         for stream in streams:
             if stream not in cls.styles:
@@ -205,12 +592,13 @@ class TemporaryRepository(Repository):
                 style = BaseArticle
             if (style is None):
                 continue
-            items = msgspec.msgpack.decode(streams[stream], type=List[style])
-            d_conn = repo.connection.get_style(stream)
-            if (stream == 'articles'):
-                for item in items:
+            data = streams[stream]
+            if (isinstance(data, bytes)):
+                data = BytesIO(data)
+            d_conn = repo.get_connection(stream)
+            for item in decode_stream(data, style):
+                if (stream == 'articles'):
                     d_conn[item.articleId] = item
-            if (stream == 'titles'):
-                for item in items:
+                if (stream == 'titles'):
                     d_conn[item.label.labelId] = item
         return repo
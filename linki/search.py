@@ -0,0 +1,122 @@
+from collections import defaultdict
+import re
+from typing import Dict, Iterable, List, Set, Tuple
+
+import msgspec
+from linki.article import BaseArticle
+from linki.config import ConfigCollection
+from linki.connection import Connection
+from linki.id import ID, LabelID
+from linki.postings import PostingItem, PostingList
+
+TOKEN = re.compile(r'\w+')
+
+
+class SearchDocument(msgspec.Struct, frozen=True, kw_only=True):
+    # The tokens a title was last indexed under, so an edit only has to
+    # touch the postings that changed.
+    title: Tuple[str, ...] = ()
+    text: Tuple[str, ...] = ()
+
+
+class SearchIndex():
+    # An inverted index from each token to the titles that contain it. Tokens
+    # in a title's label are also kept as their own field, so titles named
+    # after the query come first. Each token's titles are a PostingList, so
+    # indexing a title costs about the same however many titles share its
+    # tokens.
+    min_length = 2
+
+    def __init__(
+        self,
+        connection: Connection[SearchDocument | PostingItem],
+        config: ConfigCollection | None = None
+    ) -> None:
+        self.store = connection
+        self.config = config
+
+    @classmethod
+    def tokenize(cls, text: str) -> Set[str]:
+        return {
+            token for token in TOKEN.findall(text.lower().replace('_', ' '))
+            if len(token) >= cls.min_length
+        }
+
+    @classmethod
+    def get_document(cls, title: BaseArticle) -> SearchDocument:
+        label = cls.tokenize(' '.join(title.label.path))
+        text = label | cls.tokenize(title.content)
+        return SearchDocument(title=tuple(sorted(label)), text=tuple(sorted(text)))
+
+    @staticmethod
+    def get_document_key(labelId: ID) -> ID:
+        return LabelID.getLabelID(('search-document:', labelId))
+
+    def get_postings(self, field: str, token: str) -> PostingList:
+        return PostingList(self.store, f'search-{field}', token)
+
+    def is_indexed(self) -> bool:
+        if (self.config is None):
+            return True
+        return self.config.has_search_index()
+
+    def index_title(self, title: BaseArticle):
+        labelId = title.label.labelId
+        old = self.store.get(self.get_document_key(labelId), SearchDocument())
+        new = self.get_document(title)
+        if (old == new):
+            return
+        self.update(labelId, old, new)
+        self.store[self.get_document_key(labelId)] = new
+
+    def remove_title(self, labelId: ID):
+        key = self.get_document_key(labelId)
+        old = self.store.get(key)
+        if (old is None):
+            return
+        self.update(labelId, old, SearchDocument())
+        del self.store[key]
+
+    def update(self, labelId: ID, old: SearchDocument, new: SearchDocument):
+        for field in ['title', 'text']:
+            (before, after) = (set(getattr(old, field)), set(getattr(new, field)))
+            for token in before - after:
+                self.get_postings(field, token).remove(labelId)
+            for token in after - before:
+                self.get_postings(field, token).add(labelId)
+
+    def match(self, field: str, tokens: List[str]) -> Set[str]:
+        matches: Set[str] | None = None
+        for token in tokens:
+            postings = self.get_postings(field, token).get()
+            matches = postings if matches is None else matches & postings
+            if (len(matches) == 0):
+                break
+        return matches or set()
+
+    def search(self, query: str, limit: int = 20) -> List[ID]:
+        # Titles with every token of the query, those with all of them in
+        # their label first.
+        tokens = sorted(self.tokenize(query))
+        if (len(tokens) == 0):
+            return []
+        text = self.match('text', tokens)
+        titled = self.match('title', tokens) & text
+        results = sorted(titled) + sorted(text - titled)
+        return [ID(labelId) for labelId in results[:limit]]
+
+    def reindex(self, titles: Iterable[BaseArticle]):
+        for key in list(self.store):
+            del self.store[key]
+        postings: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+        for title in titles:
+            labelId = title.label.labelId
+            document = self.get_document(title)
+            for field in ['title', 'text']:
+                for token in getattr(document, field):
+                    postings[(field, token)].append(str(labelId))
+            self.store[self.get_document_key(labelId)] = document
+        for ((field, token), ids) in postings.items():
+            self.get_postings(field, token).set(ids)
+        if (self.config is not None):
+            self.config.set_search_index(True)
@@ -0,0 +1,103 @@
+from contextlib import contextmanager
+import threading
+import time
+from typing import Any, Iterator
+
+from requests import Response, Session, Timeout
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Deadlines are per thread, since subscriptions are fetched in parallel
+# through the one shared session.
+local = threading.local()
+
+
+def get_remaining() -> float | None:
+    deadline = getattr(local, 'deadline', None)
+    if (deadline is None):
+        return None
+    return deadline - time.monotonic()
+
+
+class DeadlineRetry(Retry):
+    # Retries and their backoff stop at the thread's deadline.
+    def is_exhausted(self) -> bool:
+        remaining = get_remaining()
+        return super().is_exhausted() or (remaining is not None and remaining <= 0)
+
+    def get_backoff_time(self) -> float:
+        remaining = get_remaining()
+        backoff = super().get_backoff_time()
+        if (remaining is None):
+            return backoff
+        return max(0, min(backoff, remaining))
+
+
+class WebSession():
+    # Every request to another wiki goes through one pooled session, so
+    # connections are kept alive between requests, responses can be
+    # compressed and failed requests are retried with backoff.
+    timeout: float = 30.0
+    retries: int = 3
+    backoff: float = 0.5
+    pool_size: int = 16
+
+    def __init__(self) -> None:
+        self.session = Session()
+        retry = DeadlineRetry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            # Every request linki sends is safe to repeat.
+            allowed_methods=None,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry
+        )
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+    @contextmanager
+    def deadline(self, seconds: float | None) -> Iterator[None]:
+        # Every request this thread sends inside the block shares the one
+        # deadline, so a slow wiki gives up on time instead of each request
+        # waiting out its own timeout.
+        previous = getattr(local, 'deadline', None)
+        local.deadline = None
+        if (seconds is not None):
+            local.deadline = time.monotonic() + seconds
+        try:
+            yield
+        finally:
+            local.deadline = previous
+
+    def get_remaining(self) -> float | None:
+        remaining = get_remaining()
+        if (remaining is not None and remaining <= 0):
+            raise Timeout('deadline passed')
+        return remaining
+
+    def request(self, method: str, url: str, **kwargs: Any) -> Response:
+        kwargs.setdefault('timeout', self.timeout)
+        remaining = self.get_remaining()
+        if (remaining is not None):
+            kwargs['timeout'] = min(kwargs['timeout'], remaining)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs: Any) -> Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> Response:
+        return self.request('POST', url, **kwargs)
+
+
+shared: WebSession | None = None
+
+
+def get_session() -> WebSession:
+    global shared
+    if (shared is None):
+        shared = WebSession()
+    return shared
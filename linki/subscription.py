@@ -1,6 +1,7 @@
 from dataclasses import dataclass
-from typing import Iterator
+from typing import Dict, Iterator
 from linki.draft import BaseArticle, Draft
+from linki.id import ID
 from linki.title import TitleCollection
 
 
@@ -9,8 +10,22 @@ class Subscription():
     titles: TitleCollection
     remote: TitleCollection
 
-    def get_updates(self) -> Iterator[BaseArticle]:
-        for title in self.remote.get_titles():
+    def get_updates(
+        self,
+        local: Dict[ID, str] | None = None,
+        changed: list[str] | None = None
+    ) -> Iterator[BaseArticle]:
+        if (changed is not None):
+            # Titles the remote reports as changed since the last sync.
+            wants = [ID(labelId) for labelId in changed]
+        else:
+            if (local is None):
+                local = self.titles.get_versions()
+            wants = [
+                labelId for (labelId, articleId) in self.remote.get_versions().items()
+                if local.get(labelId) != articleId
+            ]
+        for (_, title) in self.remote.store.get_many(wants):
             current = self.titles.get_title(title.label)
             editOf = current
             draft = Draft(
@@ -1,6 +1,18 @@
+from io import BytesIO
+from multiprocessing import get_context
+from pathlib import Path
+import pickle
+from threading import Thread
 import pytest
-from linki.connection import Connection, MemoryConnection, PathConnection
-from linki.id import SimpleLabel
+from linki.article import Article, ArticleConnection, ArticleRecord, BaseArticle, get_delta, get_record_columns
+from linki.config import AuthDetails, ConfigCollection
+import msgspec
+from linki.connection import Codec, Connection, MemoryConnection, PackConnection, PathConnection, SparseConnection, SqliteConnection, encode_array_header, encode_path, read_frames
+from linki.id import Label, SimpleLabel
+from linki.journal import FileJournal, Journal, JournalConnection
+from linki.repository import RepositoryConnection
+from linki.title import TitleChanges
+from linki.url import URLCollection
 
 
 def do_test(connection: Connection):
@@ -35,3 +47,416 @@ def test_mem_connection():
 def test_path_connection(tmp_path):
     connection = PathConnection[int](tmp_path)
     do_test(connection)
+
+
+def test_pack_connection(tmp_path):
+    connection = PackConnection[int](tmp_path)
+    do_test(connection)
+
+    key = SimpleLabel('key').labelId
+    other = SimpleLabel('other').labelId
+    connection[key] = 1
+    connection[other] = 2
+    connection[key] = 3
+    assert PackConnection[int](tmp_path)[key] == 3
+    assert dict(connection.items()) == {key: 3, other: 2}
+
+    connection.repack()
+    assert len(connection) == 2
+    assert dict(PackConnection[int](tmp_path).items()) == {key: 3, other: 2}
+
+    # A reader still holding the idx from before a repack finds the records
+    # don't match it, and reloads.
+    connection[key] = 4
+    entries = dict(connection.index.entries)
+    connection.repack()
+    connection.index.entries = entries
+    connection.index.inode = connection.idx.stat().st_ino
+    connection.index.position = connection.idx.stat().st_size
+    assert connection[key] == 4
+    assert dict(connection.get_many([key, other])) == {key: 4, other: 2}
+
+
+def test_pack_repack_threshold(tmp_path):
+    connection = PackConnection[str](tmp_path)
+    key = SimpleLabel('key').labelId
+    for count in range(100):
+        connection[key] = str(count) * 1000
+        if (connection.should_repack()):
+            break
+    # Repacks wait until most of the pack is dead records.
+    assert connection.index.dead > connection.repack_size
+    assert connection.index.dead > connection.index.live
+
+    size = connection.pack.stat().st_size
+    connection.repack()
+    assert connection.pack.stat().st_size < size / 2
+    assert not connection.should_repack()
+    assert PackConnection[str](tmp_path)[key] == str(count) * 1000
+
+
+def test_sqlite_connection(tmp_path):
+    connection = SqliteConnection[int](tmp_path)
+    do_test(connection)
+
+    key = SimpleLabel('key').labelId
+    other = SimpleLabel('other').labelId
+    connection[key] = 1
+    connection[other] = 2
+    connection[key] = 3
+    assert SqliteConnection[int](tmp_path)[key] == 3
+    # Connections are opened once per database and thread.
+    assert SqliteConnection[int](tmp_path).db is connection.db
+    other_db = []
+    thread = Thread(target=lambda: other_db.append(SqliteConnection[int](tmp_path).db))
+    thread.start()
+    thread.join()
+    assert other_db[0] is not connection.db
+    assert dict(connection.items()) == {key: 3, other: 2}
+    assert dict(connection.get_many([other, key])) == {key: 3, other: 2}
+    assert connection.select('path', '') is not None
+    assert list(connection.select('path', '', prefix=True)) == []  # type: ignore
+
+
+def test_sqlite_select(tmp_path):
+    codec = Codec(ArticleRecord, BaseArticle, columns=get_record_columns)
+    connection = SqliteConnection[ArticleRecord](tmp_path, codec)
+    articles = ArticleConnection(connection)
+    content = ''.join([f'line {n}\n' for n in range(20)])
+    inside = Article(Label(['folder', 'key']), content, None)
+    nested = Article(Label(['folder', 'deeper', 'key']), 'nested', None)
+    outside = Article(Label(['folders', 'key']), 'outside', None)
+    edit = Article(Label(['folder', 'key']), content + 'edit\n', inside)
+    for article in [inside, nested, outside, edit]:
+        articles[article.articleId] = article
+    assert connection[edit.articleId].delta is not None
+
+    def select(*args, **kwargs):
+        rows = articles.select(*args, **kwargs)
+        assert rows is not None
+        return {key: value for (key, value) in rows}
+
+    assert select('path', encode_path(('folder',)), prefix=True) == {
+        inside.articleId: inside,
+        nested.articleId: nested,
+        edit.articleId: edit,
+    }
+    assert select('path', encode_path(('folder', 'deeper')), True) == {
+        nested.articleId: nested
+    }
+    assert select('article', str(outside.articleId)) == {
+        outside.articleId: outside
+    }
+    assert select('article', str(edit.articleId)) == {
+        edit.articleId: edit
+    }
+    assert select('label', str(inside.label.labelId)) == {
+        inside.articleId: inside,
+        edit.articleId: edit,
+    }
+    assert connection.select('unknown', '') is None
+
+
+@pytest.mark.parametrize('storage', ['memory', 'path', 'pack', 'sqlite'])
+def test_select_keys(tmp_path, storage):
+    codec = Codec(ArticleRecord, BaseArticle, columns=get_record_columns)
+
+    def connect() -> Connection[BaseArticle]:
+        match storage:
+            case 'memory':
+                return memory
+            case 'path':
+                return PathConnection(tmp_path, codec)
+            case 'pack':
+                return PackConnection(tmp_path, codec)
+        return SqliteConnection(tmp_path, codec)
+
+    memory = MemoryConnection[BaseArticle](codec.get_columns)
+    connection = connect()
+    inside = Article(Label(['folder', 'key']), 'inside', None)
+    nested = Article(Label(['folder', 'deeper', 'key']), 'nested', None)
+    outside = Article(Label(['folders', 'key']), 'outside', None)
+    for article in [inside, nested, outside]:
+        connection[article.articleId] = article
+
+    def select_keys(*args):
+        keys = connect().select_keys(*args)
+        assert keys is not None
+        return set(keys)
+
+    folder = encode_path(('folder',))
+    assert select_keys('path', folder, True) == {
+        inside.articleId, nested.articleId}
+    assert select_keys('article', str(outside.articleId)) == {
+        outside.articleId}
+
+    del connection[nested.articleId]
+    assert select_keys('path', folder, True) == {inside.articleId}
+
+    # Writes in a batch are read back and indexed before it ends.
+    with connection.batch():
+        connection[nested.articleId] = nested
+        assert connection[nested.articleId] == nested
+        assert select_keys('path', folder, True) == {
+            inside.articleId, nested.articleId}
+        del connection[nested.articleId]
+    assert select_keys('path', folder, True) == {inside.articleId}
+    assert nested.articleId not in connect()
+
+    # Only the matching items are read, and the filter holds either way.
+    def in_folder(article: BaseArticle) -> bool:
+        return article.label.path[0] == 'folder'
+
+    for where in [('path', folder, True), None]:
+        sparse = SparseConnection(connect(), in_folder, where)
+        assert len(sparse) == 1
+        assert dict(sparse.items()) == {inside.articleId: inside}
+        with pytest.raises(KeyError):
+            sparse[outside.articleId]
+
+    if (storage in ['path', 'pack']):
+        # The column index is rebuilt if it goes missing.
+        tmp_path.joinpath('.columns').unlink()
+        PathConnection.column_indexes.clear()
+        assert select_keys('path', folder, True) == {inside.articleId}
+        assert len(connect()) == 2
+
+
+def test_article_connection(tmp_path, monkeypatch):
+    history = PackConnection[BaseArticle](tmp_path)
+    articles = ArticleConnection(history)
+    content = ''.join([f'line {n}\n' for n in range(100)])
+
+    article = None
+    for n in range(10):
+        content = content.replace(f'line {n}\n', f'edit {n}\n')
+        article = Article(SimpleLabel('busy'), content, article)
+        articles[article.articleId] = article
+
+    assert article is not None
+    assert isinstance(history[article.articleId], ArticleRecord)
+    assert history[article.articleId].delta is not None
+    assert ArticleConnection(history)[article.articleId] == article
+
+    titles = ArticleConnection(MemoryConnection(), history)
+    titles[article.label.labelId] = article
+    assert titles[article.label.labelId] == article
+    assert titles[article.label.labelId].editOf == article.editOf
+
+    # Rebuilt articles are shared between connections, so another read
+    # doesn't walk the chain again.
+    ArticleConnection.cache.clear()
+    assert ArticleConnection(history)[article.articleId] == article
+    assert article.editOf is not None
+    del history[article.editOf.articleId]
+    assert ArticleConnection(history)[article.articleId] == article
+
+    # Every snapshot_size-th edit keeps its whole content.
+    monkeypatch.setattr(ArticleConnection, 'snapshot_size', 4)
+    article = Article(SimpleLabel('snapshots'), content, None)
+    articles[article.articleId] = article
+    deltas = []
+    for n in range(10, 20):
+        content = content.replace(f'line {n}\n', f'edit {n}\n')
+        article = Article(SimpleLabel('busy'), content, article)
+        articles[article.articleId] = article
+        deltas.append(history[article.articleId].deltas)
+    assert deltas == [1, 2, 3, 0, 1, 2, 3, 0, 1, 2]
+    assert history[article.articleId].content is None
+    ArticleConnection.cache.clear()
+    assert ArticleConnection(history)[article.articleId] == article
+
+
+def test_journal_connection(tmp_path, monkeypatch):
+    journal_path = tmp_path.joinpath('journal')
+    tmp_path.joinpath('store').mkdir()
+    for journal in [Journal(), FileJournal(journal_path)]:
+        connection = JournalConnection(
+            PathConnection[int](tmp_path.joinpath('store')), journal, 'style')
+        do_test(connection)
+
+        key = SimpleLabel('key').labelId
+        connection[key] = 1
+        connection[key] = 2
+        del connection[key]
+        entries = list(journal.tail())
+        assert [entry.sequence for entry in entries] == list(
+            range(1, len(entries) + 1))
+        assert journal.sequence == len(entries)
+        assert [(entry.key, entry.deleted) for entry in journal.tail(len(entries) - 3)] == [
+            (key, False), (key, False), (key, True)]
+
+    # Another writer's entries are picked up, and a torn write is dropped.
+    sequence = journal.sequence
+    with journal_path.open('ab') as stream:
+        stream.write(b'\x00\x00\x01')
+    FileJournal.positions.clear()
+    assert FileJournal(journal_path).append('style', key).sequence == sequence + 1
+    assert [entry.sequence for entry in FileJournal(journal_path).tail(sequence)] == [
+        sequence + 1]
+
+    # tail() starts from the last mark before the cursor, wherever that is.
+    FileJournal.positions.clear()
+    FileJournal.marks.clear()
+    monkeypatch.setattr(FileJournal, 'mark_size', 2)
+    journal = FileJournal(journal_path)
+    journal.extend(('style', key, False) for _ in range(5))
+    for after in range(journal.sequence + 1):
+        assert [entry.sequence for entry in journal.tail(after)] == list(
+            range(after + 1, journal.sequence + 1))
+    assert len(FileJournal.marks[journal.path]) == journal.sequence // 2
+
+    # The entry is written first, so a write that fails is still in it.
+    class FailingConnection(MemoryConnection):
+        def __setitem__(self, __key, __value):
+            raise OSError
+    connection = JournalConnection(FailingConnection(), journal, 'style')
+    sequence = journal.sequence
+    with pytest.raises(OSError):
+        connection[key] = 3
+    assert journal.sequence == sequence + 1
+
+
+def append_from_process(path: Path, name: str):
+    codec = Codec(ArticleRecord, BaseArticle, columns=get_record_columns)
+    journal = FileJournal(path.joinpath('journal'))
+    store = PathConnection[BaseArticle](path.joinpath('store'), codec)
+    for n in range(50):
+        article = Article(Label([name, str(n)]), name, None)
+        store[article.articleId] = article
+        journal.append('style', article.articleId)
+
+
+def test_appends_from_processes(tmp_path):
+    # Writers never cut off each other's frames.
+    tmp_path.joinpath('store').mkdir()
+    PathConnection(
+        tmp_path.joinpath('store'),
+        Codec(ArticleRecord, BaseArticle, columns=get_record_columns)
+    ).get_column_index()
+    names = ['one', 'two', 'three', 'four']
+    processes = [
+        get_context('fork').Process(target=append_from_process, args=(tmp_path, name))
+        for name in names
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * len(names)
+
+    FileJournal.positions.clear()
+    PathConnection.column_indexes.clear()
+    journal = FileJournal(tmp_path.joinpath('journal'))
+    assert [entry.sequence for entry in journal.tail()] == list(range(1, 201))
+    store = PathConnection[BaseArticle](
+        tmp_path.joinpath('store'),
+        Codec(ArticleRecord, BaseArticle, columns=get_record_columns))
+    for name in names:
+        keys = store.select_keys('path', encode_path((name,)), True)
+        assert keys is not None and len(list(keys)) == 50
+
+
+def test_iter_stream(tmp_path):
+    for size in [0, 15, 16, 2**16 - 1, 2**16]:
+        encoded = msgspec.msgpack.encode([None] * size)
+        assert encode_array_header(size) == encoded[0:-size or None]
+
+    connection = PackConnection[BaseArticle](tmp_path)
+    articles = [Article(SimpleLabel(f'{n}'), f'{n}', None) for n in range(20)]
+    for article in articles:
+        connection[article.articleId] = article
+    stream = connection.iter_stream()
+    assert isinstance(next(stream), bytes)
+    assert connection.toStream() == msgspec.msgpack.encode(articles)
+    frames = read_frames(BytesIO(b''.join(connection.iter_frames())))
+    assert [msgspec.msgpack.decode(frame, type=BaseArticle)
+            for frame in frames] == articles
+
+
+def test_memory_connection_shares_frozen_values():
+    connection = MemoryConnection()
+    key = SimpleLabel('key').labelId
+    article = Article(SimpleLabel('key'), 'content', None)
+    connection[key] = article
+    assert connection[key] is article
+
+    refusals = {'refused'}
+    connection[key] = refusals
+    connection[key].add('changed')
+    refusals.add('changed too')
+    assert connection[key] == {'refused'}
+
+    # Shared records can't be changed through a reader's copy, and frozen
+    # structs holding something mutable are still copied.
+    edit = Article(SimpleLabel('key'), 'content\nmore\n', article)
+    record = ArticleRecord(label=edit.label, editOf=str(article.articleId),
+                           delta=get_delta(article.content, edit.content))
+    connection[key] = record
+    assert connection[key] is record
+    with pytest.raises(AttributeError):
+        connection[key].delta.append((0, 0, 'changed'))  # type: ignore
+    listed = TitleChanges(cursor=1, labels=['label'])
+    connection[key] = listed
+    connection[key].labels.append('changed')  # type: ignore
+    assert connection[key].labels == ['label']
+
+
+def test_codec_connection(tmp_path):
+    codec = Codec(ArticleRecord, BaseArticle)
+    connection = PathConnection[BaseArticle](tmp_path, codec)
+    do_test(connection)
+
+    parent = Article(Label(['folder', 'key']), 'content', None)
+    article = Article(Label(['folder', 'key']), 'more content', parent)
+    key = article.label.labelId
+    connection[key] = article
+    raw = tmp_path.joinpath(key).read_bytes()
+    assert raw.startswith(codec.header)
+    assert len(raw) < len(pickle.dumps(article))
+    assert connection[key] == article
+
+    # Records written before the codec are still read.
+    tmp_path.joinpath(key).write_bytes(pickle.dumps(parent))
+    assert connection[key] == parent
+    connection[key] = {'not', 'an', 'article'}
+    assert connection[key] == {'not', 'an', 'article'}
+
+
+def test_settings_codecs(tmp_path):
+    # Only the refusal and approval sets are left to pickle.
+    codecs = RepositoryConnection.codecs
+    for style in ['config', 'subs']:
+        tmp_path.joinpath(style).mkdir()
+    config = ConfigCollection(
+        PathConnection(tmp_path.joinpath('config'), codecs['config']))
+    subs = URLCollection(PathConnection(tmp_path.joinpath('subs'), codecs['subs']))
+
+    url = subs.add_url('https://example.com/')
+    config.add_auth(url, 'name', 'secret')
+    version = config.bump_version('titles')
+    config.set_cursor(url.url, 3)
+    config.set_change_index(True)
+    config.set_change_ids('ab', ['abc'])
+    config.add_refusal('abc')
+
+    pickled = [
+        path.name for path in tmp_path.joinpath('config').iterdir()
+        if not path.read_bytes().startswith(codecs['config'].header)
+    ]
+    assert pickled == [SimpleLabel('refusals').labelId]
+    assert all(
+        path.read_bytes().startswith(codecs['subs'].header)
+        for path in tmp_path.joinpath('subs').iterdir()
+    )
+    assert [stored.url for stored in subs.get_urls()] == ['https://example.com/']
+    assert subs.get_url(url.labelId).labelId == url.labelId
+    assert config.get_auth(url) == AuthDetails(url.url, 'name', 'secret')
+    assert config.get_version('titles') == version
+    assert config.get_cursor(url.url) == 3
+    # Urls that clean to the same label, and other subtrees, don't share one.
+    assert config.get_cursor('https://example.com') == 0
+    assert config.get_cursor(url.url, ('folder',)) == 0
+    assert config.has_change_index() is True
+    assert config.get_change_ids('ab') == ['abc']
+    assert config.get_refusals() == {'abc'}
@@ -4,12 +4,17 @@ from unittest import TestCase
 
 from hypothesis import HealthCheck, given, settings
 import msgspec
-from linki.article import BaseArticle
+from linki.article import Article, BaseArticle
 from linki.draft import BaseArticle
 
+from linki.change import Change
+from linki.connection import MemoryConnection
 from linki.editor import Editor
-from linki.id import Label
+from linki.id import Label, SimpleLabel
+from linki.links import LinkList
+from linki.postings import PostingList
 from linki.repository import MemoryRepoConnection, Repository
+from linki.title import Redirect
 from linki.testing.strategies.article import an_article
 from linki.testing.strategies.draft import a_draft, a_new_draft, some_drafts, some_new_drafts
 
@@ -147,3 +152,192 @@ def test_does_publish_changed_draft_path(draft: BaseArticle):
     assert g_n_draft is not None
     assert g_o_draft.redirect == n_draft.label
     assert g_n_draft.redirect == z_draft.label
+
+
+@given(some_drafts(2))
+@settings(suppress_health_check=[HealthCheck.filter_too_much])
+def test_does_index_labels(some_drafts: Set[BaseArticle]):
+    repo = MemoryRepository()
+    editor = Editor(repo)
+
+    for draft in some_drafts:
+        repo.drafts.set_draft(draft)
+    editor.publish_drafts()
+    titles = [title.label for title in repo.titles.get_titles()]
+    test.assertCountEqual(repo.titles.get_labels(), titles)
+
+    # Titles written before the index existed get picked up.
+    repo.connection.connections['labels'] = MemoryConnection()
+    repo.config.set_label_index(False)
+    test.assertCountEqual(repo.titles.get_labels(), titles)
+    assert repo.config.has_label_index()
+
+
+@given(some_drafts(3))
+@settings(suppress_health_check=[HealthCheck.filter_too_much])
+def test_does_index_change_ids(some_drafts: Set[BaseArticle]):
+    repo = MemoryRepository()
+    changes = [Change(draft, 'https://example.com/') for draft in some_drafts]
+    for change in changes:
+        repo.changes.add_change(change)
+
+    for change in changes:
+        matches = repo.changes.find_change_id(change.change_id)
+        assert change.label.labelId in matches
+        test.assertCountEqual(
+            matches,
+            [change_id for change_id in repo.changes.store
+             if change_id.startswith(change.change_id)]
+        )
+
+    removed = changes.pop()
+    repo.changes.remove_change(removed)
+    assert removed.label.labelId not in repo.changes.find_change_id(
+        removed.change_id)
+
+    # Changes added before the index existed get picked up.
+    repo.connection.connections['config'] = MemoryConnection()
+    for change in changes:
+        assert change.label.labelId in repo.changes.find_change_id(
+            change.change_id)
+
+
+def test_does_index_paths():
+    repo = MemoryRepository()
+    paths = [['top'], ['top', 'page'], ['top', 'folder', 'page'], ['topper']]
+    titles = [Article(Label(path), '/'.join(path), None) for path in paths]
+    for title in titles:
+        repo.articles.merge_article(title)
+        repo.titles.set_title(title)
+
+    def contents(collection):
+        return sorted(title.content for title in collection)
+
+    assert contents(repo.titles.get_titles(('top',))) == [
+        'top', 'top/folder/page', 'top/page']
+    assert contents(repo.articles.get_articles(('top', 'folder'))) == [
+        'top/folder/page']
+    assert repo.titles.get_count(('top',)) == 3
+    assert repo.get_count('articles', ('topper',)) == 1
+    assert repo.titles.get_count(('missing',)) == 0
+
+    repo.titles.clear_title(titles[2].label)
+    assert repo.titles.get_count(('top',)) == 2
+    assert repo.titles.get_count(('top', 'folder')) == 0
+
+    # Pending writes aren't in the path column, so they're scanned for.
+    with repo.transaction():
+        repo.titles.set_title(titles[2])
+        assert contents(repo.titles.get_titles(('top',))) == [
+            'top', 'top/folder/page', 'top/page']
+        assert repo.titles.get_count(('top', 'folder')) == 1
+
+
+def test_does_search_titles():
+    repo = MemoryRepository()
+    moon = Article(Label(['good_moon']), 'Goodnight moon, goodnight room', None)
+    room = Article(Label(['rooms', 'red']), 'A great green room', None)
+    for title in [moon, room]:
+        repo.titles.set_title(title)
+
+    def search(query: str):
+        return ['/'.join(entry.label.path) for entry in repo.titles.search(query)]
+
+    # Titles named after the query come first.
+    assert search('room') == ['rooms/red', 'good_moon']
+    assert search('GOODNIGHT Room') == ['good_moon']
+    assert search('moon green') == []
+    assert search('a !') == []
+
+    repo.titles.set_title(Article(moon.label, 'Hello moon', moon))
+    assert search('room') == ['rooms/red']
+    repo.titles.clear_title(room.label)
+    assert search('room') == []
+    assert search('hello') == ['good_moon']
+
+    # Titles set before the index existed get picked up.
+    repo.connection.connections['search'] = MemoryConnection()
+    repo.connection.connections['config'] = MemoryConnection()
+    assert search('moon') == ['good_moon']
+
+    # Including on wikis from before the labels index.
+    repo.connection.connections['labels'] = MemoryConnection()
+    repo.config.set_label_index(False)
+    assert search('moon') == ['good_moon']
+
+
+def test_does_merge_posting_changes():
+    store = MemoryConnection()
+    postings = PostingList(store, 'test', 'shared')
+    postings.merge_size = 4
+    ids = [str(SimpleLabel(f'page{n}').labelId) for n in range(10)]
+    for id in ids:
+        postings.add(id)
+    for id in ids[:3]:
+        postings.remove(id)
+
+    # Changes are folded into the ids every few writes, and the rest are
+    # read on top of them.
+    count = postings.get_count()
+    assert (count.changes, count.size) == (1, 8)
+    assert postings.get() == set(ids[3:])
+    for id in ids[3:]:
+        postings.remove(id)
+    assert postings.get() == set()
+    # Merging a list that's empty drops it.
+    postings.merge()
+    assert len(store) == 0
+
+
+def test_does_index_links():
+    repo = MemoryRepository()
+    home = Article(Label(['home']), 'See [moon](group/moon) and [web](https://x.org)', None)
+    moon = Article(Label(['group', 'moon']), 'Back [home](../home), [sun](/w/group/sun#top)', None)
+    sun = Article(Label(['group', 'sun']), 'Nothing here', None)
+    for title in [home, moon, sun]:
+        repo.titles.set_title(title)
+
+    def backlinks(title: BaseArticle):
+        return {
+            '/'.join(entry.label.path)
+            for entry in repo.titles.get_backlinks(title.label.labelId)
+        }
+
+    assert backlinks(home) == {'group/moon'}
+    assert backlinks(moon) == {'home'}
+    assert backlinks(sun) == {'group/moon'}
+
+    repo.titles.set_title(Redirect(sun, home.label))
+    repo.titles.set_title(Article(moon.label, 'Just [home](/home)', moon))
+    assert backlinks(home) == {'group/moon', 'group/sun'}
+    assert backlinks(sun) == set()
+    repo.titles.clear_title(home.label)
+    assert backlinks(moon) == set()
+
+    # Titles set before the index existed get picked up.
+    repo.connection.connections['links'] = MemoryConnection()
+    repo.connection.connections['config'] = MemoryConnection()
+    assert backlinks(home) == {'group/moon', 'group/sun'}
+
+    # Including on wikis from before the labels index.
+    repo.connection.connections['labels'] = MemoryConnection()
+    repo.config.set_label_index(False)
+    assert backlinks(home) == {'group/moon', 'group/sun'}
+
+    # A new backlink is written as a change, without rewriting the others.
+    written = []
+
+    class RecordingConnection(MemoryConnection):
+        def __setitem__(self, key, value):
+            written.append(value)
+            super().__setitem__(key, value)
+
+    links = RecordingConnection()
+    links.update(repo.connection.connections['links'])
+    repo.connection.connections['links'] = links
+    written.clear()
+    star = Article(Label(['star']), 'Also [home](home)', None)
+    repo.titles.set_title(star)
+    assert [value for value in written if isinstance(value, LinkList)] == [
+        LinkList((home.label.labelId,))]
+    assert backlinks(home) == {'group/moon', 'group/sun', 'star'}
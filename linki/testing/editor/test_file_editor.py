@@ -1,9 +1,11 @@
 
 from contextlib import contextmanager
+import os
 from pathlib import Path
 import shutil
 from tempfile import TemporaryDirectory
-from typing import Set
+from threading import Thread
+from typing import List, Set
 from unittest import TestCase
 
 from hypothesis import HealthCheck, assume, given, settings
@@ -187,3 +189,136 @@ def test_does_publish_some_new_drafts(some_drafts: Set[BaseArticle]):
         titles = [title.label for title in editor.repo.titles.get_titles()]
         for draft in some_drafts:
             assert draft.label in titles
+
+
+def test_load_drafts_skips_unchanged_files():
+    with get_file_editor() as editor:
+        path = editor.repo.path.joinpath('hello')
+        path.write_text('hello')
+        os.utime(path, ns=(0, 0))
+
+        editor.load_drafts()
+        assert editor.repo.drafts.clear_draft(SimpleLabel('hello'))
+
+        editor.load_drafts()
+        assert editor.repo.drafts.get_draft(SimpleLabel('hello')) is None
+
+        path.write_text('howdy')
+        os.utime(path, ns=(0, 1_000_000_000))
+        editor.load_drafts()
+        draft = editor.repo.drafts.get_draft(SimpleLabel('hello'))
+        assert draft is not None
+        assert draft.content == 'howdy'
+
+
+def test_publishes_in_one_transaction():
+    with get_file_editor() as editor:
+        repo = editor.repo
+        hello = Article(SimpleLabel('hello'), 'hello', None)
+        howdy = Article(SimpleLabel('howdy'), 'howdy', None)
+
+        try:
+            with repo.transaction():
+                repo.titles.set_title(hello)
+                assert repo.titles.get_title(hello.label) == hello
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        assert repo.titles.get_title(hello.label) is None
+        assert repo.journal is not None and repo.journal.sequence == 0
+
+        with repo.transaction():
+            repo.articles.merge_article(hello)
+            repo.titles.set_title(hello)
+        assert repo.titles.get_title(hello.label) == hello
+        assert repo.journal.sequence == 2
+
+        # A transaction saved but not applied is finished on the next open.
+        def interrupted(transaction):
+            raise RuntimeError
+        repo.connection.apply = interrupted  # type: ignore
+        try:
+            with repo.transaction():
+                repo.articles.merge_article(howdy)
+                repo.titles.set_title(howdy)
+        except RuntimeError:
+            pass
+        path = repo.connection.get_transaction_path()
+        assert path is not None and path.exists()
+        assert repo.titles.get_title(howdy.label) is None
+
+        repo = FileRepository.fromPath(repo.path)
+        assert repo.titles.get_title(howdy.label) == howdy
+        assert repo.journal is not None and repo.journal.sequence == 4
+        assert not path.exists()
+
+
+def test_opens_each_store_once_per_transaction():
+    with get_file_editor() as editor:
+        repo = editor.repo
+        open_style = repo.connection.open_style
+        opened: List[str] = []
+
+        def counting_open(style):
+            opened.append(style)
+            return open_style(style)
+        repo.connection.open_style = counting_open  # type: ignore
+        with repo.transaction():
+            for name in ['hello', 'howdy', 'hi']:
+                article = Article(SimpleLabel(name), name, None)
+                repo.articles.merge_article(article)
+                repo.titles.set_title(article)
+        assert len(opened) == len(set(opened))
+        assert repo.titles.get_title(SimpleLabel('hi')) is not None
+
+
+def test_counts_titles_across_processes():
+    with get_file_editor() as editor:
+        repo = editor.repo
+        other = FileRepository.fromPath(repo.path)
+        hello = Article(SimpleLabel('hello'), 'hello', None)
+        howdy = Article(SimpleLabel('howdy'), 'howdy', None)
+        repo.titles.set_title(Article(SimpleLabel('hi'), 'hi', None))
+        cursor = repo.titles.get_version().count
+
+        # Both read the same version before either commits.
+        with repo.transaction(), other.transaction():
+            repo.titles.set_title(hello)
+            other.titles.set_title(howdy)
+        version = repo.titles.get_version().count
+        assert version == other.titles.get_version().count > cursor
+        assert set(repo.titles.get_changes(cursor).labels or []) == {
+            hello.label.labelId, howdy.label.labelId}
+
+
+def test_waits_for_other_commits():
+    with get_file_editor() as editor:
+        repo = editor.repo
+        hello = Article(SimpleLabel('hello'), 'hello', None)
+        apply = repo.connection.apply
+        opened = []
+
+        def open_repo():
+            opened.append(FileRepository.fromPath(repo.path))
+
+        # Another process opening the wiki mid-commit has to wait for it
+        # instead of replaying the transaction itself.
+        def slow_apply(transaction):
+            other = Thread(target=open_repo)
+            other.start()
+            other.join(0.2)
+            assert other.is_alive()
+            apply(transaction)
+            opened.append(other)
+        repo.connection.apply = slow_apply  # type: ignore
+        with repo.transaction():
+            repo.articles.merge_article(hello)
+            repo.titles.set_title(hello)
+        opened[0].join()
+
+        path = repo.connection.get_transaction_path()
+        assert path is not None and not path.exists()
+        assert repo.journal is not None and repo.journal.sequence == 2
+        assert [
+            entry.sequence for entry in repo.journal.tail()
+        ] == [1, 2]
@@ -1,13 +1,12 @@
 from pathlib import Path
 from unittest import TestCase
 
-import requests
 from linki.inbox import Inbox
 
 from linki.main import app
 from typer.testing import CliRunner
 
-from linki.testing.server.test_happy_path import get_client, get_memory_server
+from linki.testing.server.test_happy_path import get_client, get_memory_server, patch_session
 
 runner = CliRunner()
 
@@ -66,7 +65,7 @@ def test_add_http_contribution_with_flags(tmp_path: Path, monkeypatch):
     server = get_memory_server()
     server_url = "https://localhost/"
     client = get_client(server)
-    monkeypatch.setattr(requests, "get", client.get)
+    patch_session(monkeypatch, client)
     username = 'user'
     password = 'pass'
     server.repo.users.add_user(username, password)
@@ -88,7 +87,7 @@ def test_add_http_contribution_without_flags(tmp_path: Path, monkeypatch):
     server = get_memory_server()
     server_url = "https://localhost/"
     client = get_client(server)
-    monkeypatch.setattr(requests, "get", client.get)
+    patch_session(monkeypatch, client)
     username = 'user'
     password = 'pass'
     server.repo.users.add_user(username, password)
@@ -114,8 +113,7 @@ def test_successful_http_contribute(tmp_path: Path, monkeypatch):
     server = get_memory_server()
     server_url = "https://localhost/"
     client = get_client(server)
-    monkeypatch.setattr(requests, "get", client.get)
-    monkeypatch.setattr(requests, "post", client.post)
+    patch_session(monkeypatch, client)
     username = 'user'
     password = 'pass'
     server.repo.users.add_user(username, password)
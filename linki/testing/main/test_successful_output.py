@@ -1,8 +1,11 @@
 from pathlib import Path
+import shutil
 from typer.testing import CliRunner
+from linki.article import Article
 from linki.change import ChangeLabel
 from linki.id import Label, SimpleLabel
 from linki.main import app
+from linki.repository import FileRepository
 
 runner = CliRunner()
 
@@ -42,6 +45,136 @@ def test_publish_drafts(tmp_path: Path):
     assert tmp_path.joinpath('good_moon.md').read_text() == 'Goodnight Moon'
 
 
+def test_migrate_storage(tmp_path: Path):
+    res = runner.invoke(app, ["init", str(tmp_path), "--storage", "pack"])
+    assert res.stdout == f"Initialized wiki in {str(tmp_path)}.\n"
+    tmp_path.joinpath('hello_world.md').write_text('Hello World')
+    res = runner.invoke(app, ["publish", str(tmp_path)])
+    assert res.stdout == f"Published {1} drafts.\n"
+
+    res = runner.invoke(app, ["migrate", str(tmp_path), "--storage", "path"])
+    assert res.stdout.startswith("Migrated ")
+    assert tmp_path.joinpath('.linki', 'storage').read_text() == 'path'
+
+    tmp_path.joinpath('hello_world.md').write_text('Goodnight Moon')
+    res = runner.invoke(app, ["publish", str(tmp_path)])
+    assert res.stdout == f"Published {1} drafts.\n"
+    assert tmp_path.joinpath('hello_world.md').read_text() == 'Goodnight Moon'
+
+
+def test_migration_is_finished_on_open(tmp_path: Path):
+    runner.invoke(app, ["init", str(tmp_path), "--storage", "pack"])
+    tmp_path.joinpath('hello_world.md').write_text('Hello World')
+    runner.invoke(app, ["publish", str(tmp_path)])
+
+    # Interrupted after the new stores were written out, and after the
+    # first of them was swapped in.
+    repo = FileRepository.fromPath(tmp_path)
+    finish_migration = repo.connection.finish_migration
+
+    def interrupted():
+        root = tmp_path.joinpath('.linki')
+        root.joinpath('titles').rename(root.joinpath('titles.old'))
+        raise RuntimeError
+    repo.connection.finish_migration = interrupted  # type: ignore
+    try:
+        repo.migrate('path')
+    except RuntimeError:
+        pass
+    assert tmp_path.joinpath('.linki', 'storage').read_text() == 'pack'
+
+    repo = FileRepository.fromPath(tmp_path)
+    assert repo.connection.storage == 'path'
+    assert not tmp_path.joinpath('.linki', 'migrate').exists()
+    assert not list(tmp_path.joinpath('.linki').glob('*.old'))
+    assert [
+        title.content for title in repo.titles.get_titles()
+    ] == ['Hello World']
+
+    # A commit that waited out a migration writes to the new stores.
+    other = FileRepository.fromPath(tmp_path)
+    with repo.transaction():
+        repo.titles.set_title(Article(SimpleLabel('howdy'), 'howdy', None))
+        assert other.migrate('pack') > 0
+    repo = FileRepository.fromPath(tmp_path)
+    assert repo.connection.storage == 'pack'
+    assert {
+        title.content for title in repo.titles.get_titles()
+    } == {'Hello World', 'howdy'}
+
+
+def test_repack_storage(tmp_path: Path):
+    runner.invoke(app, ["init", str(tmp_path), "--storage", "pack"])
+    for content in ['Hello World', 'Goodnight Moon', 'Hello Moon']:
+        tmp_path.joinpath('hello_world.md').write_text(content)
+        runner.invoke(app, ["publish", str(tmp_path)])
+    pack = tmp_path.joinpath('.linki', 'labels', 'pack')
+    size = pack.stat().st_size
+
+    res = runner.invoke(app, ["repack", str(tmp_path)])
+    assert res.stdout.startswith("Repacked ")
+    assert pack.stat().st_size < size
+    repo = FileRepository.fromPath(tmp_path)
+    assert [
+        title.content for title in repo.titles.get_titles()
+    ] == ['Hello Moon']
+
+
+def test_sqlite_storage(tmp_path: Path):
+    res = runner.invoke(app, ["init", str(tmp_path), "--storage", "sqlite"])
+    assert res.stdout == f"Initialized wiki in {str(tmp_path)}.\n"
+    tmp_path.joinpath('folder').mkdir()
+    tmp_path.joinpath('folder', 'hello_world.md').write_text('Hello World')
+    tmp_path.joinpath('good_moon.md').write_text('Goodnight Moon')
+    res = runner.invoke(app, ["publish", str(tmp_path)])
+    assert res.stdout == f"Published {2} drafts.\n"
+    assert tmp_path.joinpath('.linki', 'titles', 'db.sqlite').exists()
+
+    repo = FileRepository.fromPath(tmp_path)
+    assert repo.get_count('titles') == 2
+    assert [
+        title.content for title in repo.titles.get_titles(('folder',))
+    ] == ['Hello World']
+
+    res = runner.invoke(app, ["migrate", str(tmp_path), "--storage", "path"])
+    assert res.stdout.startswith("Migrated ")
+    tmp_path.joinpath('good_moon.md').write_text('Good Moon')
+    res = runner.invoke(app, ["publish", str(tmp_path)])
+    assert res.stdout == f"Published {1} drafts.\n"
+
+    res = runner.invoke(app, ["migrate", str(tmp_path), "--storage", "sqlite"])
+    assert res.stdout.startswith("Migrated ")
+    assert tmp_path.joinpath('.linki', 'storage').read_text() == 'sqlite'
+    repo = FileRepository.fromPath(tmp_path)
+    assert {
+        title.content for title in repo.titles.get_titles()
+    } == {'Hello World', 'Good Moon'}
+
+
+def test_render_titles(tmp_path: Path):
+    runner.invoke(app, ["init", str(tmp_path)])
+    tmp_path.joinpath('hello_world.md').write_text('Hello World')
+    tmp_path.joinpath('good_moon.md').write_text('Goodnight Moon')
+    runner.invoke(app, ["publish", str(tmp_path)])
+
+    res = runner.invoke(app, ["render", str(tmp_path)])
+    assert res.stdout == f"Rendered {2} titles.\n"
+    res = runner.invoke(app, ["render", str(tmp_path)])
+    assert res.stdout == f"Rendered {0} titles.\n"
+
+
+def test_search_titles(tmp_path: Path):
+    runner.invoke(app, ["init", str(tmp_path)])
+    tmp_path.joinpath('hello_world.md').write_text('Hello World')
+    tmp_path.joinpath('good_moon.md').write_text('Goodnight Moon, hello')
+    runner.invoke(app, ["publish", str(tmp_path)])
+
+    res = runner.invoke(app, ["search", "hello", "--location", str(tmp_path)])
+    assert res.stdout == "hello_world.md\ngood_moon.md\n"
+    res = runner.invoke(app, ["search", "sun", "--location", str(tmp_path)])
+    assert res.stdout == "No titles found for sun.\n"
+
+
 def test_create_local_linki_copy(tmp_path: Path):
     base = tmp_path.joinpath('base')
     copy = tmp_path.joinpath('copy')
@@ -61,6 +194,31 @@ def test_create_local_linki_copy(tmp_path: Path):
     assert content == "Hello World"
 
 
+def test_copy_only_writes_changed_titles(tmp_path: Path):
+    base = tmp_path.joinpath('base')
+    copy = tmp_path.joinpath('copy')
+    base.mkdir()
+
+    runner.invoke(app, ["init", str(base)])
+    base.joinpath('hello_world.md').write_text('Hello World')
+    base.joinpath('moon_night.md').write_text('Hello Moon')
+    runner.invoke(app, ["publish", str(base)])
+
+    res = runner.invoke(app, ["copy", str(base), str(copy), "--verbose"])
+    assert res.stdout == (''
+                          + f"Copied 2 titles and 2 articles.\n"
+                          + f"Wrote 2 files, skipped 0 and removed 0.\n")
+
+    base.joinpath('hello_world.md').write_text('Goodnight World')
+    runner.invoke(app, ["publish", str(base)])
+    res = runner.invoke(app, ["copy", str(base), str(copy), "--verbose"])
+    assert res.stdout == (''
+                          + f"Copied 1 titles and 1 articles.\n"
+                          + f"Wrote 1 files, skipped 1 and removed 0.\n")
+    content = copy.joinpath('hello_world.md').read_text()
+    assert content == "Goodnight World"
+
+
 def test_create_local_group_copy(tmp_path: Path):
     base = tmp_path.joinpath('base')
     copy = tmp_path.joinpath('copy')
@@ -191,6 +349,26 @@ def test_view_inbox_updates(tmp_path: Path):
                           )
 
 
+def test_view_inbox_report(tmp_path: Path):
+    base = tmp_path.joinpath('base')
+    gone = tmp_path.joinpath('gone')
+    copy = tmp_path.joinpath('copy')
+    for linki in [base, gone, copy]:
+        linki.mkdir()
+        runner.invoke(app, ["init", str(linki)])
+    runner.invoke(app, ["subscribe", "--location", str(copy), str(base)])
+    runner.invoke(app, ["subscribe", "--location", str(copy), str(gone)])
+    shutil.rmtree(gone)
+
+    base.joinpath('hello.md').write_text('Hello World!')
+    runner.invoke(app, ["publish", str(base)])
+    res = runner.invoke(app, ["inbox", "--location", str(copy), "--verbose"])
+
+    assert f"Loaded 1 changes from {base.as_uri()} in " in res.stdout
+    assert f"Couldn't load {gone.as_uri()}: " in res.stdout
+    assert 'hello.md' in res.stdout
+
+
 def test_view_inbox_update_details(tmp_path: Path):
     base = tmp_path.joinpath('base')
     copy = tmp_path.joinpath('copy')
@@ -1,15 +1,30 @@
+import gzip
 from io import BytesIO
-from typing import Dict, TypedDict
+from pathlib import Path
+import time
+from typing import Dict, List, TypedDict
 
-from hypothesis import given, settings
+from hypothesis import HealthCheck, given, settings
+from pytest import MonkeyPatch
 import msgspec
-from linki.article import BaseArticle, ArticleCollection
-from linki.connection import MemoryConnection
+from requests import PreparedRequest, ReadTimeout, Response
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from linki.article import Article, BaseArticle, ArticleCollection
+from linki import session
+from linki.connection import MemoryConnection, encode_path, read_frames
+from linki.editor import Editor
+from linki.inbox import Inbox
+from linki.journal import JournalEntry
+from linki.subscription import Subscription
+from linki.id import SimpleLabel
+from linki.repository import FileRepository, Repository, TemporaryRepository
+from linki.session import WebSession
 from linki.testing.editor.test_editor import MemoryRepository
 from linki.testing.strategies.article import an_article
 from linki.testing.strategies.draft import some_drafts
 from linki.title import BaseArticle, TitleCollection
-from linki.viewer import RenderedArticle, WebView, WebViewConf
+from linki.viewer import ListedArticle, RenderedArticle, Renderer, WebView, WebViewConf
 
 from werkzeug.test import Client
 
@@ -25,6 +40,20 @@ def get_memory_server():
     return viewer
 
 
+def publish_title(repo: Repository, title: BaseArticle):
+    repo.articles.merge_article(title)
+    repo.titles.set_title(title)
+
+
+def get_file_server(path: Path, titles: List[BaseArticle], conf: WebViewConf) -> WebView:
+    # For what only shows with a wiki on disk, like the persisted caches.
+    FileRepository.createPath(path)
+    repo = FileRepository.fromPath(path)
+    for title in titles:
+        publish_title(repo, title)
+    return WebView(repo, conf)
+
+
 @given(some_drafts(2))
 def test_does_handle_articles(article_set: set[BaseArticle]):
     articles = list(article_set)
@@ -121,21 +150,21 @@ def test_does_handle_web(article_set: set[BaseArticle]):
     )
     for call in single_calls:
         res = client.get(call['url'])
-        expected = {'item': call['expect']}
         assert res.status_code == 200
         assert msgspec.convert(
-            res.json, type=dict[str, RenderedArticle]) == expected
+            res.json['item'], type=RenderedArticle) == call['expect']
+        assert res.json['backlinks'] == []
 
     class RenderRes(TypedDict):
-        items: set[RenderedArticle]
+        items: set[ListedArticle]
         style: str
         style_root: str
 
     res = client.get('/w/articles/')
     expected = {
         'items': {
-            e_article,
-            e_title_by_a_id
+            ListedArticle(label=article.label, web_id=article.articleId),
+            ListedArticle(label=title.label, web_id=title.articleId)
         },
         'style': 'articles'.capitalize(),
         'style_root': f"/w/"
@@ -149,7 +178,7 @@ def test_does_handle_web(article_set: set[BaseArticle]):
     res = client.get('/w/titles/')
     expected = {
         'items': {
-            e_title_by_path
+            ListedArticle(label=title.label, web_id=path)
         },
         'style': 'titles'.capitalize(),
         'style_root': f"/w/"
@@ -243,6 +272,15 @@ def test_does_handle_contributions(article: BaseArticle):
     change_text = ','.join([change.articleId for change in titles.values()])
     assert res.text == f'/w/contributions/{change_text}'
 
+    # Framed contributions are read an item at a time.
+    res = client.post('/api/contribute', data={
+        'changes': (titles.toFramedFile(), 'changes')
+    }, auth=(username, password))
+    assert res.status_code == 202
+    assert res.text == f'/w/contributions/{change_text}'
+    repo = TemporaryRepository.fromStreams(titles=titles.toFramedFile())
+    assert repo.titles.get_title(article.label) == article
+
     # TODO Test for 201 (can_edit=True)
 
 
@@ -293,3 +331,336 @@ def test_does_handle_copy(article_set: set[BaseArticle]):
     ]
     assert res.status_code == 200
     assert msgspec.msgpack.decode(res.data, type=list[BaseArticle]) == expected
+
+
+def test_does_cache_renders(tmp_path: Path):
+    title = Article(SimpleLabel('hello'), '# Hello', None)
+    viewer = get_file_server(tmp_path, [title], WebViewConf(web=True))
+    client = get_client(viewer)
+
+    assert client.get('/w/hello').status_code == 200
+    assert client.get('/w/hello').status_code == 200
+    assert viewer.renders.misses == 1
+    assert viewer.renders.hits == 1
+
+    viewer = WebView(viewer.repo, WebViewConf(web=True))
+    client = get_client(viewer)
+    assert client.get('/w/hello').status_code == 200
+    assert viewer.renders.misses == 0
+    assert viewer.renders.hits == 1
+
+
+def test_does_keep_pandoc_running():
+    renderer = Renderer(workers=1)
+    pages = [
+        Article(SimpleLabel(name), content, None)
+        for (name, content) in [
+            ('hello', '# Hello'),
+            ('moon', '*Goodnight* “Moon”'),
+            ('tabs', '0\t\n0\r\n\tcode'),
+        ]
+    ]
+    for page in pages:
+        assert renderer.render(page) == Renderer.convert(page.content)
+    # Both pages went through the one process, and not through the pool.
+    worker = renderer.idle.get()
+    renderer.idle.put(worker)
+    assert worker.process is not None and worker.process.poll() is None
+    assert len(renderer.pool._threads) == 0
+    renderer.close()
+    assert worker.process is None
+
+
+def test_does_answer_conditional_requests(tmp_path: Path):
+    title = Article(SimpleLabel('hello'), '# Hello', None)
+    viewer = get_file_server(tmp_path, [title], WebViewConf(api=True))
+    client = get_client(viewer)
+
+    res = client.get('/api/titles/')
+    etag = res.headers['ETag']
+    modified = res.headers['Last-Modified']
+    assert res.status_code == 200
+    assert res.headers['Cache-Control'] == 'no-cache'
+    res = client.get('/api/titles/', headers={'If-None-Match': etag})
+    assert res.status_code == 304
+    res = client.get('/api/titles/', headers={'If-Modified-Since': modified})
+    assert res.status_code == 304
+
+    res = client.get(f'/api/{title.articleId}')
+    assert res.headers['ETag'] == f'"{title.articleId}"'
+    assert 'immutable' in res.headers['Cache-Control']
+    res = client.get(
+        f'/api/{title.articleId}', headers={'If-None-Match': res.headers['ETag']})
+    assert res.status_code == 304
+
+    edit = Article(SimpleLabel('hello'), '# Hello again', title)
+    publish_title(viewer.repo, edit)
+    res = client.get('/api/titles/', headers={'If-None-Match': etag})
+    assert res.status_code == 200
+    assert res.headers['ETag'] != etag
+    res = client.get('/api/hello', headers={'If-None-Match': etag})
+    assert res.headers['ETag'] == f'"{edit.articleId}"'
+
+
+def test_does_handle_search(tmp_path: Path):
+    viewer = get_file_server(tmp_path, [
+        Article(SimpleLabel('hello'), '# Hello moon', None),
+        Article(SimpleLabel('search'), 'Search the moon', None),
+    ], WebViewConf(web=True, api=True))
+    client = get_client(viewer)
+
+    res = client.get('/api/search/', query_string={'q': 'moon'})
+    assert res.status_code == 200
+    assert {
+        result['web_id'] for result in res.json['results']
+    } == {'hello', 'search'}
+    res = client.get('/api/search/', query_string={'q': 'search'})
+    assert [result['web_id'] for result in res.json['results']] == ['search']
+    res = client.get('/api/search', query_string={'q': 'moon'})
+    assert res.status_code == 200
+    assert res.json['query'] == 'moon'
+    for path in ['/w/search', '/w/search/']:
+        res = client.get(path, query_string={'q': 'moon'})
+        assert res.status_code == 200
+        assert 'name="q" value="moon"' in res.text
+    assert client.get('/api/articles/search/').status_code == 404
+
+
+def test_does_handle_backlinks(tmp_path: Path):
+    hello = Article(SimpleLabel('hello'), '# Hello', None)
+    moon = Article(SimpleLabel('moon'), 'Say [hello](hello)', None)
+    viewer = get_file_server(
+        tmp_path, [hello, moon], WebViewConf(web=True, api=True))
+    client = get_client(viewer)
+
+    res = client.get('/api/backlinks/hello')
+    assert res.status_code == 200
+    assert res.json['label'] == hello.label.labelId
+    assert [
+        result['web_id'] for result in res.json['backlinks']
+    ] == ['moon']
+    res = client.get(f'/api/backlinks/{moon.label.labelId}')
+    assert res.json['backlinks'] == []
+
+    res = client.get('/w/hello')
+    assert res.status_code == 200
+    assert 'href="/w/moon"' in res.text
+    etag = res.headers['ETag']
+    sun = Article(SimpleLabel('sun'), 'Also [hello](/w/hello)', None)
+    publish_title(viewer.repo, sun)
+    res = client.get('/w/hello', headers={'If-None-Match': etag})
+    assert res.status_code == 200
+    assert 'href="/w/sun"' in res.text
+
+
+@given(an_article())
+def test_does_tail_journal(article: BaseArticle):
+    viewer = get_memory_server()
+    viewer.repo.articles.merge_article(article)
+    viewer.repo.titles.set_title(article)
+    client = get_client(viewer)
+
+    res = client.get('/copy/journal/')
+    entries = [
+        msgspec.msgpack.decode(frame, type=JournalEntry)
+        for frame in read_frames(BytesIO(res.data))
+    ]
+    assert [(entry.sequence, entry.style) for entry in entries] == [
+        (1, 'articles'), (2, 'titles')]
+    assert entries[1].key == article.label.labelId
+
+    res = client.get('/copy/journal/?after=1')
+    assert len(list(read_frames(BytesIO(res.data)))) == 1
+
+
+class ClientAdapter(BaseAdapter):
+    # Sends the session's requests to a test client instead of the network.
+    def __init__(self, client: Client) -> None:
+        super().__init__()
+        self.client = client
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:  # type: ignore
+        res = self.client.open(
+            request.url, method=request.method, data=request.body,
+            headers=dict(request.headers))
+        data = res.data
+        if (res.headers.get('Content-Encoding') == 'gzip'):
+            data = gzip.decompress(data)
+        response = Response()
+        response.status_code = res.status_code
+        response.headers = CaseInsensitiveDict(res.headers)
+        response.raw = BytesIO(data)
+        response.url = request.url or ''
+        response.request = request
+        return response
+
+
+def patch_session(monkeypatch: MonkeyPatch, client: Client):
+    web = WebSession()
+    web.session.mount('https://', ClientAdapter(client))
+    monkeypatch.setattr(session, 'shared', web)
+
+
+@given(some_drafts(2))
+def test_does_handle_stream(article_set: set[BaseArticle]):
+    articles = list(article_set)
+    article = articles[0]
+    title = articles[1]
+    viewer = get_memory_server()
+    viewer.repo.articles.merge_article(article)
+    viewer.repo.articles.merge_article(title)
+    viewer.repo.titles.set_title(article)
+    viewer.repo.titles.set_title(title)
+    client = get_client(viewer)
+
+    res = client.get('/copy/stream/articles')
+    assert res.status_code == 200
+    assert [
+        msgspec.msgpack.decode(frame, type=BaseArticle)
+        for frame in read_frames(BytesIO(res.data))
+    ] == [article, title]
+
+    res = client.get(
+        '/copy/stream/articles',
+        headers={'Accept-Encoding': 'gzip'}
+    )
+    assert res.status_code == 200
+    assert res.headers['Content-Encoding'] == 'gzip'
+    assert [
+        msgspec.msgpack.decode(frame, type=BaseArticle)
+        for frame in read_frames(BytesIO(gzip.decompress(res.data)))
+    ] == [article, title]
+
+    path = '/'.join(title.label.path)
+    res = client.get('/copy/stream/titles', query_string={'prefix': path})
+    assert res.status_code == 200
+    assert [
+        msgspec.msgpack.decode(frame, type=BaseArticle)
+        for frame in read_frames(BytesIO(res.data))
+    ] == [title]
+
+    res = client.get('/count/titles/', query_string={'prefix': path})
+    assert res.status_code == 200
+    assert res.text == '1'
+
+    with MonkeyPatch.context() as patch:
+        patch_session(patch, client)
+        remote = Repository('https://localhost/')
+        editor = Editor(MemoryRepository())
+        assert editor.copy_articles(remote.articles) == 2
+        assert editor.copy_titles(remote.titles) == 2
+        assert len(remote.titles.store) == 2
+        assert remote.titles.store[title.label.labelId] == title
+        keys = remote.articles.store.select_keys(
+            'path', encode_path(title.label.path), True)
+        assert keys is not None and list(keys) == [title.articleId]
+
+        remote = Repository(f'https://localhost/w/{path}')
+        assert list(remote.titles.get_titles()) == [title]
+        assert len(remote.titles.store) == 1
+
+
+@given(some_drafts(2))
+@settings(suppress_health_check=[HealthCheck.filter_too_much])
+def test_does_only_copy_missing(article_set: set[BaseArticle]):
+    articles = list(article_set)
+    article = articles[0]
+    title = articles[1]
+    viewer = get_memory_server()
+    viewer.repo.articles.merge_article(article)
+    viewer.repo.titles.set_title(article)
+    client = get_client(viewer)
+
+    with MonkeyPatch.context() as patch:
+        patch_session(patch, client)
+        remote = Repository('https://localhost/')
+        editor = Editor(MemoryRepository())
+        assert editor.copy_articles(remote.articles) == 1
+        assert editor.copy_titles(remote.titles) == 1
+
+        viewer.repo.articles.merge_article(title)
+        viewer.repo.titles.set_title(title)
+        assert editor.copy_articles(remote.articles) == 1
+        assert editor.copy_titles(remote.titles) == 1
+        assert editor.copy_articles(remote.articles) == 0
+        assert editor.copy_titles(remote.titles) == 0
+
+        subscription = Subscription(editor.repo.titles, remote.titles)
+        assert list(subscription.get_updates()) == []
+
+
+@given(some_drafts(3))
+@settings(suppress_health_check=[HealthCheck.filter_too_much])
+def test_does_sync_from_cursor(article_set: set[BaseArticle]):
+    articles = list(article_set)
+    viewer = get_memory_server()
+    for article in articles[0:2]:
+        viewer.repo.articles.merge_article(article)
+        viewer.repo.titles.set_title(article)
+    client = get_client(viewer)
+    url = 'https://localhost/'
+
+    with MonkeyPatch.context() as patch:
+        patch_session(patch, client)
+        local = MemoryRepository()
+        local.subs.add_url(url)
+        inbox = Inbox(local)
+        assert [report.count for report in inbox.load_inbox()] == [2]
+        cursor = viewer.repo.titles.get_version().count
+        assert cursor > 0
+        assert local.config.get_cursor(url) == cursor
+        assert local.config.get_cursor(url + 'w/') == 0
+
+        # Nothing is fetched again until the remote changes.
+        assert [report.count for report in inbox.load_inbox()] == [0]
+
+        viewer.repo.articles.merge_article(articles[2])
+        viewer.repo.titles.set_title(articles[2])
+        changes = Repository(url).get_title_changes(cursor)
+        assert changes.cursor == viewer.repo.titles.get_version().count
+        assert changes.labels == [str(articles[2].label.labelId)]
+        assert [report.count for report in inbox.load_inbox()] == [1]
+        assert Repository(url).get_title_changes(changes.cursor).labels == []
+
+
+class SlowAdapter(ClientAdapter):
+    # Answers after a delay, or fails like a socket would when the request's
+    # timeout runs out first.
+    def __init__(self, client: Client, delay: float) -> None:
+        super().__init__(client)
+        self.delay = delay
+
+    def send(self, request: PreparedRequest, **kwargs) -> Response:  # type: ignore
+        timeout = kwargs.get('timeout')
+        if (timeout is not None and timeout < self.delay):
+            time.sleep(timeout)
+            raise ReadTimeout(request=request)
+        time.sleep(self.delay)
+        return super().send(request, **kwargs)
+
+
+def test_does_time_out_fetches_when_they_start():
+    viewer = get_memory_server()
+    publish_title(viewer.repo, Article(SimpleLabel('hello'), '# Hello', None))
+    local = MemoryRepository()
+    for name in ['one', 'two', 'three', 'four']:
+        local.subs.add_url(f'https://{name}.localhost/')
+
+    with MonkeyPatch.context() as patch:
+        web = WebSession()
+        patch.setattr(session, 'shared', web)
+
+        # Two requests of 0.3s a fetch, on half as many workers as fetches.
+        web.session.mount('https://', SlowAdapter(get_client(viewer), 0.3))
+        reports = Inbox(local).load_inbox(workers=2, timeout=1.0)
+        assert [report.error for report in reports] == [None] * 4
+        assert [report.count for report in reports] == [1] * 4
+
+        # A hung wiki gives up at the deadline instead of holding a thread.
+        web.session.mount('https://', SlowAdapter(get_client(viewer), 10.0))
+        local = MemoryRepository()
+        local.subs.add_url('https://localhost/')
+        start = time.monotonic()
+        reports = Inbox(local).load_inbox(timeout=0.5)
+        assert [report.error for report in reports] == ['timed out after 0.5s']
+        assert time.monotonic() - start < 2.0
@@ -9,6 +9,8 @@ from linki.id import SimpleLabel
 @strategies.composite
 def a_label(draw: strategies.DrawFn):
     label = draw(strategies.text(alphabet=string.printable))
+    # A file repository keeps its own data in .linki
+    assume(SimpleLabel(label).name != '.linki')
     return SimpleLabel(label)
 
 
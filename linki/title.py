@@ -1,9 +1,15 @@
 import pickle
-from typing import Iterator
+from typing import Dict, Iterator, List, Tuple
+
+import msgspec
 from linki.article import BaseArticle
-from linki.connection import Connection
+from linki.config import ConfigCollection, Version
+from linki.connection import Columns, Connection, encode_path
 
-from linki.id import BaseLabel
+from linki.id import ID, BaseLabel
+from linki.journal import Journal
+from linki.links import LinkIndex
+from linki.search import SearchIndex
 
 
 def Title(
@@ -29,12 +35,55 @@ def Redirect(editOf: BaseArticle, redirect: BaseLabel) -> 'BaseArticle':
     )
 
 
+class TitleEntry(msgspec.Struct, frozen=True, kw_only=True):
+    label: BaseLabel
+    articleId: str
+
+
+def get_entry_columns(entry: TitleEntry) -> Columns:
+    return {
+        'label': str(entry.label.labelId),
+        'path': encode_path(entry.label.path),
+        'article': entry.articleId,
+    }
+
+
+class TitleChanges(msgspec.Struct, frozen=True):
+    # labels is None when the changes can't be listed and the titles have to
+    # be compared in full.
+    cursor: int
+    labels: list[str] | None = None
+
+
 class TitleCollection():
-    def __init__(self, connection: Connection[BaseArticle]) -> None:
+    def __init__(
+        self,
+        connection: Connection[BaseArticle],
+        labels: Connection[TitleEntry] | None = None,
+        config: ConfigCollection | None = None,
+        journal: Journal | None = None,
+        index: SearchIndex | None = None,
+        links: LinkIndex | None = None
+    ) -> None:
         self.store = connection
+        self.labels = labels
+        self.config = config
+        self.journal = journal
+        self.index = index
+        self.links = links
 
     def set_title(self, title: BaseArticle | BaseArticle) -> BaseArticle:
         self.store[title.label.labelId] = title
+        if (self.labels is not None):
+            self.labels[title.label.labelId] = TitleEntry(
+                label=title.label,
+                articleId=str(title.articleId)
+            )
+        if (self.index is not None):
+            self.index.index_title(title)
+        if (self.links is not None):
+            self.links.index_title(title)
+        self.bump_version(title.label.labelId)
         return title
 
     def get_title(self, title: BaseLabel) -> BaseArticle | None:
@@ -42,13 +91,148 @@ class TitleCollection():
             return None
         return self.store[title.labelId]
 
-    def get_titles(self) -> Iterator[BaseArticle]:
-        for item in self.store.values():
-            yield item
+    def get_titles(self, prefix: Tuple[str, ...] = ()) -> Iterator[BaseArticle]:
+        if (len(prefix) == 0):
+            for item in self.store.values():
+                yield item
+            return
+
+        items = self.store.select('path', encode_path(prefix), prefix=True)
+        if (items is not None):
+            for (_, item) in items:
+                yield item
+            return
+
+        for entry in self.get_entries(prefix):
+            item = self.store.get(entry.label.labelId)
+            if (item is not None):
+                yield item
+
+    def get_entries(self, prefix: Tuple[str, ...] = ()) -> Iterator[TitleEntry]:
+        if (self.labels is None):
+            for item in self.store.values():
+                if (item.label.path[:len(prefix)] == prefix):
+                    yield TitleEntry(label=item.label, articleId=str(item.articleId))
+            return
+
+        if (not self.is_labelled()):
+            self.reindex()
+        if (len(prefix) > 0):
+            entries = self.labels.select('path', encode_path(prefix), prefix=True)
+            if (entries is not None):
+                for (_, entry) in entries:
+                    yield entry
+                return
+        for entry in self.labels.values():
+            if (entry.label.path[:len(prefix)] == prefix):
+                yield entry
+
+    def get_count(self, prefix: Tuple[str, ...] = ()) -> int:
+        if (len(prefix) == 0):
+            return len(self.store)
+        keys = self.store.select_keys('path', encode_path(prefix), prefix=True)
+        if (keys is not None):
+            return sum(1 for _ in keys)
+        return sum(1 for _ in self.get_entries(prefix))
+
+    def search(self, query: str, limit: int = 20) -> List[TitleEntry]:
+        if (self.index is None):
+            return []
+        if (not self.index.is_indexed()):
+            self.index.reindex(self.store.values())
+        return self.get_entries_by_id(self.index.search(query, limit))
+
+    def get_backlinks(self, labelId: ID) -> List[TitleEntry]:
+        if (self.links is None):
+            return []
+        if (not self.links.is_indexed()):
+            self.links.reindex(self.store.values())
+        return self.get_entries_by_id(self.links.get_backlinks(labelId))
+
+    def get_entries_by_id(self, labelIds: List[ID]) -> List[TitleEntry]:
+        if (self.labels is not None):
+            if (not self.is_labelled()):
+                self.reindex()
+            entries = dict(self.labels.get_many(labelIds))
+        else:
+            entries = {
+                labelId: TitleEntry(label=item.label, articleId=str(item.articleId))
+                for (labelId, item) in self.store.get_many(labelIds)
+            }
+        return [entries[labelId] for labelId in labelIds if labelId in entries]
+
+    def get_labels(self) -> Iterator[BaseLabel]:
+        for entry in self.get_entries():
+            yield entry.label
+
+    def get_versions(self, prefix: Tuple[str, ...] = ()) -> Dict[ID, str]:
+        return {
+            entry.label.labelId: entry.articleId
+            for entry in self.get_entries(prefix)
+        }
+
+    def is_labelled(self) -> bool:
+        # Remote collections are kept labelled by their server.
+        if (self.config is None):
+            return True
+        return self.config.has_label_index()
+
+    def reindex(self) -> None:
+        if (self.labels is None):
+            return
+        entries = {
+            item.label.labelId: TitleEntry(
+                label=item.label,
+                articleId=str(item.articleId)
+            )
+            for item in self.store.values()
+        }
+        # Titles set while this runs already have their entry, so only
+        # entries for titles that are gone are dropped.
+        for labelId in list(self.labels):
+            if (labelId not in entries and labelId not in self.store):
+                del self.labels[labelId]
+        for (labelId, entry) in entries.items():
+            self.labels[labelId] = entry
+        if (self.config is not None):
+            self.config.set_label_index(True)
 
     def clear_title(self, title: BaseLabel) -> None:
         if (title.labelId in self.store):
             del self.store[title.labelId]
+        if (self.labels is not None and title.labelId in self.labels):
+            del self.labels[title.labelId]
+        if (self.index is not None):
+            self.index.remove_title(title.labelId)
+        if (self.links is not None):
+            self.links.remove_title(title.labelId)
+        self.bump_version(title.labelId)
+
+    def bump_version(self, labelId: ID):
+        if (self.config is None):
+            return
+        self.config.bump_version('titles')
+
+    def get_version(self) -> Version:
+        # Counted by the journal, whose sequence numbers are handed out under
+        # a lock, so writers in different processes never share one. The
+        # count in the config only dates it.
+        if (self.config is None):
+            return Version()
+        version = self.config.get_version('titles')
+        if (self.journal is None):
+            return version
+        return Version(self.journal.last('titles'), version.modified)
+
+    def get_changes(self, cursor: int) -> TitleChanges:
+        version = self.get_version()
+        if (self.journal is None or cursor <= 0 or cursor > version.count):
+            return TitleChanges(version.count)
+        labels = [
+            entry.key for entry in self.journal.tail(cursor)
+            if entry.style == 'titles'
+        ]
+        return TitleChanges(version.count, list(dict.fromkeys(labels)))
 
     @classmethod
     def fromStream(cls, stream: bytes):
@@ -0,0 +1,171 @@
+import os
+from pathlib import Path
+import pickle
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from linki.connection import VT, Connection, fsync_path
+from linki.id import ID
+from linki.journal import Journal, JournalEntry
+
+Write = Tuple[bool, Any]
+
+
+class TransactionJournal(Journal):
+    # Entries are numbered after the real journal, but only appended to it
+    # once the transaction commits.
+    def __init__(self, journal: Journal | None) -> None:
+        super().__init__()
+        self.journal = journal
+
+    @property
+    def sequence(self) -> int:
+        base = 0 if self.journal is None else self.journal.sequence
+        return base + len(self.entries)
+
+    def append(self, style: str, key: ID, deleted: bool = False) -> JournalEntry:
+        entry = JournalEntry(self.sequence + 1, style, str(key), deleted)
+        self.entries.append(entry)
+        return entry
+
+    def tail(self, after: int = 0) -> Iterator[JournalEntry]:
+        if (self.journal is not None):
+            yield from self.journal.tail(after)
+        yield from super().tail(after)
+
+    def last(self, style: str) -> int:
+        sequence = super().last(style)
+        if (sequence == 0 and self.journal is not None):
+            return self.journal.last(style)
+        return sequence
+
+
+class Transaction():
+    def __init__(self, journal: Journal | None = None) -> None:
+        # (style, key) -> (deleted, value)
+        self.writes: Dict[Tuple[str, ID], Write] = dict()
+        self.journal = TransactionJournal(journal)
+        # Stores opened while the transaction is active, by style, so each
+        # is only opened once and synced once when it commits.
+        self.stores: Dict[str, Connection] = dict()
+
+    def get_writes(self, style: str) -> Iterator[Tuple[ID, Write]]:
+        for ((write_style, key), write) in self.writes.items():
+            if (write_style == style):
+                yield (key, write)
+
+    def save(self, path: Path):
+        # Written next to the target and renamed over it, so a crash leaves
+        # either the whole transaction or none of it.
+        temporary = path.with_name(f'{path.name}.tmp')
+        entries = [
+            (entry.style, entry.key, entry.deleted)
+            for entry in self.journal.entries
+        ]
+        with temporary.open('wb') as stream:
+            pickle.dump((self.writes, entries), stream)
+            stream.flush()
+            os.fsync(stream.fileno())
+        temporary.replace(path)
+        fsync_path(path.parent)
+
+    @classmethod
+    def load(cls, path: Path) -> 'Transaction | None':
+        try:
+            with path.open('rb') as stream:
+                (writes, entries) = pickle.load(stream)
+        except (EOFError, pickle.UnpicklingError):
+            return None
+        transaction = cls()
+        transaction.writes = writes
+        for (style, key, deleted) in entries:
+            transaction.journal.append(style, key, deleted)
+        return transaction
+
+
+class TransactionConnection(Connection[VT]):
+    def __init__(self, store: Connection[VT], transaction: Transaction, style: str) -> None:
+        self.store = store
+        self.transaction = transaction
+        self.style = style
+
+    def __setitem__(self, __key: ID, __value: VT) -> None:
+        self.transaction.writes[(self.style, __key)] = (False, __value)
+
+    def __delitem__(self, __key: ID) -> None:
+        if (not self.__contains__(__key)):
+            raise KeyError
+        self.transaction.writes[(self.style, __key)] = (True, None)
+
+    def __getitem__(self, __key: ID) -> VT:
+        write = self.transaction.writes.get((self.style, __key))
+        if (write is None):
+            return self.store[__key]
+        (deleted, value) = write
+        if (deleted):
+            raise KeyError
+        return value
+
+    def __contains__(self, __key: object) -> bool:
+        write = self.transaction.writes.get((self.style, __key))  # type: ignore
+        if (write is None):
+            return self.store.__contains__(__key)
+        return not write[0]
+
+    def __iter__(self) -> Iterator[ID]:
+        writes = dict(self.transaction.get_writes(self.style))
+        for key in self.store:
+            if (key not in writes):
+                yield key
+        for (key, (deleted, _)) in writes.items():
+            if (not deleted):
+                yield key
+
+    def __len__(self) -> int:
+        count = self.store.__len__()
+        for (key, (deleted, _)) in self.transaction.get_writes(self.style):
+            stored = self.store.__contains__(key)
+            if (deleted and stored):
+                count -= 1
+            elif (not deleted and not stored):
+                count += 1
+        return count
+
+    def items(self) -> Iterator[Tuple[ID, VT]]:  # type: ignore
+        writes = dict(self.transaction.get_writes(self.style))
+        for (key, value) in self.store.items():
+            if (key not in writes):
+                yield (key, value)
+        for (key, (deleted, value)) in writes.items():
+            if (not deleted):
+                yield (key, value)
+
+    def values(self) -> Iterator[VT]:  # type: ignore
+        for (_, value) in self.items():
+            yield value
+
+    def get_many(self, keys: Iterable[ID]) -> Iterator[Tuple[ID, VT]]:
+        stored: List[ID] = []
+        for key in keys:
+            write = self.transaction.writes.get((self.style, key))
+            if (write is None):
+                stored.append(key)
+            elif (not write[0]):
+                yield (key, write[1])
+        yield from self.store.get_many(stored)
+
+    def has_writes(self) -> bool:
+        for _ in self.transaction.get_writes(self.style):
+            return True
+        return False
+
+    # Pending writes aren't indexed, so selections are only answered from
+    # the store while there are none for this style.
+    def select_keys(self, column: str, value: str, prefix: bool = False) -> Iterator[ID] | None:
+        if (self.has_writes()):
+            return None
+        return self.store.select_keys(column, value, prefix)
+
+    def select(self, column: str, value: str, prefix: bool = False) -> Iterator[Tuple[ID, VT]] | None:
+        if (self.has_writes()):
+            return None
+        return self.store.select(column, value, prefix)
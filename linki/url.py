@@ -10,6 +10,7 @@ from linki.id import LabelID, SimpleLabel
 
 @dataclass
 class URL():
+    url: str
     valid_schemes = ['file', 'https']
 
     def __init__(self, url: str) -> None:
@@ -23,7 +24,10 @@ class URL():
             valid_schemes = ', '.join(self.valid_schemes)
             raise ValueError(
                 f'Invalid URL. Must be one of these schemes: {valid_schemes}')
+        self.__post_init__()
 
+    def __post_init__(self) -> None:
+        # Also called when a stored URL is decoded, which skips __init__.
         self.parsed = urlparse(self.url)
         self.labelId = SimpleLabel(self.url).labelId
 
@@ -1,13 +1,22 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
 from io import BytesIO
+import os
 from pathlib import Path
+from queue import Queue
+import subprocess
+from typing import Dict, Iterable, Iterator
+import zlib
 import msgspec
 
 import pypandoc
 from linki.article import BaseArticle
 from linki.change import Change
+from linki.connection import Codec, PathConnection, decode_stream, encode_frame
 from linki.editor import Copier, Editor
-from linki.id import ID, Label, LabelID
-from linki.repository import Repository, TemporaryRepository
+from linki.id import ID, BaseLabel, Label, LabelID
+from linki.repository import FileRepository, Repository, TemporaryRepository
 from dataclasses import dataclass
 import bottle
 
@@ -24,46 +33,270 @@ class WebViewConf:
     home: str | None = None
 
 
+class RenderCache():
+    # ArticleIDs are content hashes, so a rendered article never goes stale.
+    def __init__(
+        self,
+        store: PathConnection[str] | None = None,
+        size: int = 1024,
+        disk_size: int = 65536
+    ) -> None:
+        self.store = store
+        self.size = size
+        self.disk_size = disk_size
+        self.memory: OrderedDict[ID, str] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_count = 0
+        if (self.store is not None):
+            self.disk_count = len(self.store)
+
+    @classmethod
+    def fromRepository(cls, repo: Repository, size: int = 1024, disk_size: int = 65536):
+        if (not isinstance(repo, FileRepository)):
+            return cls(None, size, disk_size)
+        path = repo.path.joinpath('.linki', 'renders')
+        path.mkdir(exist_ok=True)
+        return cls(PathConnection[str](path, Codec(str)), size, disk_size)
+
+    def get(self, article_id: ID) -> str | None:
+        web_content = self.memory.get(article_id)
+        if (web_content is not None):
+            self.memory.move_to_end(article_id)
+            self.hits += 1
+            return web_content
+
+        if (self.store is None or article_id not in self.store):
+            self.misses += 1
+            return None
+
+        web_content = self.store[article_id]
+        os.utime(self.store.store.joinpath(article_id))
+        self.hits += 1
+        self.remember(article_id, web_content)
+        return web_content
+
+    def put(self, article_id: ID, web_content: str):
+        self.remember(article_id, web_content)
+        self.save(article_id, web_content)
+
+    def remember(self, article_id: ID, web_content: str):
+        self.memory[article_id] = web_content
+        if (len(self.memory) > self.size):
+            self.memory.popitem(last=False)
+
+    def save(self, article_id: ID, web_content: str):
+        if (self.store is None):
+            return
+        self.store[article_id] = web_content
+        self.disk_count += 1
+        if (self.disk_count <= self.disk_size):
+            return
+
+        # Drop the least recently used tenth of the disk cache.
+        renders = sorted(
+            self.store.store.iterdir(),
+            key=lambda render: render.stat().st_mtime_ns
+        )
+        for render in renders[:max(1, len(renders) // 10)]:
+            render.unlink(missing_ok=True)
+        self.disk_count = len(self.store)
+
+
+class PandocWorker():
+    # A pandoc process kept running between conversions. It reads markdown
+    # as one JSON string per line, and answers each with a line of the html
+    # `pandoc -f markdown -t html` would have written.
+    script = (
+        "for line in io.lines() do "
+        "local document = pandoc.read(pandoc.json.decode(line), 'markdown') "
+        "io.write(pandoc.json.encode(pandoc.write(document, 'html') .. '\\n'), '\\n') "
+        "io.stdout:flush() "
+        "end"
+    )
+
+    def __init__(self) -> None:
+        self.process: subprocess.Popen[str] | None = None
+        # Cleared when this pandoc can't run the script, which needs 3.1.1
+        # or newer, and then every document gets a pandoc of its own.
+        self.supported = True
+
+    def convert(self, content: str) -> str:
+        if (self.supported):
+            started = self.process is None
+            web_content = self.send(content)
+            if (web_content is not None):
+                return web_content
+            self.stop()
+            self.supported = not started
+        return Renderer.convert(content)
+
+    def start(self) -> subprocess.Popen[str] | None:
+        try:
+            return subprocess.Popen(
+                [pypandoc.get_pandoc_path(), 'lua', '-e', self.script],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                encoding='utf-8'
+            )
+        except OSError:
+            return None
+
+    def send(self, content: str) -> str | None:
+        if (self.process is None):
+            self.process = self.start()
+        if (self.process is None or self.process.stdin is None or self.process.stdout is None):
+            return None
+        try:
+            # The pandoc command drops carriage returns and expands tabs
+            # before reading, and pandoc.read leaves that to its caller.
+            text = content.replace('\r', '').expandtabs(4)
+            self.process.stdin.write(msgspec.json.encode(text).decode() + '\n')
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except OSError:
+            return None
+        if (not line):
+            return None
+        return msgspec.json.decode(line, type=str)
+
+    def __del__(self):
+        # pandoc exits once its input is closed.
+        self.stop()
+
+    def stop(self):
+        if (self.process is None):
+            return
+        (process, self.process) = (self.process, None)
+        if (process.stdin is not None):
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+        try:
+            process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        if (process.stdout is not None):
+            process.stdout.close()
+
+
+class Renderer():
+    # Articles are converted by pandoc processes that are kept running, at
+    # most one per worker. Single pages are converted on the calling thread,
+    # and the pool lets batches use every worker at once.
+    def __init__(self, cache: RenderCache | None = None, workers: int | None = None) -> None:
+        self.cache = RenderCache() if cache is None else cache
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.idle: Queue[PandocWorker] = Queue()
+        for _ in range(self.workers):
+            self.idle.put(PandocWorker())
+
+    @staticmethod
+    def convert(content: str) -> str:
+        return pypandoc.convert_text(content, format='markdown', to='html')
+
+    def run(self, content: str) -> str:
+        worker = self.idle.get()
+        try:
+            return worker.convert(content)
+        finally:
+            self.idle.put(worker)
+
+    def render(self, article: BaseArticle) -> str:
+        web_content = self.cache.get(article.articleId)
+        if (web_content is None):
+            web_content = self.run(article.content)
+            self.cache.put(article.articleId, web_content)
+        return web_content
+
+    def render_many(self, articles: Iterable[BaseArticle]) -> Dict[ID, str]:
+        rendered: Dict[ID, str] = dict()
+        missing: Dict[ID, str] = dict()
+        for article in articles:
+            web_content = self.cache.get(article.articleId)
+            if (web_content is None):
+                missing[article.articleId] = article.content
+            else:
+                rendered[article.articleId] = web_content
+
+        results = self.pool.map(self.run, missing.values())
+        for (article_id, web_content) in zip(missing, results):
+            self.cache.put(article_id, web_content)
+            rendered[article_id] = web_content
+        return rendered
+
+    def prewarm(self, articles: Iterable[BaseArticle], batch_size: int = 256) -> int:
+        misses = self.cache.misses
+        batch = []
+        for article in articles:
+            batch.append(article)
+            if (len(batch) >= batch_size):
+                self.render_many(batch)
+                batch = []
+        self.render_many(batch)
+        return self.cache.misses - misses
+
+    def close(self):
+        self.pool.shutdown()
+        for _ in range(self.workers):
+            self.idle.get().stop()
+
+
+class ListedArticle(msgspec.Struct, frozen=True, kw_only=True):
+    label: BaseLabel
+    web_id: str
+
+    @classmethod
+    def list(cls, repo: Repository, collection_type: str):
+        match collection_type:
+            case 'articles':
+                # Only the labels are needed, so skip rebuilding the articles.
+                store = repo.connection.get_style('articles')
+                return [
+                    cls(label=record.label, web_id=str(article_id))
+                    for (article_id, record) in store.items()
+                ]
+            case 'titles':
+                return [
+                    cls(label=label, web_id='/'.join(label.path))
+                    for label in repo.titles.get_labels()
+                ]
+
+
 class RenderedArticle(BaseArticle, frozen=True):
     web_content: str
     web_id: str
 
     @classmethod
-    def fromArticle(cls, article: BaseArticle, label: str):
+    def fromArticle(cls, article: BaseArticle, label: str, renderer: Renderer | None = None):
         # if(article.redirect is None):
-        raw = article.content
         # raw = pypandoc.convert_text(
         # article.content, format='markdown', to='markdown')
-        web_content = pypandoc.convert_text(
-            article.content, format='markdown', to='html')
+        if (renderer is None):
+            web_content = Renderer.convert(article.content)
+        else:
+            web_content = renderer.render(article)
         # TODO Write redirect test for /w/
         # if (article.redirect is not None):
         #   redirect = f"0; URL='/w/{article.redirect.labelId}'"
         #   content = f'<meta http-equiv="refresh" content="{redirect}"/>'
 
+        return cls.fromRendered(article, label, web_content)
+
+    @classmethod
+    def fromRendered(cls, article: BaseArticle, label: str, web_content: str):
         return cls(
             label=article.label,
             web_content=web_content,
-            content=raw,
+            content=article.content,
             editOf=article.editOf,
             web_id=label
         )
 
-    @classmethod
-    def render(cls, collection: list[BaseArticle], collection_type: str):
-        match collection_type:
-            case 'articles':
-                return {
-                    cls.fromArticle(article, str(article.articleId))
-                    for article in collection
-                }
-            case 'titles':
-                return {
-                    cls.fromArticle(
-                        article, '/'.join(article.label.path))
-                    for article in collection
-                }
-
 
 class WebView:
     styles = ['titles', 'articles']
@@ -77,10 +310,21 @@ class WebView:
             self.app.route('/api/me', 'GET', self.handle_get_me)
             self.app.route('/api/contribute', 'POST', self.handle_contribution)
         self.app.route('/', 'GET', self.handle_home)
+        self.app.route('/copy/stream/<collection_type>',
+                       ['GET', 'POST'], self.handle_stream)
+        self.app.route('/copy/ids/<collection_type>',
+                       'GET', self.handle_ids)
+        self.app.route('/copy/since/<collection_type>',
+                       'GET', self.handle_since)
+        self.app.route('/copy/journal/', 'GET', self.handle_journal)
         self.app.route('/<style>/titles/',
                        'GET', self.handle_many_titles)
         self.app.route('/<style>/articles/',
                        'GET', self.handle_many_articles)
+        self.app.route(['/<style>/search', '/<style>/search/'],
+                       'GET', self.handle_search)
+        self.app.route('/api/backlinks/<label:path>',
+                       'GET', self.handle_backlinks)
         self.app.route('/<style>/<label:path>',
                        'GET', self.handle_single_article)
         if (self.conf.web):
@@ -95,6 +339,8 @@ class WebView:
 
             self.one_tmpl.prepare()
             self.many_tmpl.prepare()
+            self.renders = RenderCache.fromRepository(self.repo)
+            self.renderer = Renderer(self.renders)
 
     def handle_home(self):
         if (self.conf.home is not None):
@@ -119,6 +365,69 @@ class WebView:
     def convert_path(self, label: str):
         return Label(label.split('/')).labelId
 
+    def check_cache(
+        self,
+        etag: str,
+        modified: float | None = None,
+        immutable: bool = False
+    ):
+        # Raises a 304 when the client already holds this representation,
+        # otherwise sets the validators on the outgoing response.
+        headers = {'ETag': f'"{etag}"'}
+        if (immutable):
+            headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            headers['Cache-Control'] = 'no-cache'
+        if (modified is not None and modified > 0):
+            headers['Last-Modified'] = formatdate(modified, usegmt=True)
+
+        not_modified = False
+        if_none_match = bottle.request.get_header('If-None-Match')
+        if_modified_since = bottle.request.get_header('If-Modified-Since')
+        if (if_none_match is not None):
+            tags = [tag.strip().removeprefix('W/')
+                    for tag in if_none_match.split(',')]
+            not_modified = ('*' in tags) or (headers['ETag'] in tags)
+        elif (if_modified_since is not None and 'Last-Modified' in headers):
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+                not_modified = int(modified or 0) <= since
+            except (TypeError, ValueError):
+                not_modified = False
+
+        if (not_modified):
+            raise bottle.HTTPResponse(status=304, headers=headers)
+        for (name, value) in headers.items():
+            bottle.response.set_header(name, value)
+
+    def compress(self, chunks: Iterable[bytes]) -> Iterable[bytes]:
+        bottle.response.add_header('Vary', 'Accept-Encoding')
+        accepts = bottle.request.get_header('Accept-Encoding', '')
+        if ('gzip' not in accepts):
+            return chunks
+        bottle.response.set_header('Content-Encoding', 'gzip')
+        return self.gzip(chunks)
+
+    @staticmethod
+    def gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+        compressor = zlib.compressobj(wbits=31)
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if (compressed):
+                yield compressed
+        yield compressor.flush()
+
+    def check_collection_cache(self, collection_type: str, *parts: str):
+        match collection_type:
+            case 'titles' | 'labels':
+                version = self.repo.titles.get_version()
+                etag = '-'.join(['titles', str(version.count), *parts])
+                self.check_cache(etag, version.modified)
+            case 'articles':
+                # Articles are only ever added, so the count is a version.
+                count = self.repo.get_count('articles')
+                self.check_cache('-'.join(['articles', str(count), *parts]))
+
     def handle_single_article(self, style: str, label: str):
         self.confirm_support(style)
         if (not LabelID.isValidID(label)):
@@ -129,10 +438,20 @@ class WebView:
             error = bottle.HTTPError(404, f'item not found: {label}')
 
         item = self.repo.titles.store.get(item_id, None)
-        if (item is None):
+        backlinks = None
+        if (item is not None):
+            version = self.repo.titles.get_version()
+            etag = str(item.articleId)
+            if (style == 'w'):
+                # The page lists its backlinks, which change with other titles.
+                etag = f'{etag}-{version.count}'
+                backlinks = self.list_backlinks(item_id)
+            self.check_cache(etag, version.modified)
+        else:
             item = self.repo.articles.store.get(item_id, None)
-        if (item is None):
-            return error
+            if (item is None):
+                return error
+            self.check_cache(str(item.articleId), immutable=True)
 
         match style:
             case 'copy':
@@ -140,8 +459,12 @@ class WebView:
             case 'api':
                 return msgspec.to_builtins(item)
             case 'w':
-                web_item = RenderedArticle.fromArticle(item, label)
-                return self.one_tmpl.render({'item': web_item})
+                web_item = RenderedArticle.fromArticle(
+                    item, label, self.renderer)
+                return self.one_tmpl.render({
+                    'item': web_item,
+                    'backlinks': backlinks or []
+                })
 
     def handle_many_titles(self, style: str):
         return self.handle_many(style, 'titles')
@@ -151,22 +474,151 @@ class WebView:
 
     def handle_many(self, style: str, collection_type: str):
         self.confirm_support(style)
-        collection = self.repo.get_collection(collection_type)
+        prefix = self.get_prefix()
+        self.check_collection_cache(collection_type, style, *prefix)
         match style:
             case 'copy':
-                return msgspec.msgpack.encode(collection)
+                connection = self.repo.get_connection(collection_type)
+                bottle.response.content_type = 'application/octet-stream'
+                return self.compress(connection.iter_stream())
             case 'api':
+                collection = self.repo.get_collection(collection_type)
                 return {collection_type: [msgspec.to_builtins(item) for item in collection]}
             case 'count':
-                return f"{self.repo.get_count(collection_type)}"
+                return f"{self.repo.get_count(collection_type, prefix)}"
             case 'w':
-                items = RenderedArticle.render(collection, collection_type)
+                items = ListedArticle.list(self.repo, collection_type)
                 return self.many_tmpl.render({
                     'items': items,
                     'style': collection_type.capitalize(),
                     'style_root': f"/w/"
                 })
 
+    def handle_search(self, style: str):
+        self.confirm_support(style)
+        query = bottle.request.query.getunicode('q', default='')  # type: ignore
+        items = [
+            ListedArticle(label=entry.label, web_id='/'.join(entry.label.path))
+            for entry in self.repo.titles.search(query)
+        ]
+        match style:
+            case 'api':
+                return {
+                    'query': query,
+                    'results': [msgspec.to_builtins(item) for item in items]
+                }
+            case 'w':
+                return self.many_tmpl.render({
+                    'items': items,
+                    'style': 'Search',
+                    'style_root': f"/w/",
+                    'query': query
+                })
+            case _:
+                return bottle.HTTPError(404, f'{style} search not found.')
+
+    def list_backlinks(self, labelId: ID) -> list[ListedArticle]:
+        return [
+            ListedArticle(label=entry.label, web_id='/'.join(entry.label.path))
+            for entry in self.repo.titles.get_backlinks(labelId)
+        ]
+
+    def handle_backlinks(self, label: str):
+        self.confirm_support('api')
+        if (LabelID.isValidID(label)):
+            labelId = ID(label)
+        else:
+            labelId = self.convert_path(label)
+        self.check_collection_cache('titles', 'backlinks', labelId)
+        return {
+            'label': str(labelId),
+            'backlinks': [
+                msgspec.to_builtins(item) for item in self.list_backlinks(labelId)
+            ]
+        }
+
+    def get_prefix(self) -> tuple[str, ...]:
+        prefix = bottle.request.query.get('prefix', '')  # type: ignore
+        return tuple(crumb for crumb in prefix.split('/') if crumb)
+
+    def handle_ids(self, collection_type: str):
+        self.confirm_support('copy')
+        prefix = self.get_prefix()
+        self.check_collection_cache(collection_type, 'ids', *prefix)
+        match collection_type:
+            case 'titles' | 'labels':
+                ids = [
+                    str(entry.label.labelId)
+                    for entry in self.repo.titles.get_entries(prefix)
+                ]
+            case 'articles':
+                ids = [str(articleId)
+                       for articleId in self.repo.articles.get_ids(prefix)]
+            case _:
+                return bottle.HTTPError(404, f'{collection_type} not found.')
+
+        bottle.response.content_type = 'application/octet-stream'
+        return self.compress([msgspec.msgpack.encode(ids)])
+
+    def handle_since(self, collection_type: str):
+        self.confirm_support('copy')
+        if (collection_type != 'titles'):
+            return bottle.HTTPError(404, f'{collection_type} not found.')
+        cursor = bottle.request.query.get('cursor', '0')  # type: ignore
+        if (not cursor.isdigit()):
+            return bottle.HTTPError(400, f'Invalid cursor: {cursor}')
+        self.check_collection_cache(collection_type, 'since', cursor)
+
+        bottle.response.content_type = 'application/octet-stream'
+        return msgspec.msgpack.encode(self.repo.titles.get_changes(int(cursor)))
+
+    def handle_journal(self):
+        self.confirm_support('copy')
+        journal = self.repo.journal
+        if (journal is None):
+            return bottle.HTTPError(404, 'journal not found.')
+        after = bottle.request.query.get('after', '0')  # type: ignore
+        if (not after.isdigit()):
+            return bottle.HTTPError(400, f'Invalid sequence: {after}')
+
+        bottle.response.content_type = 'application/octet-stream'
+        return self.compress(
+            encode_frame(entry) for entry in journal.tail(int(after)))
+
+    def handle_stream(self, collection_type: str):
+        self.confirm_support('copy')
+        prefix = self.get_prefix()
+        wants = None
+        if (bottle.request.method == 'POST'):
+            body = bottle.request.body.read()  # type: ignore
+            wants = [ID(want) for want in msgspec.msgpack.decode(
+                body, type=list[str])]
+        else:
+            self.check_collection_cache(
+                collection_type, 'stream', collection_type, *prefix)
+
+        titles = self.repo.titles
+        match collection_type:
+            case 'titles' if wants is not None:
+                collection = (item for (_, item) in titles.store.get_many(wants))
+            case 'titles':
+                collection = titles.get_titles(prefix)
+            case 'articles' if wants is not None:
+                articles = self.repo.articles.store
+                collection = (item for (_, item) in articles.get_many(wants))
+            case 'articles':
+                collection = self.repo.articles.get_articles(prefix)
+            case 'labels' if wants is not None and titles.labels is not None:
+                collection = (
+                    item for (_, item) in titles.labels.get_many(wants))
+            case 'labels':
+                collection = titles.get_entries(prefix)
+            case _:
+                return bottle.HTTPError(404, f'{collection_type} not found.')
+
+        bottle.response.content_type = 'application/octet-stream'
+        return self.compress(encode_frame(item) for item in collection)
+
     def handle_contribution(self):
         (username, password) = bottle.request.auth or (None, None)
         if (
@@ -185,10 +637,10 @@ class WebView:
 
         b_changes: BytesIO = c_changes.file
 
-        r_changes = msgspec.msgpack.decode(
-            b_changes.read(), type=list[BaseArticle])
         can_edit = False
-        for change in r_changes:
+        articleIds = []
+        for change in decode_stream(b_changes, BaseArticle):
+            articleIds.append(change.articleId)
             new_change = Change(
                 source=username,
                 article=change
@@ -201,7 +653,7 @@ class WebView:
                 pass
             else:
                 self.repo.changes.add_change(new_change)
-        title_text = ','.join([title.articleId for title in r_changes])
+        title_text = ','.join(articleIds)
         if (can_edit):
             return bottle.HTTPResponse(f'/w/titles/{title_text}', 201)
         return bottle.HTTPResponse(f'/w/contributions/{title_text}', 202)